@@ -1,21 +1,55 @@
 import streamlit as st
 import os
-import shutil
-import subprocess
-import sys
-import time
-import pandas as pd
+import functools
 from datetime import datetime
+from file_catalog import (archived_months, archived_page, catalog_add, catalog_count, catalog_files,
+                          catalog_is_stale, catalog_page_at, reconcile_catalog)
+from file_scanner import forget_scan_cache, scan_files, scan_folders
+from file_download import deferred_file, deferred_member
+from employee_directory import employee_index, is_admin, read_employee_list
+from blob_store import store_upload
+from replication import enqueue_replication, replication_states, start_replication_workers
+from upload_io import upload_token
+from file_server import EXPORT_PATH, FILE_SERVER_PORT, FILE_SERVER_URL, serve_folder
+from bulk_download import export_name, register_export
+from workbook_jobs import check_job, convert_job, job_result, wait_job, warm_pool
+from batch_upload import SUMMARY_COLUMNS, batch_status, expand_uploads, start_batch
+from workbook_validation import WorkbookError
+from stage_timing import (METRICS_FILE, METRICS_INTERVAL, current_tab, finish_rerun, set_tab, span,
+                          stage_summary, start_metrics_writer, start_rerun)
+from rerun_profiler import PROFILE_DIR, finish_profile, profiled_employees, set_profiled, start_profile
+from prewarm import prewarm
 #nothing shows in the app...these just load libraries
 
 #streamlit --> makes the web app UI
 #os --> interact with files/folders
-#shutil --> copy/move files
-#subprocess --> run external commands
-#sys --> get Python executable
-#time --> add delays
-#pandas --> handle Excel files
+#functools --> functools.partial: a function with some arguments already filled in
 #datetime --> format timestamps
+#file_catalog --> our SQLite list of uploaded files (so the log doesn't walk the NAS every click)
+#file_scanner --> folder scanner that only re-reads folders that changed
+#file_download --> download buttons that read the file (or one file inside an archive zip) only when clicked
+#employee_directory --> reads the employee Excel (with pandas) once and keeps it in memory
+#blob_store --> saves each distinct file once and links every folder copy to it
+#replication --> makes the Spotfire / Downloads copies in the background, retrying if the NAS hiccups
+#upload_io --> upload_token: fingerprint of an uploaded file, to avoid saving it twice
+#file_server --> small built-in web server that shares a folder over http
+#bulk_download --> "Download selected": many files as one zip, streamed by the file server
+#workbook_jobs --> runs the heavy Excel work (checking, converting) in separate worker processes
+#batch_upload --> batch mode: many files (or a .zip) uploaded at once, a few processed at a time
+#workbook_validation --> the error raised when an uploaded Excel breaks the rules for its test
+#stage_timing --> stopwatch for each step of a page refresh (what is slow, on which tab)
+#rerun_profiler --> records where the time goes inside a whole page refresh, for chosen users
+#prewarm --> does slow first-time work (loading pandas, the employee Excel...) in the background
+
+start_rerun()
+start_metrics_writer()
+#start_rerun starts the stopwatch for this refresh of the page
+#start_metrics_writer starts (once) a background thread that writes all timings every 15 s to
+#stage_metrics.prom (or the file in RE_PN_LAB_METRICS_FILE), for Prometheus / monitoring to read
+
+start_profile(st.session_state.get("employee_id"))
+#If this user is being profiled (RE_PN_LAB_PROFILE_EMPLOYEES or the admin "🔬 Profiler" panel),
+#the profiler starts here and runs until the end of the page; nobody else is slowed down
 
 # === Auto-start file server (optional) ===
 def start_file_server():
@@ -23,22 +57,19 @@ def start_file_server():
     try:
         folder_to_serve = r"C:\PN-RE-LAB"
         #sets the folder "C:\PN-RE-LAB" as the one that will be shared via the mini web server.
-        port = 8502
-        #chooses port 8502 for the local server
+        serve_folder(folder_to_serve, FILE_SERVER_PORT)
+        #starts a mini web server inside this app that serves files from C:\PN-RE-LAB
+        #FILE_SERVER_PORT = 8502 (or the RE_PN_LAB_FILE_SERVER_PORT environment variable)
         #so the server will run at "http://localhost:8502" (or "http://<yourPC>:8502" on LAN)
-        command = [sys.executable, "-m", "http.server", str(port), "--directory", folder_to_serve]
-        #builds a command to start a built-in Python HTTP server:
-        #sys.executable --> runs your current Python interpreter
-        #-m http.server --> starts Python's mini web server
-        #str(port) --> runs on port 8502
-        #--directory folder_to_serve --> serves files from C:\PN-RE-LAB
-        subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        #runs the command in the background (so it doesn't block Streamlit)
-        #stdout=subprocess.DEVNULL --> hides normal messages
-        #stderr=subprocess.DEVNULL --> hides error messages
-        #so the user won't see any output here
-        time.sleep(1)
-        #waits 1 second to give the server time to start before the rest of the Streamlit app runs
+        #it runs in a background thread (so it doesn't block Streamlit) and is started only ONCE:
+        #Streamlit re-runs this file on every click, and each later call just finds the server
+        #already running and returns at once (no new process, no waiting)
+        #it can resume interrupted downloads (HTTP Range), tells the browser when its cached
+        #copy is still good (ETag / Last-Modified -> "304 Not Modified"), sends files straight
+        #from disk to the network (sendfile) and keeps connections open between requests
+        #scripts / Spotfire jobs can ask it for the list of uploads as JSON, e.g.
+        #"http://localhost:8502/api/files?test=TRH&employee=12345&since=2025-01-01"
+        #-> read from the file catalog (same list as the Uploaded Log), newest first, 100 per page
     except Exception as e:
         st.warning(f"Failed to start file server: {e}")
     #if something goes wrong, Streamlit shows a yellow warning box with error message
@@ -59,6 +90,44 @@ start_file_server()
 #archived/
 
 # === Helpers ===
+def render_stage_timings():
+    with st.sidebar.expander("⏱ Stage timings"):
+        rows = stage_summary()
+        if not rows:
+            st.caption("Nothing measured yet.")
+            return
+        st.dataframe([{"tab": r["tab"], "stage": r["stage"], "runs": r["count"],
+                       "p50 ms": round(r["p50"] * 1000, 1), "p95 ms": round(r["p95"] * 1000, 1),
+                       "p99 ms": round(r["p99"] * 1000, 1)} for r in rows], hide_index=True)
+        if METRICS_FILE:
+            st.caption(f"Written to `{METRICS_FILE}` every {METRICS_INTERVAL}s")
+#Admin-only panel in the sidebar (admins = employee numbers in RE_PN_LAB_ADMINS)
+#User sees: a table like
+#tab              stage               runs  p50 ms  p95 ms  p99 ms
+#📋 Uploaded Log  list_files_fast     120     3.1    45.0   210.7
+#📋 Uploaded Log  render rows         120    40.2    95.3   130.0
+#p50 = half of the refreshes were faster than this, p95 = all but the slowest 5%, ...
+#(over the last 1000 refreshes of all users)
+
+def toggle_profiling(on: bool):
+    emp_id = st.session_state["profile_employee"].strip()
+    if emp_id:
+        set_profiled(emp_id, on)
+
+def render_profiler():
+    with st.sidebar.expander("🔬 Profiler"):
+        st.text_input("Employee number", key="profile_employee")
+        p1, p2 = st.columns(2)
+        with p1: st.button("Start", key="profile_start", on_click=toggle_profiling, args=(True,))
+        with p2: st.button("Stop", key="profile_stop", on_click=toggle_profiling, args=(False,))
+        from_env, switched_on = profiled_employees()
+        st.caption(f"Profiling: {', '.join(from_env + switched_on) or 'nobody'} → `{PROFILE_DIR}`")
+#Admin-only panel: type an employee number and press Start ->
+#every page refresh of that employee is profiled until Stop is pressed
+#Each refresh becomes one file in the "profiles" folder (or RE_PN_LAB_PROFILE_DIR), e.g.
+#20250131-140215-042_1000003610_Uploaded_Log.folded  (time_employee_tab)
+#.folded files open as a flame graph in speedscope.app or flamegraph.pl
+
 def human_size(num_bytes: int) -> str:
 #takes an integer "num_bytes" (file size in raw bytes)
 #returns a string (formatted size, e.g. "1.2 MB")
@@ -94,58 +163,13 @@ def human_size(num_bytes: int) -> str:
 def list_files_fast(folder: str):
 #takes a folder path as input
 #purpose: to list all files inside that folder (and subfolders) with some details
-    files_list = []
-    #this will store info about each file as a dictionary
-    #example at this stage: "files_list = []"
-    for root, _, files in os.walk(folder):
-    #"os.walk(folder)" goes through every folder, subfolder, and files inside "folder"
-    #"root" = current folder path
-    #"_" = list of subholders (ignored here)
-    #"files" = list of filenames in this folder
-    #Output example for "C:\PN-RE-LAB\UPLOADS:"
-    #root = "C:\\PN-RE-LAB\\UPLOADS\\TRH"
-    #files = ["test1.xlsx", "test2.xlsx"]
-
-        for file in files:
-        #iterate through each file in the current folder
-            try:
-                path = os.path.join(root, file)
-            #builds full file path, e.g.:
-            #path = "C:\\PN-RE-LAB\\UPLOADS\\TRH\\test1.xlsx"
-                stat = os.stat(path)
-                #os.stat() gets metadata about the file, including:
-                #st_size --> file size in bytes
-                #st_mtime --> last modified timestamp
-                #example:
-                #stat.st_size = 2048
-                #stat.st_mtime = 1695030000.0 #UNIX timestamp
-                employee_folder = os.path.basename(os.path.dirnmae(path))
-                #assumes file is under employee folder, e.g.:
-                #path = "C:\\PN-RE-LAB\\UPLOADS\\TRH\\1000329829\\test1.xlsx"
-                #os.path.dirname(path) -> "C:\\PN-RE-LAB\\UPLOADS\\TRH\\1000329829"
-                #os.path.basename(...) -> "1000329829"
-                #So employee_folder = "1000329829"
-                files_list.append({
-                    "name": file,
-                    "path": path,
-                    "size": stat.st_size,
-                    "mtime": stat.st_mtime,
-                    "employee": employee_folder
-                })
-                #adds a dictionary for this file:
-                #"name": "test1.xlsx".
-                #"path": "C:\\PN-RE-LAB\\UPLOADS\\TRH\\1000329829\\test1.xlsx",
-                #"size": 2048,
-                #"mtime": 1695030000.0,
-                #"employee": 1000329829"
-            except FileNotFoundError:
-                continue
-            #skips the file if it doesn't exist anymore (e.g., deleted while scanning)
-    files_list.sort(key=lambda x: x["mtime"], reverse=True)
-    #sorts the list most recently modified first
-    #example after sorting:
-    #[{"name": "test2.xlsx", "mtime": 1695040000.0}, {"name": "test1.xlsx","mtime": 1695030000.0}]
-    return files_list
+    return scan_files(folder)
+    #scan_files (file_scanner.py) walks the folder with os.scandir and remembers each
+    #folder's last-modified time (mtime) from the previous call
+    #next time, folders whose mtime did not change are NOT read again -> their files come from memory
+    #Example: after one upload only "C:\\PN-RE-LAB\\UPLOADS\\TRH\\1000329829" is re-read,
+    #the other employee folders are skipped
+    #the list is sorted most recently modified first, same as before
     #returns a list of dictionaries for all files in the folder (and subfolders) with their info
     #example output:
     #[
@@ -165,55 +189,78 @@ def list_files_fast(folder: str):
     #{
     #]
 
-#this function scans a folder recursively
+#this function scans a folder recursively (only the parts that changed since last time)
 #collects file name, full path, size, last modified time, and employee folder
 #returns a sorted list (most recent files first)
 #used in the dashboard to show uploaded files in a log
 
-def save_to_local(src_path, dst_folder):
-#takes two arguments:
-#src_path -> the source file path (where the file is now)
-#dst_folder -> the destination folder (where we want to save it)
-    os.makedirs(dst_folder, exists_ok=True)
-    #creates the destination folder if it doesn't already exists
-    #exists_ok=True -> prevents error if folder already exists
-    #example
-    #dst_folder = "C:\\PN-RE-LAB\\UPLOADS\\TRH"
-    #If UPLOADS/TRH doesn't exist -> it will be created
-    dst_path = os.path.join(dst_folder, os.path.basename(src_path))
-    #os.path.basename(src_path) -> gets only the filename
-    #Joins it with dst_folder to get the final save location
+def list_folders_fast(folders):
+#takes a list of folder paths (e.g. the TRH, HACT and HEAD WEAR folders)
+    return scan_folders(folders)
+    #scans all of them at the same time with a pool of threads
+    #(the employee folders inside each test folder are read in parallel too)
+    #on the NAS every folder read is a network round trip, so doing them together
+    #is much faster than one after another
+    #RE_PN_LAB_SCAN_WORKERS environment variable = how many folders at once (default 16)
+    #returns a dictionary {folder: list of files (same as list_files_fast)}
     #Example:
-    #src_path = "C:\\Users\\Me\\Desktop\\report.xlsx"
-    #dst_folder = "C:\\PN-RE-LAB\\UPLOADS\\TRH"
-    #dst_path = "C:\\PN-RE-LAB\\UPLOADS\\TRH\\report.xlsx"
-    try:
-        if os.path.abspath(src_path) != os.path.abspath(dst_path):
-            shutil.copy2(src_path, dst_path)
-        return dst_path, True
-    #Checks if source and destination are not the same file
-    #(os.path.abspath) -> converts both to full absolute paths
-    #If dirrent -> copies file with "shutil.copy2()" (preserves metadata like modified date)
-    #Returns tuple (dst_path, True) -> meaning copy succeeded
-    except shutil.SameFileError:
-        return dst_path, False
-    #if the source and destination are exactly the same file, it won't copy
-    #Returns (dst_path, False) -> meaning no copy happened
-    except Exception as e:
-        return dst_path, str(e)
-    #catches any other error(like permission denied, disk full, etc)
-    #returns (dst_path, "error message")
-    #ex:("C:\\PN-RE-LAB\\UPLOADS\\TRH\\report.xlsx", "Permission denied")
-    #Example usage:
-    #src = "C:\\Users\\Me\\Desktop\\report.xlsx"
-    #dst = "C:\\PN-RE-LAB\\UPLOADS\\TRH"
-    #print(save_to_local(src, dst))
-    #possible outputs:
-    #("C:\\PN-RE-LAB\\UPLOADS\\TRH\\report.xlsx", True) #Copied
-    #("C:\\PN-RE-LAB\\UPLOADS\\TRH\\report.xlsx", False) #Same file, no copy
-    #("C:\\PN-RE-LAB\\UPLOADS\\TRH\\report.xlsx", "Permission denied") #Error
-    
-    
+    #{"C:\\PN-RE-LAB\\UPLOADS\\TRH": [{"name": "test1.xlsx", ...}], "C:\\PN-RE-LAB\\UPLOADS\\HACT": []}
+
+def page_controls(key, pages):
+#key: name used to remember the current page (e.g. "🛠 MI Tests_TRH_page")
+#pages: how many pages this test has
+    page = min(st.session_state.get(key, 1), pages)
+    st.session_state[key] = page
+    #remembers the page number between clicks (1 = first page)
+    #if files were deleted and there are fewer pages now -> stay on the last page
+    def step(delta):
+        st.session_state[key] = min(max(st.session_state[key] + delta, 1), pages)
+    #moves one page back (-1) or forward (+1), never below 1 or past the last page
+    c1, c2, c3 = st.columns([0.2, 0.6, 0.2])
+    with c1: st.button("◀ Prev", key=f"{key}_prev", on_click=step, args=(-1,), disabled=page <= 1)
+    with c2:
+        st.number_input("Page", min_value=1, max_value=pages, step=1, key=key)
+        st.caption(f"of {pages}")
+    with c3: st.button("Next ▶", key=f"{key}_next", on_click=step, args=(1,), disabled=page >= pages)
+    #User sees:
+    #[ ◀ Prev ]   Page [ 2 ] of 7   [ Next ▶ ]
+    #typing a number in the Page box jumps straight to that page
+    return st.session_state[key] - 1
+    #returns the page as 0-based (page 1 -> 0) for catalog_page_at
+
+REPLICATION_ICONS = {"pending": "⏳", "running": "🔄", "done": "✅", "failed": "❌"}
+#icon for each state of a background copy:
+#pending = waiting (or waiting to retry), running = being copied now,
+#done = copied, failed = gave up after 8 tries
+
+def replication_badge(jobs):
+    return " ".join(REPLICATION_ICONS[state] for _, state, _, _ in jobs)
+    #jobs = the background copies of one file (Spotfire, Downloads)
+    #Example: "✅ ⏳" -> Spotfire copy done, Downloads copy still waiting
+
+@st.fragment(run_every=2)
+def replication_status(src):
+    for dst, state, attempts, error in replication_states([src])[src]:
+        line = f"{REPLICATION_ICONS[state]} Copy to `{dst}`: {state}"
+        if error:
+            line += f" (attempt {attempts}: {error})"
+        st.write(line)
+    #shows one line per background copy of the file at src
+    #Example: "✅ Copy to C:\PN-RE-LAB\UPLOADS\Spotfire\TRH\report.xlsx: done"
+    #if a try failed, the error is shown next to it and the copy is retried later
+    #@st.fragment(run_every=2) -> only this part of the page refreshes itself every 2 seconds,
+    #so the user watches the copies finish without the upload being run again
+
+@st.fragment(run_every=1)
+def wait_for_job(job_id, message):
+    if job_result(job_id)[0] == "running":
+        st.info(message)
+    else:
+        st.rerun()
+    #job_id = a job handed to the worker processes (see workbook_jobs)
+    #while it is running: shows e.g. "⏳ Checking workbook…" and looks again every second
+    #once it has finished: st.rerun() runs the whole page again, which picks up the result
+
 # === Load Employee List from Shared File (robust) ===
 EMPLOYEE_LIST_PATH = "EMPLOYEE_LIST.xlsx"
 #Hardcodes the Excel file path where the employee list is stored
@@ -231,8 +278,12 @@ def load_employee_list():
     #Output in UI:
     #Employee list file not found at C:\PN-RE-LAB\EMPLOYEE_LIST.xlsx
     try:
-        df = pd.read_excel(abs_path, dtype=str)
+        df = read_employee_list(abs_path)
         #reads the Excel into a Pandas DataFrame
+        #read_employee_list keeps the result in memory for ALL users of the app and only reads
+        #the Excel again when the file changes (its modified time or size is different)
+        #it also saves a quick-load copy in the .cache folder, so after a restart the
+        #Excel doesn't need to be parsed again if it didn't change
         #"dtype=str" ensures all values are read as strings (important for employee IDs like "00123" that Excel might convert to numbers)
         if 'Employee #' not in df.columns or 'Name' not in df.columns:
             st.error("Excel must have columns: 'Employee #' and 'Name'")
@@ -249,18 +300,6 @@ def load_employee_list():
     #Output in UI:
     #Failed to read employee list: <error message>
 
-employee_df = load_employee_list()
-employee_ids = employee_df['Employee #'].tolist()
-#calls the function to actually load the employee list
-#saves the DataFrame into "employee_df"
-#Extracts the list of employee IDs into "employee_ids"
-#Example DataFrame (employee_df):
-#Employee #                Name
-#1001                     Alice Lee
-#1002                     Bob Tan
-#Example list (employee_ids):
-#["1001", "1002"]
-
 # === Employee Login ===
 if "authenticated" not in st.session_state:
     st.session_state["authenticated"] = False
@@ -292,16 +331,18 @@ def check_employee_id():
             #[ Login ]
             if submitted:
             #Runs only when the user clicks Login
-                if emp_id in employee_ids:
-                #checks if the entered Employee # exists in the "employee_ids" list
+                employees = employee_index(load_employee_list())
+                #the employee list is only needed now, not to show the form (see below)
+                if emp_id in employees:
+                #checks if the entered Employee # exists in the "employees" dictionary
                     st.session_state["authenticated"] = True
                     st.session_state["employee_id"] = emp_id
-                    employee_name = employee_df.loc[employee_df['Employee #']==emp_id, 'Name'.values[0]]
+                    employee_name = employees[emp_id]["Name"]
                     st.success(f"Welcome {employee_name}")
                     st.rerun()
                 #sets the session as logged in.
                 #stores which employee ID logged in
-                #Looks up their Name in the DataFrame
+                #Looks up their Name in the "employees" dictionary
                 #Shows a green success message:
                 # Welcome Alice Lee
                 #"st.rerun()" reloads the app so the login form disappears and the user sees the main app instead
@@ -315,23 +356,53 @@ def check_employee_id():
     return True
 
 if not check_employee_id():
+    prewarm("employee list", read_employee_list, os.path.abspath(EMPLOYEE_LIST_PATH))
+    prewarm("workbook pool", warm_pool)
     st.stop()
 #Calls the login check function
 #If it returns "False" (user not logged in yet) -> stop running the rest of the app until they log in
+#The login page is kept as light as possible so it appears fast after the app (re)starts:
+#nothing above it loads pandas or reads the employee Excel
+#While the user types their number, prewarm does the slow first-time work in the background
+#(once per app start, not per user):
+#-> "employee list": loads pandas and reads the Excel, so pressing Login is quick
+#-> "workbook pool": starts one worker process that checks uploaded workbooks
+#   (more are started when several uploads arrive at once)
 
 #App starts
 #User sees a textbox -> "Enter Employee #" and a Login button
 #If they type "1001" and it exists in Excel -> login succeeds -> page refresh -> "Welcome Alice Lee"
 #If they type something wrong -> "Invalid Employee"
 
+with span("load_employee_list"):
+    employee_df = load_employee_list()
+    employees = employee_index(employee_df)
+#calls the function to actually load the employee list (after login, usually already in memory)
+#(timed as the "load_employee_list" stage)
+#saves the DataFrame into "employee_df"
+#Builds "employees": a dictionary from Employee # to that employee's row
+#(built once per version of the Excel, shared by all users)
+#Example DataFrame (employee_df):
+#Employee #                Name
+#1001                     Alice Lee
+#1002                     Bob Tan
+#Example dictionary (employees):
+#{"1001": {"Employee #": "1001", "Name": "Alice Lee"}, "1002": {"Employee #": "1002", "Name": "Bob Tan"}}
+#Looking up an ID in a dictionary is instant, no matter how many employees there are
+#(a list has to be checked one by one, and employee_df.loc[...] checks every row)
+
 # === Config Constants ===
 SHARED_UPLOAD_FOLDER = r"C:\PN-RE-LAB\UPLOADS"
 LOCAL_SAVE_FOLDER   = os.path.join(SHARED_UPLOAD_FOLDER, "DOWNLOADS")
-os.makedirs(LOCAL_SAVE_FOLDER, exist_ok=True)
+prewarm("upload folders", os.makedirs, LOCAL_SAVE_FOLDER, exist_ok=True)
+prewarm("replication workers", start_replication_workers)
 #What it does:
 #Defines a shared folder "UPLOADS"
 #Creates a "DOWNLOADS" folder inside "UPLOADS"
 #Ensures the folder exists (creates it if missing)
+#Starts the background copiers right away, so copies still on the to-do list from
+#before a restart are made even if nobody uploads anything
+#This is done in the background, once per app start, so a slow shared drive never holds up the page
 
 #Example (folder structure after running):
 #C:\PN-RE-LAB\
@@ -384,6 +455,7 @@ tabs = ["📁 MI Upload", "📁 Chemlab Upload", "📈 View Spotfire Dashboard",
 #This defines the tab names that will show up in the Streamlit app navigation dropdown
 #The emojis make it visually clear what each tab is about
 selected_tab = st.selectbox("🗭 Navigate", tabs, label_visibility="collapsed")
+set_tab(selected_tab)
 #This creates a dropdown menu in Streamlit
 #The user will see the options from the "tabs" list and can select one
 #"label_visibility="collapsed"" hides the label "Navigate" (the dropdown shows only the options)
@@ -393,20 +465,98 @@ selected_tab = st.selectbox("🗭 Navigate", tabs, label_visibility="collapsed")
 #-> View Spotfire Dashboard
 #-> Uploaded Log
 #The variable "selected_tab" will hold whichever tab the user picks (e.g., "MI Upload")
+#set_tab files this refresh's timings under that tab (the employee list timing included)
 
 # === Upload Section ===
+def process_batch_file(file, test, emp_id):
+    user_folder = os.path.join(SHARED_UPLOAD_FOLDER, test, emp_id)
+    spotfire_folder = os.path.join(SHARED_UPLOAD_FOLDER, "Spotfire", test)
+    stream_path = os.path.join(user_folder, file.name)
+    state, result = wait_job(check_job(file.getvalue(), test))
+    if state == "failed":
+        if isinstance(result, WorkbookError):
+            return {"status": "❌ rejected", "detail": str(result)}
+        raise result
+    checked, _ = result
+    os.makedirs(user_folder, exist_ok=True)
+    _, digest, saved, reused = store_upload(file, SHARED_UPLOAD_FOLDER, [stream_path])
+    if saved[stream_path] is not True:
+        return {"status": "❌ failed", "rows": checked, "detail": f"saving: {saved[stream_path]}"}
+    catalog_add(os.path.join(SHARED_UPLOAD_FOLDER, test), stream_path)
+    enqueue_replication(stream_path, [os.path.join(spotfire_folder, file.name),
+                                      os.path.join(LOCAL_SAVE_FOLDER, test, emp_id, file.name)])
+    row = {"status": "✅ saved", "rows": checked,
+           "detail": stream_path + (" (identical file already stored, linked)" if reused else "")}
+    state, converted = wait_job(convert_job(file.getvalue(), spotfire_folder, file.name,
+                                            provenance={"sha256": digest, "employee": emp_id}, test=test))
+    if state == "failed":
+        row["status"] = "⚠️ saved"
+        row["detail"] += f"; Spotfire Parquet conversion failed: {converted}"
+    elif converted[2]:
+        row["status"] = "⚠️ saved"
+        row["detail"] += f"; {converted[2]} value(s) did not match the {test} column types and were left empty"
+    return row
+#One file of a batch upload: the same steps as handle_upload below, just without any screen output
+#(check -> save -> catalog -> background copies -> Parquet for Spotfire)
+#It runs on a batch worker thread, so it can simply wait for the check / conversion jobs (wait_job)
+#Returns one row of the summary table, e.g.
+#{"status": "✅ saved", "rows": 120, "detail": "C:\PN-RE-LAB\UPLOADS\TRH\12345\run1.xlsx"}
+#or {"status": "❌ rejected", "detail": "sheet 'Data' row 7: 'Temp' should be double, got 'n/a'"}
+
+@st.fragment(run_every=1)
+def wait_for_batch(batch_id):
+    done, total, rows = batch_status(batch_id)
+    if done == total:
+        st.rerun()
+    st.progress(done / total, text=f"⏳ {done} / {total} file(s) processed")
+    st.dataframe(rows, hide_index=True, column_order=SUMMARY_COLUMNS)
+#Like wait_for_job, but for a whole batch: refreshes itself every second
+#User sees: a progress bar "⏳ 7 / 20 file(s) processed" and the table filling up
+#(files not started yet show "⏳ queued", the ones being worked on "🔄 working")
+
+def handle_batch_upload(test_type, selected_test):
+    files = st.file_uploader("Upload Excel files, or one .zip of them", type=["xlsx", "zip"],
+                             accept_multiple_files=True, key=f"{test_type}_batch_files")
+    batches = st.session_state.setdefault("upload_batches", {})
+    if files and st.button(f"🚀 Upload {len(files)} file(s) to {selected_test}", key=f"{test_type}_batch_start"):
+        items, skipped = expand_uploads(files)
+        process = functools.partial(process_batch_file, test=selected_test, emp_id=st.session_state["employee_id"])
+        batches[test_type] = start_batch(items, process, skipped)
+    #User drops many .xlsx files (or one .zip of them) and clicks one button
+    #expand_uploads only lists what is in the zip (files inside that are not .xlsx are listed as skipped);
+    #each file is unpacked later by the worker that handles it
+    #start_batch hands every file to the batch workers (4 at a time by default) and returns at once
+    #batches remembers the batch of this tab, so reruns show it instead of starting it again
+    status = batch_status(batches[test_type]) if test_type in batches else None
+    if status is None:
+        return
+    done, total, rows = status
+    if done < total:
+        wait_for_batch(batches[test_type])
+        return
+    counts = {icon: sum(row["status"].startswith(icon) for row in rows) for icon in ("✅", "⚠️", "❌", "⏭")}
+    st.success(f"📦 Batch finished: {counts['✅'] + counts['⚠️']} saved, {counts['❌']} rejected or failed, "
+               f"{counts['⏭']} skipped")
+    st.dataframe(rows, hide_index=True, column_order=SUMMARY_COLUMNS)
+    #User sees: "📦 Batch finished: 18 saved, 1 rejected or failed, 1 skipped"
+    #and one row per file: file | status | rows | detail (where it was saved, or why not)
+
 def handle_upload(test_type, tests_list):
 #test_type : either "MI" or "Chemlab" depending on which tab the user is in
 #tests_list : the list of tests for that category (e.g., ["TRH", "HACT", "HEAD WEAR"] for MI)
     st.subheader(f"🛠️ Upload {test_type} Test File")
     selected_test = st.selectbox(f"Select {test_type} Test", tests_list)
+    if st.toggle("📦 Batch upload (many files or a .zip)", key=f"{test_type}_batch"):
+        handle_batch_upload(test_type, selected_test)
+        return
     file = st.file_uploader("Upload Excel File", type=["xlsx"])
     #A subheader like "Upload MI Test File"
     #A dropdown (st.selectbox) to choose a test (e.g., TRH, HACT)
+    #A switch for batch mode (see handle_batch_upload above); off = one file at a time as below
     #A file uploader (st.file_uploader) where user can drag-drop or browse for an ".xlsx"
     if file:
         emp_id = st.session_state["employee_id"]
-        employee_name = employee_df.loc[employee_df['Employee #']==emp_id, 'Name'].values[0]
+        employee_name = employees[emp_id]["Name"]
 
         #Gets the employee ID from the login session
         #Looks up the employee's name in the Excel list
@@ -415,9 +565,6 @@ def handle_upload(test_type, tests_list):
         user_folder = os.path.join(SHARED_UPLOAD_FOLDER, selected_test, emp_id)
         spotfire_folder = os.path.join(SHARED_UPLOAD_FOLDER, "Spotfire", selected_test)
         local_folder = os.path.join(LOCAL_SAVE_FOLDER, selected_test, emp_id)
-        os.makedirs(user_folder, exist_ok=True)
-        os.makedirs(spotfire_folder, exist_ok=True)
-        os.makedirs(local_folder, exist_ok=True)
 
         #Builds 3 storage paths:
         #user_folder: for this employee's uploads
@@ -427,47 +574,249 @@ def handle_upload(test_type, tests_list):
         #local_folder: personal "downloads" for this employee
         #Example: C:\PN-RE-LAB\UPLOADS\DOWNLOADS\TRH\12345
 
-        #What happens: If these folders don't exists, they get created
-
-        # Save upload
+        # Save upload (Spotfire copy + DOWNLOADS copy follow in the background)
         stream_path = os.path.join(user_folder, file.name)
-        with open(stream_path, "wb") as f:
-            f.write(file.read())
-
-        #writes the uploaded file into the employee's folder
-        #Example: C:\PN-RE-LAB\UPLOADS\TRH\12345\report.xlsx
-
-        # Copy to Spotfire
-        shutil.copy2(stream_path, os.path.join(spotfire_folder, file.name))
-        #Makes a copy in the Spotfire folder so dashboards can read it
-
-        # Copy to local DOWNLOADS
-        local_path, saved = save_to_local(stream_path, local_folder)
-        #calls your helper save_to_local -> copies file into DOWNLOADS folder
-        #Returns (path, status) where "status" is True (saved), False (already exists), or error message
+        spotfire_path = os.path.join(spotfire_folder, file.name)
+        local_path = os.path.join(local_folder, file.name)
+        token = (stream_path,) + upload_token(file)
+        persisted = st.session_state.setdefault("persisted_uploads", {})
+        if token not in persisted:
+            checks = st.session_state.setdefault("workbook_checks", {})
+            if token not in checks:
+                checks[token] = check_job(file.getvalue(), selected_test)
+            state, result = job_result(checks[token])
+            if state == "running":
+                wait_for_job(checks[token], "⏳ Checking workbook…")
+                return
+            if state == "failed":
+                if isinstance(result, WorkbookError):
+                    st.error(f"❌ Upload rejected: {result}")
+                else:
+                    del checks[token]
+                    st.error(f"❌ Workbook check failed: {result}")
+                return
+            checked, preview = result
+            with span("save upload"):
+                os.makedirs(user_folder, exist_ok=True)
+                _, digest, saved, reused = store_upload(file, SHARED_UPLOAD_FOLDER, [stream_path])
+            if saved[stream_path] is not True:
+                st.error(f"❌ Failed saving upload: {saved[stream_path]}")
+                return
+            catalog_add(os.path.join(SHARED_UPLOAD_FOLDER, selected_test), stream_path)
+            enqueue_replication(stream_path, [spotfire_path, local_path])
+            # typed Parquet copy next to the Spotfire .xlsx (converted once, in the worker processes)
+            converting = convert_job(file.getvalue(), spotfire_folder, file.name,
+                                     provenance={"sha256": token[-1], "employee": emp_id}, test=selected_test)
+            persisted[token] = (reused, checked, preview, converting)
+            del checks[token]
+        digest, (reused, checked, preview, converting) = token[-1], persisted[token]
+
+        #Streamlit re-runs this whole script on every click (choosing another test,
+        #pressing a download button...) and the uploader still holds the same file each time
+        #token = where it goes + file name + size + SHA-256 checksum of the file
+        #Example: ("C:\\PN-RE-LAB\\UPLOADS\\TRH\\12345\\report.xlsx", "report.xlsx", 2048, "9f86d0...")
+        #the checksum is worked out from the copy already in memory -> no NAS access
+        #persisted = tokens already saved in this browser session (kept in st.session_state)
+        #-> first time: the file is saved (below) and its token is remembered
+        #-> any later re-run with the same file and test: nothing is written again,
+        #   the messages below are just shown again
+        #choosing a different test gives a different token -> saved there too
+        #check_job checks the file BEFORE anything is saved, using the rules for this test
+        #in workbook_schemas.json (sheet name, column names, number / date / text cells, no empty
+        #cells in required columns). It reads the Excel one row at a time and stops at the first
+        #problem, so even a huge bad file is refused almost instantly
+        #Example: "Upload rejected: sheet 'Data' row 12: 'Temp' should be double, got 'n/a'"
+        #tests with no rules only need to open as an Excel with a header row
+        #the check runs in a separate worker process (one per CPU core), not in this script:
+        #reading Excel keeps Python busy, and done here it would freeze the page for everyone
+        #-> several people uploading big files at once are checked side by side
+        #checks = jobs already handed out in this session, so a re-run doesn't start a second one
+        #while the job runs: "⏳ Checking workbook…" (the page looks again every second)
+        #a broken file -> red "Upload rejected" message, nothing is saved
+        #checked, preview = number of data rows checked + the first 20 rows, shown below
+        #the employee folder is created only when something is actually saved
+        #(the background copies create the Spotfire / Downloads folders themselves)
+
+        #store_upload first computes the file's SHA-256 checksum (digest)
+        #if a file with exactly the same content was uploaded before (by anyone, for any test),
+        #it is already kept once in UPLOADS\\.blobs\\<checksum> -> the employee's folder just gets
+        #linked to it, nothing is written to the NAS (reused = True)
+        #otherwise it reads the uploaded file ONCE and writes it to the employee's folder,
+        #e.g. C:\PN-RE-LAB\UPLOADS\TRH\12345\report.xlsx
+        #the file is written 1 MB at a time into a temp file like ".report.xlsx.1a2b3c4d.part",
+        #then renamed to report.xlsx in one step -> nobody ever sees a half-written file
+        #digest = SHA-256 checksum of the file, computed while writing
+        #Example: "9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08"
+        #saved = status for each place: True (saved) or an error message
+        #if the main copy failed -> red error and stop here
+        #catalog_add records it in the file catalog so the Uploaded Log sees it right away
+        #enqueue_replication puts the other 2 copies on a to-do list:
+        #-> the Spotfire folder, so dashboards can read it
+        #-> the DOWNLOADS folder
+        #background threads make those copies while the user carries on
+        #(a hardlink if on the same drive, otherwise a copy)
+        #if one fails (NAS busy, folder locked...) it is retried after 2s, 4s, 8s... up to 5 minutes apart
+        #the to-do list is kept in replication_queue.sqlite3, so copies still waiting
+        #when the app restarts are not lost
+        #convert_job hands the conversion to the worker processes too:
+        #it reads the uploaded Excel ONCE (the sheet the check looked at: the test's "sheet" rule,
+        #otherwise the first sheet) and saves it as
+        #C:\PN-RE-LAB\UPLOADS\Spotfire\TRH\report.parquet -> Spotfire loads that much faster
+        #than opening the .xlsx on every refresh
+        #every file of one test gets the same columns and types (kept in Spotfire\TRH\_schema.json):
+        #-> a column missing from this file is left empty, a brand-new column is added
+        #-> a value of the wrong kind (e.g. "abc" in a number column) is left empty and counted
+        #the rows are also added to ONE growing dataset per test, which dashboards can read
+        #instead of thousands of separate files:
+        #C:\PN-RE-LAB\UPLOADS\Spotfire\TRH\dataset\upload_date=2025-01-31\<checksum>.parquet
+        #-> one folder per upload day (each day is merged into a single file the next day)
+        #-> every row gets 4 extra columns: upload_employee, upload_file, upload_sha256, upload_time
+        #-> the same file content (same SHA-256 checksum) is only ever added once,
+        #   even if uploaded again under another name or by someone else
+        #converting = the id of that job; its result is picked up below
+        #persisted[token] remembers everything, so a re-run shows it without redoing anything
 
         st.success(f"💾 File saved in `{stream_path}`")
-        st.success(f"📂 Copied to Spotfire folder: `{spotfire_folder}`")
-        if saved is True:
-            st.success(f"💾 Saved to Downloads: `{local_path}`")
-        elif saved is False:
-            st.info(f"💾 Already exists in Downloads: `{local_path}`")
+        st.caption(f"SHA-256: {digest}")
+        if reused:
+            st.info("♻️ Identical file already stored — linked without writing it again")
+        with st.expander(f"👀 Preview ({checked} data rows checked)"):
+            st.dataframe(preview)
+        replication_status(stream_path)
+        state, converted = job_result(converting)
+        if state == "running":
+            wait_for_job(converting, "⏳ Converting for Spotfire…")
+        elif state == "failed":
+            st.warning(f"⚠️ Spotfire Parquet conversion failed: {converted}")
         else:
-            st.error(f"❌ Failed saving to Downloads: {saved}")
+            parquet_path, rows, nulled, appended = converted
+            st.success(f"📊 Converted for Spotfire: `{parquet_path}` ({rows} rows)")
+            if appended:
+                st.caption(f"➕ Added to the {selected_test} dataset")
+            else:
+                st.caption(f"Already in the {selected_test} dataset (same SHA-256), not added again")
+            if nulled:
+                st.warning(f"⚠️ {nulled} value(s) did not match the {selected_test} column types and were left empty")
 
         #"File saved in C:\PN-RE-LAB\UPLOADS\TRH\12345\report.xlsx"
-        #"Copied to Spotfire folder"
-        #or "i" message about Downloads copy
-
-        st.download_button("📥 Download This File", data=open(stream_path, "rb").read(), file_name=file.name)
+        #then one line per background copy, updating by itself:
+        #"⏳ Copy to ...\Spotfire\TRH\report.xlsx: pending" -> "✅ ...: done"
+        #"⏳ Converting for Spotfire…" while the conversion job runs, then:
+        #"Converted for Spotfire: ...\Spotfire\TRH\report.parquet (120 rows)"
+        #"Added to the TRH dataset" (or "Already in the TRH dataset" for a repeated file)
+        #+ a yellow warning if some values were left empty, or if the conversion failed
+
+        st.download_button("📥 Download This File", data=deferred_file(stream_path), file_name=file.name, on_click="ignore")
         #what user sees:
         #A download button that lets them immediately re-download the uploaded file
+        #deferred_file -> the file is only read back from the NAS when the button is clicked
+        #on_click="ignore" -> clicking it downloads without re-running the whole app
 
 #User chooses test & uploads file
 #File goes into 3 places (employee folder, Spotfire folder, Downloads)
 #User gets confirmation messages + download button
 
+# === Bulk download ===
+def export_url(token):
+    base = FILE_SERVER_URL or f"http://{st.context.headers.get('Host', 'localhost').rsplit(':', 1)[0]}:{FILE_SERVER_PORT}"
+    return f"{base}{EXPORT_PATH}{token}"
+#the zip comes from our file server (port 8502), not from Streamlit
+#st.context.headers["Host"] = the address the browser used to open the app, e.g. "labpc:8501"
+#-> link becomes http://labpc:8502/api/zip/<token>
+#RE_PN_LAB_FILE_SERVER_URL can set a fixed address instead
+
+def export_entry(test, f):
+    if "member" in f:
+        return f"{f['bundle']}::{f['member']}", {"arcname": f"{test}/{f['member']}", "path": f["bundle"],
+                                                 "member": f["member"], "mtime": f["mtime"], "size": f["size"]}
+    return f["path"], {"arcname": f"{test}/{f['employee']}/{f['name']}", "path": f["path"],
+                       "mtime": f["mtime"], "size": f["size"]}
+#returns (key, entry) for one listed file:
+#key = its path (or "bundle::member" for a file inside an archive zip)
+#entry = where to read it + its name inside the zip, e.g. "TRH/12345/report.xlsx"
+
+def select_files(selection, test, files, selected=True):
+    for f in files:
+        key, entry = export_entry(test, f)
+        if selected:
+            selection[key] = entry
+        else:
+            selection.pop(key, None)
+        st.session_state[f"sel_{key}"] = selected
+#selection = {key: entry} of the ticked files, kept in the session
+#-> it survives paging, opening other tests and reruns
+#st.session_state["sel_<key>"] = the tick box of that file, so it shows ticked too
+
+def select_all(selection, test, test_folder):
+    select_files(selection, test, catalog_files(test_folder))
+#every file of the test (from the catalog, no NAS walk)
+
+def toggle_file(selection, test, f):
+    key, _ = export_entry(test, f)
+    select_files(selection, test, [f], st.session_state[f"sel_{key}"])
+#runs when a tick box is clicked: adds or removes that one file
+
+def clear_selection(selection):
+    for key in selection:
+        st.session_state[f"sel_{key}"] = False
+    selection.clear()
+
+def select_checkbox(selection, test, f):
+    key, entry = export_entry(test, f)
+    st.session_state.setdefault(f"sel_{key}", key in selection)
+    st.checkbox(f"Select {f['name']}", key=f"sel_{key}", label_visibility="collapsed",
+                on_change=toggle_file, args=(selection, test, f))
+#User sees: a small tick box at the start of each row
+
+def render_bulk_download(selection, title):
+    if not selection:
+        st.caption("☑ Tick files below to download several of them as one zip.")
+        return
+    c1, c2, c3 = st.columns([0.5, 0.25, 0.25])
+    with c1: st.write(f"☑ {len(selection)} file(s) selected — {human_size(sum(e['size'] for e in selection.values()))}")
+    with c2: prepare = st.button("📦 Download selected", key=f"{title}_bulk")
+    with c3: st.button("✖ Clear selection", key=f"{title}_clear", on_click=clear_selection, args=(selection,))
+    if prepare:
+        token = register_export(selection.values(), export_name(title))
+        st.link_button("⬇ Save zip", export_url(token))
+        st.caption("The zip is streamed while it downloads, so it starts right away; the link works for an hour.")
+#User sees: "☑ 35 file(s) selected — 120.4 MB" | 📦 Download selected | ✖ Clear selection
+#Clicking 📦 registers the list and shows a "⬇ Save zip" link
+#The file server then writes the zip straight to the browser while it reads each file
+#-> nothing is collected in memory first, so 5 files or 5,000 use the same memory
+
 # === Uploaded Log Section ===
+def render_archived(test_folder, months, key, page_size, selection, test):
+#test_folder: e.g. C:\PN-RE-LAB\UPLOADS\TRH
+#months: archived files per month, e.g. [("2024-03", 42), ("2024-02", 17)]
+    if not st.toggle(f"🗄 Show archived files ({sum(n for _, n in months)})", key=f"{key}_archived"):
+        return
+    #User sees: a switch "Show archived files (59)"; nothing more unless it is switched on
+    counts = dict(months)
+    month = st.selectbox("Month", list(counts), format_func=lambda m: f"{m} — {counts[m]} file(s)",
+                         key=f"{key}_month")
+    page = page_controls(f"{key}_archive_page", -(-counts[month] // page_size))
+    #User picks a month ("2024-03 — 42 file(s)") and pages through it like the live list
+    for f in archived_page(test_folder, month, page_size, page * page_size):
+        emp_id = f["employee"]
+        employee_name = employees[emp_id]["Name"] if emp_id in employees else emp_id
+        c0, c1, c2, c3 = st.columns([0.05, 0.4, 0.3, 0.25])
+        with c0: select_checkbox(selection, test, f)
+        with c1: st.write(f"{f['name']} (by {employee_name})")
+        with c2: st.write(f"Size: {human_size(f['size'])} 🗄")
+        with c3:
+            try:
+                st.download_button("📥", data=deferred_member(f["bundle"], f["member"]), file_name=f['name'],
+                                   key=f"dl_{f['bundle']}_{f['member']}", on_click="ignore")
+            except Exception as e:
+                st.error(f"Download failed: {e}")
+    st.markdown("---")
+    #Files older than a year are moved by upload_archive.py (run on a schedule) into one zip
+    #per test and month, e.g. C:\PN-RE-LAB\UPLOADS\.archive\TRH\2024-03.zip
+    #-> the live folders stay small, so scanning them stays fast
+    #the catalog remembers which zip each archived file went into, so this list needs
+    #no unzipping; clicking 📥 reads just that one file out of the zip
+
 def render_uploaded_log(test_list, title):
 #test_list: list of test names (e.g., ["TRH", "HACT", "HEAD WEAR"])
 #title: a heading string to show (e.g., "MI Uploaded Files")
@@ -479,48 +828,92 @@ def render_uploaded_log(test_list, title):
     #st.slider lets the user pick how many files to show at once (between 5 and 50)
     #-> Default: 20 rows per page
     #User sees: A slider bar labeled Rows per page
-
-    for test in test_list:
-        test_folder = os.path.join(SHARED_UPLOAD_FOLDER, test)
-        os.makedirs(test_folder, exist_ok=True)
-        files = list_files_fast(test_folder)
-        total = len(files)
+    rescan = st.button("🔄 Rescan folders", key=f"{title}_rescan")
+    #User sees: a button to force a re-check of the real folders
+    selection = st.session_state.setdefault(f"{title}_selection", {})
+    with container:
+        render_bulk_download(selection, title)
+    #the "Download selected" bar, shown above the test sections
+
+    test_folders = {test: os.path.join(SHARED_UPLOAD_FOLDER, test) for test in test_list}
+    with span("list_files_fast"):
+        stale = [folder for folder in test_folders.values() if rescan or catalog_is_stale(folder)]
+        for folder in stale:
+            os.makedirs(folder, exist_ok=True)
+            if rescan:
+                forget_scan_cache(folder)
+        for folder, files in list_folders_fast(stale).items():
+            reconcile_catalog(folder, files)
     #For each test (e.g., "TRH") -> find its folder in "UPLOADS"
-    #Ensure the folder exists
-    #list_files_fast returns metadata for all files
-    #total = number of files
-        with container.expander(f"📁 {test} — {total} file(s)", expanded=False):
-        #User sees:
-        #A collapsible section like:
-        #-> TRH - 12 file(s) (default collapsed)
-            if total == 0:
-                st.info("No files in this test yet.")
-                continue
-            #User sees: An info box if no files are found
-            page_files = files[:page_size]
-            #only take the first N files(N = page_size)
-            #(Note: This is not full pagination yet, just trimming the list)
-            for f in page_files:
-                emp_id = f["employee"]
-                employee_name = employee_df.loc[employee_df['Employee #']==emp_id, 'Name'].values[0] if emp_id in employee_ids else emp_id
-            #Get employee ID from file path
-            #Look up full name from employee list if available
-                c1, c2, c3 = st.columns([0.4, 0.3, 0.3])
-                with c1: st.write(f"{f['name']} (by {employee_name})")
-                with c2: st.write(f"Size: {human_size(f['size'])}")
-                with c3:
-                    try:
-                        with open(f["path"], "rb") as file_data:
-                            st.download_button("📥", data=file_data.read(), file_name=f['name'])
-                    except Exception as e:
-                        st.error(f"Download failed: {e}")
-
-                #User sees (per file, in 3 columns):
-                # 1.Filename + uploader name
-                # Example: "report.xlsx (by John Tan)"
-                # 2.File size (formatted nicely, e.g., 2.3 MB)
-                # Download button to get the file
-                # If download fails -> show an error message
+    #stale = folders that need a re-check: button clicked, or last check older than 5 minutes
+    #Ensure those folders exist
+    #The button also clears the scanner's memory so every file is read again
+    #list_folders_fast scans all stale folders at the same time,
+    #then reconcile_catalog fixes the catalog for each one
+    #(adds files copied in by hand, removes deleted ones)
+    #all of this is timed as the "list_files_fast" stage, the file rows below as "render rows"
+
+    with span("render rows"):
+        for test in test_list:
+            test_folder = test_folders[test]
+            total = catalog_count(test_folder)
+            months = archived_months(test_folder)
+            archived = sum(n for _, n in months)
+            label = f"📁 {test} — {total} file(s)" + (f" + {archived} archived" if archived else "")
+        #total = number of files in the catalog for this test (no NAS walk)
+        #months / archived = files already moved into archive zips (also from the catalog)
+            with container.expander(label, expanded=False):
+            #User sees:
+            #A collapsible section like:
+            #-> TRH - 12 file(s) + 59 archived (default collapsed)
+                if months:
+                    render_archived(test_folder, months, f"{title}_{test}", page_size, selection, test)
+                if total == 0:
+                    st.info("No recent files in this test." if months else "No files in this test yet.")
+                    continue
+                #User sees: An info box if no files are found
+                pages = -(-total // page_size)
+                page = page_controls(f"{title}_{test}_page", pages)
+                cursors = st.session_state.setdefault(f"{title}_{test}_cursors", {})
+                page_files = catalog_page_at(test_folder, page, page_size, cursors)
+                copies = replication_states([f["path"] for f in page_files])
+                s1, s2 = st.columns(2)
+                with s1: st.button("☑ Select page", key=f"{title}_{test}_select_page",
+                                   on_click=select_files, args=(selection, test, page_files))
+                with s2: st.button(f"☑ Select all {total}", key=f"{title}_{test}_select_all",
+                                   on_click=select_all, args=(selection, test, test_folder))
+                #pages = total / page_size rounded up (e.g. 45 files, 20 per page -> 3 pages)
+                #page_controls shows Prev / Next / Page box and returns the page to show
+                #catalog_page_at reads only the N files of that page (N = page_size), newest first,
+                #straight from the catalog's index -> no full list, no full sort
+                #cursors remembers where each page starts, so Next is just as fast on page 50 as on page 1
+                #copies = state of the background Spotfire / Downloads copies of the files on this page (one query)
+                #User sees: "☑ Select page" (ticks the rows shown) and "☑ Select all 45" (every file of the test)
+                for f in page_files:
+                    emp_id = f["employee"]
+                    employee_name = employees[emp_id]["Name"] if emp_id in employees else emp_id
+                #Get employee ID from file path
+                #Look up full name from employee list if available
+                    c0, c1, c2, c3 = st.columns([0.05, 0.4, 0.3, 0.25])
+                    with c0: select_checkbox(selection, test, f)
+                    with c1: st.write(f"{f['name']} (by {employee_name})")
+                    with c2: st.write(f"Size: {human_size(f['size'])} {replication_badge(copies[f['path']])}")
+                    with c3:
+                        try:
+                            st.download_button("📥", data=deferred_file(f["path"]), file_name=f['name'],
+                                               key=f"dl_{f['path']}", on_click="ignore")
+                        except Exception as e:
+                            st.error(f"Download failed: {e}")
+
+                    #User sees (per file, in 4 columns):
+                    # 0.Tick box to add the file to "Download selected"
+                    # 1.Filename + uploader name
+                    # Example: "report.xlsx (by John Tan)"
+                    # 2.File size (formatted nicely, e.g., 2.3 MB) + copy icons (e.g. "✅ ✅")
+                    # Download button to get the file
+                    # (the file is read only when that button is clicked, not while the page loads,
+                    #  so showing 50 rows costs just the file names and sizes)
+                    # If download fails -> show an error message
 #This function creates a log of uploaded files for each test type, grouped into expandable sections, with file details and download buttons 
 
 # === Main Tabs ===
@@ -568,4 +961,13 @@ st.markdown("<hr><div class='footer'>📘 Made with passion by RE PN LAB 2025</d
 #User sees:
 #-> -------------------------
 #-> Made with passion by RE PN LAB 2025
+
+if is_admin(st.session_state["employee_id"]):
+    render_stage_timings()
+    render_profiler()
+finish_rerun()
+finish_profile(current_tab())
+#Admins also get the "⏱ Stage timings" and "🔬 Profiler" panels in the sidebar
+#finish_rerun stops the stopwatch: the whole refresh is timed as the "rerun" stage
+#finish_profile writes the profile of this refresh (if this user is being profiled)
                      
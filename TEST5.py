@@ -1,26 +1,70 @@
 import streamlit as st
 import os
-import shutil
-import subprocess
-import sys
-import time
-import pandas as pd
+import functools
 from datetime import datetime
+from file_catalog import (archived_months, archived_page, catalog_add, catalog_count, catalog_files,
+                          catalog_is_stale, catalog_page_at, reconcile_catalog)
+from file_scanner import forget_scan_cache, scan_files, scan_folders
+from file_download import deferred_file, deferred_member
+from employee_directory import employee_index, is_admin, read_employee_list
+from blob_store import store_upload
+from replication import enqueue_replication, replication_states, start_replication_workers
+from upload_io import upload_token
+from workbook_validation import WorkbookError
+from file_server import EXPORT_PATH, FILE_SERVER_PORT, FILE_SERVER_URL, serve_folder
+from bulk_download import export_name, register_export
+from workbook_jobs import check_job, convert_job, job_result, wait_job, warm_pool
+from batch_upload import SUMMARY_COLUMNS, batch_status, expand_uploads, start_batch
+from stage_timing import (METRICS_FILE, METRICS_INTERVAL, current_tab, finish_rerun, set_tab, span,
+                          stage_summary, start_metrics_writer, start_rerun)
+from rerun_profiler import PROFILE_DIR, finish_profile, profiled_employees, set_profiled, start_profile
+from prewarm import prewarm
+
+# timing spans for each stage of this rerun (stage_timing); admins see them in the sidebar
+start_rerun()
+start_metrics_writer()
+start_profile(st.session_state.get("employee_id"))
 
 # ==== Auto-start file server (optional) ===
 def start_file_server():
     try:
         folder_to_serve = r"\\mpl-op-genmp01.wdc.com\PN-RELAB\RE Ctrl Nasuni\Digitalization"
-        port = 8502
-        command = [sys.executable, "-m", "http.server", str(port), "--directory", folder_to_serve]
-        subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        time.sleep(1)
+        # started once per process; reruns find it already running
+        serve_folder(folder_to_serve, FILE_SERVER_PORT)
     except Exception as e:
         st.warning(f"Failed to start file server: {e}")
 
 start_file_server()
 
 #=== Helpers ===
+def render_stage_timings():
+    # admin panel: p50 / p95 / p99 per tab and stage over the recent reruns of all sessions
+    with st.sidebar.expander("⏱ Stage timings"):
+        rows = stage_summary()
+        if not rows:
+            st.caption("Nothing measured yet.")
+            return
+        st.dataframe([{"tab": r["tab"], "stage": r["stage"], "runs": r["count"],
+                       "p50 ms": round(r["p50"] * 1000, 1), "p95 ms": round(r["p95"] * 1000, 1),
+                       "p99 ms": round(r["p99"] * 1000, 1)} for r in rows], hide_index=True)
+        if METRICS_FILE:
+            st.caption(f"Written to `{METRICS_FILE}` every {METRICS_INTERVAL}s")
+
+def toggle_profiling(on: bool):
+    emp_id = st.session_state["profile_employee"].strip()
+    if emp_id:
+        set_profiled(emp_id, on)
+
+def render_profiler():
+    # admin panel: profile every rerun of one employee until stopped (rerun_profiler)
+    with st.sidebar.expander("🔬 Profiler"):
+        st.text_input("Employee number", key="profile_employee")
+        p1, p2 = st.columns(2)
+        with p1: st.button("Start", key="profile_start", on_click=toggle_profiling, args=(True,))
+        with p2: st.button("Stop", key="profile_stop", on_click=toggle_profiling, args=(False,))
+        from_env, switched_on = profiled_employees()
+        st.caption(f"Profiling: {', '.join(from_env + switched_on) or 'nobody'} → `{PROFILE_DIR}`")
+
 def human_size(num_bytes: int) -> str:
     for unit in ["B", "KB", "MB", "GB", "TB"]:
         if num_bytes < 1024.0:
@@ -28,37 +72,50 @@ def human_size(num_bytes: int) -> str:
         return f"{num_bytes:.1f} PB"
     
 def list_files_fast(folder: str):
-    files_list = []
-    for root, _, files in os.walk(folder):
-        for file in files:
-            try:
-                path = os.path.join(root, file)
-                stat = os.stat(path)
-                employee_folder = os.path.basename(os.path.dirname(path))
-                files_list.append({
-                    "name": file,
-                    "path": path,
-                    "size": stat.st_size,
-                    "mtime": stat.st_mtime,
-                    "employee": employee_folder
-                })
-            except FileNotFoundError:
-                continue
-    files_list.sort(key=lambda x:x["mtime"], reverse=True)
-    return files_list
-
-def save_to_local(src_path, dst_folder):
-    os.makedirs(dst_folder, exist_ok=True)
-    dst_path = os.path.join(dst_folder, os.path.basename(src_path))
-    try:
-        if os.path.abspath(src_path) != os.path.abspath(dst_path):
-            shutil.copy2(src_path, dst_path)
-        return dst_path, True
-    except shutil.SameFileError:
-        return dst_path, False
-    except Exception as e:
-        return dst_path, str(e)
-    
+    # incremental: only folders whose mtime changed since the last call are re-read
+    return scan_files(folder)
+
+def list_folders_fast(folders):
+    # scans several test folders in parallel -> {folder: files}
+    return scan_folders(folders)
+
+def page_controls(key, pages):
+    # prev / next buttons and a jump-to-page box; returns the 0-based page to show
+    page = min(st.session_state.get(key, 1), pages)
+    st.session_state[key] = page
+    def step(delta):
+        st.session_state[key] = min(max(st.session_state[key] + delta, 1), pages)
+    c1, c2, c3 = st.columns([0.2, 0.6, 0.2])
+    with c1: st.button("◀ Prev", key=f"{key}_prev", on_click=step, args=(-1,), disabled=page <= 1)
+    with c2:
+        st.number_input("Page", min_value=1, max_value=pages, step=1, key=key)
+        st.caption(f"of {pages}")
+    with c3: st.button("Next ▶", key=f"{key}_next", on_click=step, args=(1,), disabled=page >= pages)
+    return st.session_state[key] - 1
+
+REPLICATION_ICONS = {"pending": "⏳", "running": "🔄", "done": "✅", "failed": "❌"}
+
+def replication_badge(jobs):
+    # one icon per queued copy (Spotfire / Downloads), e.g. "✅ ⏳"
+    return " ".join(REPLICATION_ICONS[state] for _, state, _, _ in jobs)
+
+@st.fragment(run_every=2)
+def replication_status(src):
+    # refreshes on its own every 2s without rerunning the upload
+    for dst, state, attempts, error in replication_states([src])[src]:
+        line = f"{REPLICATION_ICONS[state]} Copy to `{dst}`: {state}"
+        if error:
+            line += f" (attempt {attempts}: {error})"
+        st.write(line)
+
+@st.fragment(run_every=1)
+def wait_for_job(job_id, message):
+    # polls a workbook job every second; reruns the page once it has finished
+    if job_result(job_id)[0] == "running":
+        st.info(message)
+    else:
+        st.rerun()
+
 #=====Load Employee List ====
 EMPLOYEE_LIST_PATH = r"\\mpl-op-genmp01.wdc.com\PN-RELAB\RE Ctrl Nasuni\Digitalization\EMPLOYEE_LIST.xlsx"
 
@@ -68,7 +125,7 @@ def load_employee_list():
         st.error(f"Employee list file not found at {abs_path}")
         st.stop()
     try:
-        df = pd.read_excel(abs_path, dtype=str)
+        df = read_employee_list(abs_path)
         if 'Employee #' not in df.columns or 'Name' not in df.columns:
             st.error("Excel must have columns: 'Employee #' and 'Name'")
             st.stop()
@@ -77,9 +134,6 @@ def load_employee_list():
         st.error(f"Failed to read employee list: {e}")
         st.stop()
 
-employee_df = load_employee_list()
-employee_ids = employee_df['Employee #'].tolist()
-
 #===Employee Login ====
 if "authenticated" not in st.session_state:
     st.session_state["authenticated"] = False
@@ -91,10 +145,11 @@ def check_employee_id():
             emp_id = st.text_input("Enter Employee #")
             submitted = st.form_submit_button("Login")
             if submitted:
-                if emp_id in employee_ids:
+                employees = employee_index(load_employee_list())
+                if emp_id in employees:
                     st.session_state["authenticated"] = True
                     st.session_state["employee_id"] = emp_id
-                    employee_name = employee_df.loc[employee_df['Employee #']==emp_id, 'Name'].values[0]
+                    employee_name = employees[emp_id]["Name"]
                     st.success(f"Welcome {employee_name}")
                     st.rerun()
                 else:
@@ -103,12 +158,20 @@ def check_employee_id():
     return True
 
 if not check_employee_id():
+    # the form is on its way to the browser: warm up what the pages after login need
+    prewarm("employee list", read_employee_list, os.path.abspath(EMPLOYEE_LIST_PATH))
+    prewarm("workbook pool", warm_pool)
     st.stop()
 
+with span("load_employee_list"):
+    employee_df = load_employee_list()
+    employees = employee_index(employee_df)
+
 #===Config Constants====
 SHARED_UPLOAD_FOLDER = r"\\mpl-op-genmp01.wdc.com\PN-RELAB\RE Ctrl Nasuni\Digitalization\UPLOADS"
 LOCAL_SAVE_FOLDER   = os.path.join(SHARED_UPLOAD_FOLDER, "DOWNLOADS")
-os.makedirs(LOCAL_SAVE_FOLDER, exist_ok=True)
+prewarm("upload folders", os.makedirs, LOCAL_SAVE_FOLDER, exist_ok=True)  # once per process, off the page
+prewarm("replication workers", start_replication_workers)  # copies left pending by a restart
 
 SPOTFIRE_MI_URLS = {
     "TRH": "https://spotfiremypn.wdc.com/spotfire/wp/analysis?file=/ADHOC/RELIABILITY/TRH",
@@ -127,68 +190,279 @@ cl_tests = list(SPOTFIRE_CHEMLAB_URLS.keys())
 #===Tabs===
 tabs = ["📁 MI Upload", "📁 Chemlab Upload", "📈 View Spotfire Dashboard", "📋 Uploaded Log"]
 selected_tab = st.selectbox("🗭 Navigate", tabs, label_visibility="collapsed")
+set_tab(selected_tab)
 
 #===Upload Section===
+def process_batch_file(file, test, emp_id):
+    # one file of a batch upload: the steps of handle_upload without the UI (runs on a batch worker thread)
+    user_folder = os.path.join(SHARED_UPLOAD_FOLDER, test, emp_id)
+    spotfire_folder = os.path.join(SHARED_UPLOAD_FOLDER, "Spotfire", test)
+    stream_path = os.path.join(user_folder, file.name)
+    state, result = wait_job(check_job(file.getvalue(), test))
+    if state == "failed":
+        if isinstance(result, WorkbookError):
+            return {"status": "❌ rejected", "detail": str(result)}
+        raise result
+    checked, _ = result
+    os.makedirs(user_folder, exist_ok=True)
+    _, digest, saved, reused = store_upload(file, SHARED_UPLOAD_FOLDER, [stream_path])
+    if saved[stream_path] is not True:
+        return {"status": "❌ failed", "rows": checked, "detail": f"saving: {saved[stream_path]}"}
+    catalog_add(os.path.join(SHARED_UPLOAD_FOLDER, test), stream_path)
+    enqueue_replication(stream_path, [os.path.join(spotfire_folder, file.name),
+                                      os.path.join(LOCAL_SAVE_FOLDER, test, emp_id, file.name)])
+    row = {"status": "✅ saved", "rows": checked,
+           "detail": stream_path + (" (identical file already stored, linked)" if reused else "")}
+    state, converted = wait_job(convert_job(file.getvalue(), spotfire_folder, file.name,
+                                            provenance={"sha256": digest, "employee": emp_id}, test=test))
+    if state == "failed":
+        row["status"] = "⚠️ saved"
+        row["detail"] += f"; Spotfire Parquet conversion failed: {converted}"
+    elif converted[2]:
+        row["status"] = "⚠️ saved"
+        row["detail"] += f"; {converted[2]} value(s) did not match the {test} column types and were left empty"
+    return row
+
+@st.fragment(run_every=1)
+def wait_for_batch(batch_id):
+    # progress of a running batch, refreshed every second; reruns the page once every file is done
+    done, total, rows = batch_status(batch_id)
+    if done == total:
+        st.rerun()
+    st.progress(done / total, text=f"⏳ {done} / {total} file(s) processed")
+    st.dataframe(rows, hide_index=True, column_order=SUMMARY_COLUMNS)
+
+def handle_batch_upload(test_type, selected_test):
+    files = st.file_uploader("Upload Excel files, or one .zip of them", type=["xlsx", "zip"],
+                             accept_multiple_files=True, key=f"{test_type}_batch_files")
+    batches = st.session_state.setdefault("upload_batches", {})
+    if files and st.button(f"🚀 Upload {len(files)} file(s) to {selected_test}", key=f"{test_type}_batch_start"):
+        items, skipped = expand_uploads(files)
+        process = functools.partial(process_batch_file, test=selected_test, emp_id=st.session_state["employee_id"])
+        batches[test_type] = start_batch(items, process, skipped)
+    status = batch_status(batches[test_type]) if test_type in batches else None
+    if status is None:
+        return
+    done, total, rows = status
+    if done < total:
+        wait_for_batch(batches[test_type])
+        return
+    counts = {icon: sum(row["status"].startswith(icon) for row in rows) for icon in ("✅", "⚠️", "❌", "⏭")}
+    st.success(f"📦 Batch finished: {counts['✅'] + counts['⚠️']} saved, {counts['❌']} rejected or failed, "
+               f"{counts['⏭']} skipped")
+    st.dataframe(rows, hide_index=True, column_order=SUMMARY_COLUMNS)
+
 def handle_upload(test_type, tests_list):
     st.subheader(f"🛠️ Upload {test_type} Test File")
     selected_test = st.selectbox(f"Select {test_type} Test", tests_list)
+    if st.toggle("📦 Batch upload (many files or a .zip)", key=f"{test_type}_batch"):
+        handle_batch_upload(test_type, selected_test)
+        return
     file = st.file_uploader("Upload Excel File", type=["xlsx"])
     if file:
         emp_id = st.session_state["employee_id"]
-        employee_name = employee_df.loc[employee_df['Employee #']==emp_id, 'Name'].values[0]
+        employee_name = employees[emp_id]["Name"]
 
         user_folder = os.path.join(SHARED_UPLOAD_FOLDER, selected_test, emp_id)
         spotfire_folder = os.path.join(SHARED_UPLOAD_FOLDER, "Spotfire", selected_test)
         local_folder = os.path.join(LOCAL_SAVE_FOLDER, selected_test, emp_id)
-        os.makedirs(user_folder, exist_ok=True)
-        os.makedirs(spotfire_folder, exist_ok=True)
-        os.makedirs(local_folder, exist_ok=True)
-
         stream_path = os.path.join(user_folder, file.name)
-        with open(stream_path, "wb") as f:
-            f.write(file.read())
+        spotfire_path = os.path.join(spotfire_folder, file.name)
+        local_path = os.path.join(local_folder, file.name)
 
-        shutil.copy2(stream_path, os.path.join(spotfire_folder, file.name))
-        local_path, saved = save_to_local(stream_path, local_folder)
+        # reruns (other widgets, download clicks) keep the same file: save it only once
+        token = (stream_path,) + upload_token(file)
+        persisted = st.session_state.setdefault("persisted_uploads", {})
+        if token not in persisted:
+            # check sheet / headers / cell types first: a bad file is turned away before any write
+            # (parsing runs in the workbook process pool, this script only polls it)
+            checks = st.session_state.setdefault("workbook_checks", {})
+            if token not in checks:
+                checks[token] = check_job(file.getvalue(), selected_test)
+            state, result = job_result(checks[token])
+            if state == "running":
+                wait_for_job(checks[token], "⏳ Checking workbook…")
+                return
+            if state == "failed":
+                if isinstance(result, WorkbookError):
+                    st.error(f"❌ Upload rejected: {result}")
+                else:
+                    del checks[token]  # submitted again on the next rerun
+                    st.error(f"❌ Workbook check failed: {result}")
+                return
+            checked, preview = result
+            with span("save upload"):
+                os.makedirs(user_folder, exist_ok=True)
+                _, digest, saved, reused = store_upload(file, SHARED_UPLOAD_FOLDER, [stream_path])
+            if saved[stream_path] is not True:
+                st.error(f"❌ Failed saving upload: {saved[stream_path]}")
+                return
+            catalog_add(os.path.join(SHARED_UPLOAD_FOLDER, selected_test), stream_path)
+            # Spotfire / Downloads copies are made in the background
+            enqueue_replication(stream_path, [spotfire_path, local_path])
+            # typed Parquet copy next to the Spotfire .xlsx (converted once, in the pool)
+            converting = convert_job(file.getvalue(), spotfire_folder, file.name,
+                                     provenance={"sha256": token[-1], "employee": emp_id}, test=selected_test)
+            persisted[token] = (reused, checked, preview, converting)
+            del checks[token]
+        digest, (reused, checked, preview, converting) = token[-1], persisted[token]
 
         st.success(f"💾 File saved in `{stream_path}`")
-        st.success(f"📂 Copied to Spotfire folder: `{spotfire_folder}`")
-        if saved is True:
-            st.success(f"💾 Saved to Downloads: `{local_path}`")
-        elif saved is False:
-            st.info(f"💾 Already exists in Downloads: `{local_path}`")
+        st.caption(f"SHA-256: {digest}")
+        if reused:
+            st.info("♻️ Identical file already stored — linked without writing it again")
+        with st.expander(f"👀 Preview ({checked} data rows checked)"):
+            st.dataframe(preview)
+        replication_status(stream_path)
+        state, converted = job_result(converting)
+        if state == "running":
+            wait_for_job(converting, "⏳ Converting for Spotfire…")
+        elif state == "failed":
+            st.warning(f"⚠️ Spotfire Parquet conversion failed: {converted}")
         else:
-            st.error(f"❌ Failed saving to Downloads: {saved}")
+            parquet_path, rows, nulled, appended = converted
+            st.success(f"📊 Converted for Spotfire: `{parquet_path}` ({rows} rows)")
+            if appended:
+                st.caption(f"➕ Added to the {selected_test} dataset")
+            else:
+                st.caption(f"Already in the {selected_test} dataset (same SHA-256), not added again")
+            if nulled:
+                st.warning(f"⚠️ {nulled} value(s) did not match the {selected_test} column types and were left empty")
 
-        st.download_button("📥 Download This File", data=open(stream_path, "rb").read(), file_name=file.name)
+        st.download_button("📥 Download This File", data=deferred_file(stream_path), file_name=file.name, on_click="ignore")
 
 #======= Uploaded Log Section ====
+#=== Bulk download ===
+def export_url(token):
+    # the zip streams from the file server, on the host the browser opened the app with
+    base = FILE_SERVER_URL or f"http://{st.context.headers.get('Host', 'localhost').rsplit(':', 1)[0]}:{FILE_SERVER_PORT}"
+    return f"{base}{EXPORT_PATH}{token}"
+
+def export_entry(test, f):
+    # (selection key, what bulk_download needs to put the file in the zip)
+    if "member" in f:
+        return f"{f['bundle']}::{f['member']}", {"arcname": f"{test}/{f['member']}", "path": f["bundle"],
+                                                 "member": f["member"], "mtime": f["mtime"], "size": f["size"]}
+    return f["path"], {"arcname": f"{test}/{f['employee']}/{f['name']}", "path": f["path"],
+                       "mtime": f["mtime"], "size": f["size"]}
+
+def select_files(selection, test, files, selected=True):
+    for f in files:
+        key, entry = export_entry(test, f)
+        if selected:
+            selection[key] = entry
+        else:
+            selection.pop(key, None)
+        st.session_state[f"sel_{key}"] = selected
+
+def select_all(selection, test, test_folder):
+    select_files(selection, test, catalog_files(test_folder))
+
+def toggle_file(selection, test, f):
+    key, _ = export_entry(test, f)
+    select_files(selection, test, [f], st.session_state[f"sel_{key}"])
+
+def clear_selection(selection):
+    for key in selection:
+        st.session_state[f"sel_{key}"] = False
+    selection.clear()
+
+def select_checkbox(selection, test, f):
+    # tick box of one row; the selection survives paging and switching tests
+    key, entry = export_entry(test, f)
+    st.session_state.setdefault(f"sel_{key}", key in selection)
+    st.checkbox(f"Select {f['name']}", key=f"sel_{key}", label_visibility="collapsed",
+                on_change=toggle_file, args=(selection, test, f))
+
+def render_bulk_download(selection, title):
+    if not selection:
+        st.caption("☑ Tick files below to download several of them as one zip.")
+        return
+    c1, c2, c3 = st.columns([0.5, 0.25, 0.25])
+    with c1: st.write(f"☑ {len(selection)} file(s) selected — {human_size(sum(e['size'] for e in selection.values()))}")
+    with c2: prepare = st.button("📦 Download selected", key=f"{title}_bulk")
+    with c3: st.button("✖ Clear selection", key=f"{title}_clear", on_click=clear_selection, args=(selection,))
+    if prepare:
+        token = register_export(selection.values(), export_name(title))
+        st.link_button("⬇ Save zip", export_url(token))
+        st.caption("The zip is streamed while it downloads, so it starts right away; the link works for an hour.")
+
+def render_archived(test_folder, months, key, page_size, selection, test):
+    # files packed into monthly bundles by upload_archive.py: pick a month, download single files
+    if not st.toggle(f"🗄 Show archived files ({sum(n for _, n in months)})", key=f"{key}_archived"):
+        return
+    counts = dict(months)
+    month = st.selectbox("Month", list(counts), format_func=lambda m: f"{m} — {counts[m]} file(s)",
+                         key=f"{key}_month")
+    page = page_controls(f"{key}_archive_page", -(-counts[month] // page_size))
+    for f in archived_page(test_folder, month, page_size, page * page_size):
+        emp_id = f["employee"]
+        employee_name = employees[emp_id]["Name"] if emp_id in employees else emp_id
+        c0, c1, c2, c3 = st.columns([0.05, 0.4, 0.3, 0.25])
+        with c0: select_checkbox(selection, test, f)
+        with c1: st.write(f"{f['name']} (by {employee_name})")
+        with c2: st.write(f"Size: {human_size(f['size'])} 🗄")
+        with c3:
+            try:
+                st.download_button("📥", data=deferred_member(f["bundle"], f["member"]), file_name=f['name'],
+                                   key=f"dl_{f['bundle']}_{f['member']}", on_click="ignore")
+            except Exception as e:
+                st.error(f"Download failed: {e}")
+    st.markdown("---")
+
 def render_uploaded_log(test_list, title):
     st.markdown(f"### {title}")
     container = st.container()
     page_size = st.slider("Rows per page", 5, 50, 20, 5, key=f"{title}_slider")
-    for test in test_list:
-        test_folder = os.path.join(SHARED_UPLOAD_FOLDER, test)
-        os.makedirs(test_folder, exist_ok=True)
-        files = list_files_fast(test_folder)
-        total = len(files)
-        with container.expander(f"📁 {test} — {total} file(s)", expanded=False):
-            if total == 0:
-                st.info("No files in this test yet.")
-                continue
-            page_files = files[:page_size]
-            for f in page_files:
-                emp_id = f["employee"]
-                employee_name = employee_df.loc[employee_df['Employee #']==emp_id, 'Name'].values[0] if emp_id in employee_ids else emp_id
-                c1, c2, c3 = st.columns([0.4, 0.3, 0.3])
-                with c1: st.write(f"{f['name']} (by {employee_name})")
-                with c2: st.write(f"Size: {human_size(f['size'])}")
-                with c3:
-                    try:
-                        with open(f["path"], "rb") as file_data:
-                            st.download_button("📥", data=file_data.read(), file_name=f['name'])
-                    except Exception as e:
-                        st.error(f"Download failed: {e}")
+    rescan = st.button("🔄 Rescan folders", key=f"{title}_rescan")
+    selection = st.session_state.setdefault(f"{title}_selection", {})
+    with container:
+        render_bulk_download(selection, title)
+    test_folders = {test: os.path.join(SHARED_UPLOAD_FOLDER, test) for test in test_list}
+    with span("list_files_fast"):
+        stale = [folder for folder in test_folders.values() if rescan or catalog_is_stale(folder)]
+        for folder in stale:
+            os.makedirs(folder, exist_ok=True)
+            if rescan:
+                forget_scan_cache(folder)
+        for folder, files in list_folders_fast(stale).items():
+            reconcile_catalog(folder, files)
+    with span("render rows"):
+        for test in test_list:
+            test_folder = test_folders[test]
+            total = catalog_count(test_folder)
+            months = archived_months(test_folder)
+            archived = sum(n for _, n in months)
+            label = f"📁 {test} — {total} file(s)" + (f" + {archived} archived" if archived else "")
+            with container.expander(label, expanded=False):
+                if months:
+                    render_archived(test_folder, months, f"{title}_{test}", page_size, selection, test)
+                if total == 0:
+                    st.info("No recent files in this test." if months else "No files in this test yet.")
+                    continue
+                pages = -(-total // page_size)
+                page = page_controls(f"{title}_{test}_page", pages)
+                cursors = st.session_state.setdefault(f"{title}_{test}_cursors", {})
+                page_files = catalog_page_at(test_folder, page, page_size, cursors)
+                copies = replication_states([f["path"] for f in page_files])
+                s1, s2 = st.columns(2)
+                with s1: st.button("☑ Select page", key=f"{title}_{test}_select_page",
+                                   on_click=select_files, args=(selection, test, page_files))
+                with s2: st.button(f"☑ Select all {total}", key=f"{title}_{test}_select_all",
+                                   on_click=select_all, args=(selection, test, test_folder))
+                for f in page_files:
+                    emp_id = f["employee"]
+                    employee_name = employees[emp_id]["Name"] if emp_id in employees else emp_id
+                    c0, c1, c2, c3 = st.columns([0.05, 0.4, 0.3, 0.25])
+                    with c0: select_checkbox(selection, test, f)
+                    with c1: st.write(f"{f['name']} (by {employee_name})")
+                    with c2: st.write(f"Size: {human_size(f['size'])} {replication_badge(copies[f['path']])}")
+                    with c3:
+                        try:
+                            st.download_button("📥", data=deferred_file(f["path"]), file_name=f['name'],
+                                               key=f"dl_{f['path']}", on_click="ignore")
+                        except Exception as e:
+                            st.error(f"Download failed: {e}")
 
 #======Main Tabs=====
 if selected_tab == "📁 MI Upload":
@@ -207,4 +481,9 @@ elif selected_tab == "📋 Uploaded Log":
     st.markdown("---")
     render_uploaded_log(cl_tests, "🧪 Chemlab Tests")
 
-st.markdown("<hr><div class='footer'>📘 Made with passion by RE PN LAB 2025</div>", unsafe_allow_html=True)
\ No newline at end of file
+st.markdown("<hr><div class='footer'>📘 Made with passion by RE PN LAB 2025</div>", unsafe_allow_html=True)
+if is_admin(st.session_state["employee_id"]):
+    render_stage_timings()
+    render_profiler()
+finish_rerun()
+finish_profile(current_tab())
\ No newline at end of file
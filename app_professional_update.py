@@ -1,12 +1,31 @@
 import streamlit as st
 import os
-import pandas as pd
+import functools
 from datetime import datetime
+from file_catalog import (archived_months, archived_page, catalog_add, catalog_count, catalog_files,
+                          catalog_is_stale, catalog_page_at, reconcile_catalog)
+from file_scanner import forget_scan_cache, scan_files, scan_folders
+from file_download import deferred_file, deferred_member
+from employee_directory import employee_index, is_admin, read_employee_list
+from blob_store import store_upload
+from upload_io import upload_token
+from workbook_jobs import check_job, job_result, wait_job, warm_pool
+from batch_upload import SUMMARY_COLUMNS, batch_status, expand_uploads, start_batch
+from workbook_validation import WorkbookError
+from file_server import EXPORT_PATH, FILE_SERVER_PORT, FILE_SERVER_URL, serve_folder
+from bulk_download import export_name, register_export
+from stage_timing import (METRICS_FILE, METRICS_INTERVAL, current_tab, finish_rerun, set_tab, span,
+                          stage_summary, start_metrics_writer, start_rerun)
+from rerun_profiler import PROFILE_DIR, finish_profile, profiled_employees, set_profiled, start_profile
+from prewarm import prewarm
+
+start_rerun()
+start_metrics_writer()
+start_profile(st.session_state.get("employee_id"))
 
 #==================CONFIG================
 #NAS / Shared folder
 SHARED_UPLOAD_FOLDER = r"\\mpl-op-genmp01.wdc.com\PN-RELAB\RE Ctrl Nasuni\Digitalization"
-os.makedirs(SHARED_UPLOAD_FOLDER, exist_ok=True)
 
 # Employee list paths
 NAS_EMPLOYEE_LIST_PATH = os.path.join(SHARED_UPLOAD_FOLDER, "EMPLOYEE_LIST.xlsx")
@@ -59,6 +78,34 @@ st.markdown("""
 st.markdown('<div class="header">📊 RE PN LAB Dashboard</div>', unsafe_allow_html=True)
 
 #========HELPERS===========
+def render_stage_timings():
+    #admin-only: p50/p95/p99 per tab and stage over the recent reruns of all sessions
+    with st.sidebar.expander("⏱ Stage timings"):
+        rows = stage_summary()
+        if not rows:
+            st.caption("Nothing measured yet.")
+            return
+        st.dataframe([{"tab": r["tab"], "stage": r["stage"], "runs": r["count"],
+                       "p50 ms": round(r["p50"] * 1000, 1), "p95 ms": round(r["p95"] * 1000, 1),
+                       "p99 ms": round(r["p99"] * 1000, 1)} for r in rows], hide_index=True)
+        if METRICS_FILE:
+            st.caption(f"Written to `{METRICS_FILE}` every {METRICS_INTERVAL}s")
+
+def toggle_profiling(on: bool):
+    emp_id = st.session_state["profile_employee"].strip()
+    if emp_id:
+        set_profiled(emp_id, on)
+
+def render_profiler():
+    #admin-only: profile every rerun of one employee until stopped (rerun_profiler)
+    with st.sidebar.expander("🔬 Profiler"):
+        st.text_input("Employee number", key="profile_employee")
+        p1, p2 = st.columns(2)
+        with p1: st.button("Start", key="profile_start", on_click=toggle_profiling, args=(True,))
+        with p2: st.button("Stop", key="profile_stop", on_click=toggle_profiling, args=(False,))
+        from_env, switched_on = profiled_employees()
+        st.caption(f"Profiling: {', '.join(from_env + switched_on) or 'nobody'} → `{PROFILE_DIR}`")
+
 def human_size(num_bytes: int) -> str:
     for unit in ["B", "KB", "MB", "GB", "TB"]:
         if num_bytes < 1024.0:
@@ -67,38 +114,46 @@ def human_size(num_bytes: int) -> str:
     return f"{num_bytes:.1f} PB"
 
 def list_files_fast(folder: str):
-    files_list = []
-    for root, _, files in os.walk(folder):
-        for file in files:
-            try:
-                path = os.path.join(root, file)
-                stat = os.stat(path)
-                files_list.append({
-                    "name": file,
-                    "path": path,
-                    "size": stat.st_size,
-                    "mtime": stat.st_mtime,
-                    "folder": os.path.basename(root)
-                })
-            except FileNotFoundError:
-                continue
-    files_list.sort(key=lambda x: x["mtime"], reverse=True)
-    return files_list
+    # incremental: only folders whose mtime changed since the last call are re-read
+    return scan_files(folder, owner_key="folder")
+
+def list_folders_fast(folders):
+    # scans several test folders in parallel -> {folder: files}
+    return scan_folders(folders, owner_key="folder")
+
+def page_controls(key, pages):
+    # prev / next buttons and a jump-to-page box; returns the 0-based page to show
+    page = min(st.session_state.get(key, 1), pages)
+    st.session_state[key] = page
+    def step(delta):
+        st.session_state[key] = min(max(st.session_state[key] + delta, 1), pages)
+    c1, c2, c3 = st.columns([0.2, 0.6, 0.2])
+    with c1: st.button("◀ Prev", key=f"{key}_prev", on_click=step, args=(-1,), disabled=page <= 1)
+    with c2:
+        st.number_input("Page", min_value=1, max_value=pages, step=1, key=key)
+        st.caption(f"of {pages}")
+    with c3: st.button("Next ▶", key=f"{key}_next", on_click=step, args=(1,), disabled=page >= pages)
+    return st.session_state[key] - 1
+
+@st.fragment(run_every=1)
+def wait_for_job(job_id, message):
+    # polls a workbook job every second; reruns the page once it has finished
+    if job_result(job_id)[0] == "running":
+        st.info(message)
+    else:
+        st.rerun()
 
 #==========LOAD EMPLOYEE LIST===========
 def load_employee_list():
     if os.path.exists(NAS_EMPLOYEE_LIST_PATH):
         try:
-            df = pd.read_excel(NAS_EMPLOYEE_LIST_PATH, dtype=str)
+            df = read_employee_list(NAS_EMPLOYEE_LIST_PATH)
             return df
         except:
             pass
     st.error("❌ Employee list not found!")
     st.stop()
 
-employee_df = load_employee_list()
-employee_ids = employee_df['Employee #'].tolist()
-
 #===========LOGIN===========
 if "authenticated" not in st.session_state:
     st.session_state["authenticated"] = False
@@ -110,10 +165,11 @@ def check_employee_id():
             emp_id = st.text_input("Enter Employee #")
             submitted = st.form_submit_button("Login")
             if submitted:
-                if emp_id in employee_ids:
+                employees = employee_index(load_employee_list())
+                if emp_id in employees:
                     st.session_state["authenticated"] = True
                     st.session_state["employee_id"] = emp_id
-                    employee_name = employee_df.loc[employee_df['Employee #']==emp_id, 'Name'].values[0]
+                    employee_name = employees[emp_id]["Name"]
                     st.success(f"Welcome {employee_name}")
                     st.rerun()
                 else:
@@ -122,9 +178,18 @@ def check_employee_id():
     return True
 
 if not check_employee_id():
+    #login page: nothing above loads pandas or touches the NAS; the form is already on its
+    #way to the browser, so the slow first-time work of the pages after login starts now
+    prewarm("employee list", read_employee_list, NAS_EMPLOYEE_LIST_PATH)
+    prewarm("workbook pool", warm_pool)
     st.stop()
 
-emp_name = employee_df.loc[employee_df['Employee #']==st.session_state["employee_id"], 'Name'].values[0]
+with span("load_employee_list"):
+    employee_df = load_employee_list()
+    employees = employee_index(employee_df)
+prewarm("upload folders", os.makedirs, SHARED_UPLOAD_FOLDER, exist_ok=True)  # once per process, off the page
+
+emp_name = employees[st.session_state["employee_id"]]["Name"]
 st.sidebar.success(f"Logged in as: {emp_name}")
 
 #==========SPOTFIRE URLS==========
@@ -151,54 +216,247 @@ cl_tests = list(SPOTFIRE_CHEMLAB_URLS.keys())
 # ================== SIDEBAR ==================
 tabs = ["📁 MI Upload", "📁 Chemlab Upload", "📈 Spotfire Dashboards", "📋 Uploaded Log"]
 selected_tab = st.sidebar.radio("Navigate", tabs)
+set_tab(selected_tab)
 
 #==============UPLOAD HANDLER===========
+def process_batch_file(file, test):
+    # one file of a batch upload: the steps of handle_upload without the UI (runs on a batch worker thread)
+    test_folder = os.path.join(SHARED_UPLOAD_FOLDER, test)
+    save_path = os.path.join(test_folder, file.name)
+    state, result = wait_job(check_job(file.getvalue(), test))
+    if state == "failed":
+        if isinstance(result, WorkbookError):
+            return {"status": "❌ rejected", "detail": str(result)}
+        raise result
+    checked, _ = result
+    os.makedirs(test_folder, exist_ok=True)
+    _, digest, saved, reused = store_upload(file, SHARED_UPLOAD_FOLDER, [save_path])
+    if saved[save_path] is not True:
+        return {"status": "❌ failed", "rows": checked, "detail": f"saving: {saved[save_path]}"}
+    catalog_add(test_folder, save_path)
+    return {"status": "✅ saved", "rows": checked,
+            "detail": save_path + (" (identical file already stored, linked)" if reused else "")}
+
+@st.fragment(run_every=1)
+def wait_for_batch(batch_id):
+    # progress of a running batch, refreshed every second; reruns the page once every file is done
+    done, total, rows = batch_status(batch_id)
+    if done == total:
+        st.rerun()
+    st.progress(done / total, text=f"⏳ {done} / {total} file(s) processed")
+    st.dataframe(rows, hide_index=True, column_order=SUMMARY_COLUMNS)
+
+def handle_batch_upload(test_type, selected_test):
+    files = st.file_uploader("Upload Excel files, or one .zip of them", type=["xlsx", "zip"],
+                             accept_multiple_files=True, key=f"{test_type}_batch_files")
+    batches = st.session_state.setdefault("upload_batches", {})
+    if files and st.button(f"🚀 Upload {len(files)} file(s) to {selected_test}", key=f"{test_type}_batch_start"):
+        items, skipped = expand_uploads(files)
+        batches[test_type] = start_batch(items, functools.partial(process_batch_file, test=selected_test), skipped)
+    status = batch_status(batches[test_type]) if test_type in batches else None
+    if status is None:
+        return
+    done, total, rows = status
+    if done < total:
+        wait_for_batch(batches[test_type])
+        return
+    counts = {icon: sum(row["status"].startswith(icon) for row in rows) for icon in ("✅", "❌", "⏭")}
+    st.success(f"📦 Batch finished: {counts['✅']} saved, {counts['❌']} rejected or failed, {counts['⏭']} skipped")
+    st.dataframe(rows, hide_index=True, column_order=SUMMARY_COLUMNS)
+
 def handle_upload(test_type, tests_list):
     st.subheader(f"🛠️ Upload {test_type} Test File")
     selected_test = st.selectbox(f"Select {test_type} Test", tests_list)
+    if st.toggle("📦 Batch upload (many files or a .zip)", key=f"{test_type}_batch"):
+        handle_batch_upload(test_type, selected_test)
+        return
     file = st.file_uploader("Upload Excel File", type=["xlsx"])
     if file:
         emp_id = st.session_state["employee_id"]
-        employee_name = employee_df.loc[employee_df['Employee #']==emp_id, 'Name'].values[0]
+        employee_name = employees[emp_id]["Name"]
 
         test_folder = os.path.join(SHARED_UPLOAD_FOLDER, selected_test)
-        os.makedirs(test_folder, exist_ok=True)
-
         save_path = os.path.join(test_folder, file.name)
-        with open(save_path, "wb") as f:
-            f.write(file.read())
+
+        # reruns (other widgets, download clicks) keep the same file: save it only once
+        token = (save_path,) + upload_token(file)
+        persisted = st.session_state.setdefault("persisted_uploads", {})
+        if token not in persisted:
+            # check sheet / headers / cell types first: a bad file is turned away before any write
+            # (parsing runs in the workbook process pool, this script only polls it)
+            checks = st.session_state.setdefault("workbook_checks", {})
+            if token not in checks:
+                checks[token] = check_job(file.getvalue(), selected_test)
+            state, result = job_result(checks[token])
+            if state == "running":
+                wait_for_job(checks[token], "⏳ Checking workbook…")
+                return
+            if state == "failed":
+                if isinstance(result, WorkbookError):
+                    st.error(f"❌ Upload rejected: {result}")
+                else:
+                    del checks[token]  # submitted again on the next rerun
+                    st.error(f"❌ Workbook check failed: {result}")
+                return
+            checked, preview = result
+            with span("save upload"):
+                os.makedirs(test_folder, exist_ok=True)
+                _, digest, saved, reused = store_upload(file, SHARED_UPLOAD_FOLDER, [save_path])
+            if saved[save_path] is not True:
+                st.error(f"❌ Failed saving upload: {saved[save_path]}")
+                return
+            catalog_add(test_folder, save_path)
+            persisted[token] = (reused, checked, preview)
+            del checks[token]
+        digest, (reused, checked, preview) = token[-1], persisted[token]
 
         st.success(f"💾 File saved to shared folder: `{save_path}`")
-        st.download_button("📥 Download This File", data=open(save_path, "rb").read(), file_name=file.name)
+        st.caption(f"SHA-256: {digest}")
+        if reused:
+            st.info("♻️ Identical file already stored — linked without writing it again")
+        with st.expander(f"👀 Preview ({checked} data rows checked)"):
+            st.dataframe(preview)
+        st.download_button("📥 Download This File", data=deferred_file(save_path), file_name=file.name, on_click="ignore")
 
 #========FILE LOG=======
+#=== Bulk download ===
+def export_url(token):
+    # the zip streams from the file server, on the host the browser opened the app with
+    base = FILE_SERVER_URL or f"http://{st.context.headers.get('Host', 'localhost').rsplit(':', 1)[0]}:{FILE_SERVER_PORT}"
+    return f"{base}{EXPORT_PATH}{token}"
+
+def export_entry(test, f):
+    # (selection key, what bulk_download needs to put the file in the zip)
+    if "member" in f:
+        return f"{f['bundle']}::{f['member']}", {"arcname": f"{test}/{f['member']}", "path": f["bundle"],
+                                                 "member": f["member"], "mtime": f["mtime"], "size": f["size"]}
+    return f["path"], {"arcname": f"{test}/{f['folder']}/{f['name']}", "path": f["path"],
+                       "mtime": f["mtime"], "size": f["size"]}
+
+def select_files(selection, test, files, selected=True):
+    for f in files:
+        key, entry = export_entry(test, f)
+        if selected:
+            selection[key] = entry
+        else:
+            selection.pop(key, None)
+        st.session_state[f"sel_{key}"] = selected
+
+def select_all(selection, test, test_folder):
+    select_files(selection, test, catalog_files(test_folder, owner_key="folder"))
+
+def toggle_file(selection, test, f):
+    key, _ = export_entry(test, f)
+    select_files(selection, test, [f], st.session_state[f"sel_{key}"])
+
+def clear_selection(selection):
+    for key in selection:
+        st.session_state[f"sel_{key}"] = False
+    selection.clear()
+
+def select_checkbox(selection, test, f):
+    # the selection survives paging and switching tests
+    key, entry = export_entry(test, f)
+    st.session_state.setdefault(f"sel_{key}", key in selection)
+    st.checkbox("Select", key=f"sel_{key}", on_change=toggle_file, args=(selection, test, f))
+
+def render_bulk_download(selection, title):
+    if not selection:
+        st.caption("☑ Select files below to download several of them as one zip.")
+        return
+    c1, c2, c3 = st.columns([0.5, 0.25, 0.25])
+    with c1: st.write(f"☑ {len(selection)} file(s) selected — {human_size(sum(e['size'] for e in selection.values()))}")
+    with c2: prepare = st.button("📦 Download selected", key=f"{title}_bulk")
+    with c3: st.button("✖ Clear selection", key=f"{title}_clear", on_click=clear_selection, args=(selection,))
+    if prepare:
+        try:
+            serve_folder(SHARED_UPLOAD_FOLDER, FILE_SERVER_PORT)  # started on first use, once per process
+        except OSError as e:
+            st.error(f"File server could not start: {e}")
+            return
+        token = register_export(selection.values(), export_name(title))
+        st.link_button("⬇ Save zip", export_url(token))
+        st.caption("The zip is streamed while it downloads, so it starts right away; the link works for an hour.")
+
+def render_archived(test_folder, months, key, page_size, selection, test):
+    #files moved into monthly zip bundles by upload_archive.py, listed from the catalog index
+    if not st.toggle(f"🗄 Show archived files ({sum(n for _, n in months)})", key=f"{key}_archived"):
+        return
+    counts = dict(months)
+    month = st.selectbox("Month", list(counts), format_func=lambda m: f"{m} — {counts[m]} file(s)",
+                         key=f"{key}_month")
+    page = page_controls(f"{key}_archive_page", -(-counts[month] // page_size))
+    for f in archived_page(test_folder, month, page_size, page * page_size, owner_key="folder"):
+        st.markdown(f"""
+        <div class="card">
+            <b>🗄 {f['name']}</b><br>
+            Folder: {f['folder']} | Size: {human_size(f['size'])} | Date: {datetime.fromtimestamp(f['mtime']).strftime('%d-%b-%Y %H:%M')}
+        </div>
+        """, unsafe_allow_html=True)
+        c1, c2 = st.columns([0.8, 0.2])
+        with c1: select_checkbox(selection, test, f)
+        with c2:
+            try:
+                st.download_button("📥", data=deferred_member(f["bundle"], f["member"]), file_name=f['name'],
+                                   key=f"dl_{f['bundle']}_{f['member']}", on_click="ignore")
+            except:
+                st.error("Download failed!")
+    st.markdown("---")
+
 def render_uploaded_log(tests_list, title):
     st.markdown(f"### {title}")
     container = st.container()
     page_size = st.slider("Rows per page", 5, 50, 20, 5, key=f"{title}_slider")
-    for test in tests_list:
-        test_folder = os.path.join(SHARED_UPLOAD_FOLDER, test)
-        os.makedirs(test_folder, exist_ok=True)
-        files = list_files_fast(test_folder)
-        total = len(files)
-        with container.expander(f"📁 {test} — {total} file(s)", expanded=True):
-            if total == 0:
-                st.info("No files in this test yet.")
-                continue
-            for f in files[:page_size]:
-                st.markdown(f"""
-                <div class="card">
-                    <b>{f['name']}</b><br>
-                    Folder: {f['folder']} | Size: {human_size(f['size'])} | Date: {datetime.fromtimestamp(f['mtime']).strftime('%d-%b-%Y %H:%M')}
-                </div>
-                """, unsafe_allow_html=True)
-                c1, c2 = st.columns([0.8, 0.2])
-                with c2:
-                    try:
-                        with open(f["path"], "rb") as file_data:
-                            st.download_button("📥", data=file_data.read(), file_name=f['name'])
-                    except:
-                        st.error("Download failed!")
+    rescan = st.button("🔄 Rescan folders", key=f"{title}_rescan")
+    selection = st.session_state.setdefault(f"{title}_selection", {})
+    with container:
+        render_bulk_download(selection, title)
+    test_folders = {test: os.path.join(SHARED_UPLOAD_FOLDER, test) for test in tests_list}
+    with span("list_files_fast"):
+        stale = [folder for folder in test_folders.values() if rescan or catalog_is_stale(folder)]
+        for folder in stale:
+            os.makedirs(folder, exist_ok=True)
+            if rescan:
+                forget_scan_cache(folder)
+        for folder, files in list_folders_fast(stale).items():
+            reconcile_catalog(folder, files)
+    with span("render rows"):
+        for test in tests_list:
+            test_folder = test_folders[test]
+            total = catalog_count(test_folder)
+            months = archived_months(test_folder)
+            archived = sum(n for _, n in months)
+            label = f"📁 {test} — {total} file(s)" + (f" + {archived} archived" if archived else "")
+            with container.expander(label, expanded=True):
+                if months:
+                    render_archived(test_folder, months, f"{title}_{test}", page_size, selection, test)
+                if total == 0:
+                    st.info("No recent files in this test." if months else "No files in this test yet.")
+                    continue
+                pages = -(-total // page_size)
+                page = page_controls(f"{title}_{test}_page", pages)
+                cursors = st.session_state.setdefault(f"{title}_{test}_cursors", {})
+                page_files = catalog_page_at(test_folder, page, page_size, cursors, owner_key="folder")
+                s1, s2 = st.columns(2)
+                with s1: st.button("☑ Select page", key=f"{title}_{test}_select_page",
+                                   on_click=select_files, args=(selection, test, page_files))
+                with s2: st.button(f"☑ Select all {total}", key=f"{title}_{test}_select_all",
+                                   on_click=select_all, args=(selection, test, test_folder))
+                for f in page_files:
+                    st.markdown(f"""
+                    <div class="card">
+                        <b>{f['name']}</b><br>
+                        Folder: {f['folder']} | Size: {human_size(f['size'])} | Date: {datetime.fromtimestamp(f['mtime']).strftime('%d-%b-%Y %H:%M')}
+                    </div>
+                    """, unsafe_allow_html=True)
+                    c1, c2 = st.columns([0.8, 0.2])
+                    with c1: select_checkbox(selection, test, f)
+                    with c2:
+                        try:
+                            st.download_button("📥", data=deferred_file(f["path"]), file_name=f['name'],
+                                               key=f"dl_{f['path']}", on_click="ignore")
+                        except:
+                            st.error("Download failed!")
 
 #===========MAIN=================
 if selected_tab == "📁 MI Upload":
@@ -225,4 +483,9 @@ elif selected_tab == "📋 Uploaded Log":
     st.markdown("---")
     render_uploaded_log(cl_tests, "🧪 Chemlab Tests")
 
-st.markdown("<div class='footer'>📘 Made with passion by RE PN LAB 2025</div>", unsafe_allow_html=True)
\ No newline at end of file
+st.markdown("<div class='footer'>📘 Made with passion by RE PN LAB 2025</div>", unsafe_allow_html=True)
+if is_admin(st.session_state["employee_id"]):
+    render_stage_timings()
+    render_profiler()
+finish_rerun()
+finish_profile(current_tab())
\ No newline at end of file
@@ -0,0 +1,146 @@
+import functools
+import io
+import os
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+#=== Batch upload ===
+#Batch mode of handle_upload: many .xlsx files (or one .zip of them) in one action instead
+#of one file_uploader round trip, and one full rerun, per file.
+#expand_uploads turns the uploaded files into BatchFile objects, which behave like
+#st.file_uploader's UploadedFile (name, size, getvalue, getbuffer, seek/read), so a
+#script's per-file function uses the same upload_token / store_upload calls as a single
+#upload. A BatchFile is read on demand: a member of a zip is only decompressed by the
+#batch worker that processes it (zf.open, streamed), so starting a 200-file batch does
+#not unpack 200 workbooks into memory at once. start_batch runs that function for every file on a thread pool shared by all
+#sessions of the process; at most BATCH_WORKERS files (RE_PN_LAB_BATCH_WORKERS) are in
+#flight at once, so a 200-file zip cannot flood the NAS or the workbook process pool.
+#Workbook parsing itself still happens in the process pool (workbook_jobs). Each file ends
+#as one summary row; an exception in one file only fails that row.
+
+BATCH_WORKERS = int(os.environ.get("RE_PN_LAB_BATCH_WORKERS", "4"))
+BATCH_RETENTION = 3600  # seconds a finished batch's summary stays available
+MAX_MEMBER_BYTES = 200 * 1024 * 1024  # a larger .xlsx inside a zip is skipped, not unpacked
+SUMMARY_COLUMNS = ("file", "status", "rows", "detail")  # column order of the summary table
+
+_executor = None
+_batches = {}  # batch id -> (started at, [(name, Future or finished row)])
+_lock = threading.Lock()
+
+class BatchFile:
+    def __init__(self, name: str, size: int, opener):
+        #opener() returns a new binary file object positioned at the start of the data
+        self.name = name
+        self.size = size
+        self._opener = opener
+        self._stream = None  # opened by the first seek/read
+
+    def getvalue(self) -> bytes:
+        with self._opener() as f:
+            return f.read()
+
+    def getbuffer(self):
+        return memoryview(self.getvalue())
+
+    def seek(self, offset: int, whence=io.SEEK_SET) -> int:
+        if self._stream is None:
+            self._stream = self._opener()
+        return self._stream.seek(offset, whence)
+
+    def read(self, size=-1) -> bytes:
+        if self._stream is None:
+            self._stream = self._opener()
+        return self._stream.read(size)
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+def _open_member(zf, info, lock):
+    #members of one zip share its ZipFile; opening one reads the shared file position
+    with lock:
+        return zf.open(info)
+
+def _skipped(name: str, reason: str):
+    return {"file": name, "status": "⏭ skipped", "detail": reason}
+
+def expand_uploads(files):
+    #files = UploadedFiles (.xlsx or .zip); returns ([BatchFile], [summary rows of skipped entries])
+    #only the zip directories are read here, no member data
+    items, skipped, names = [], [], set()
+    def add(name, size, opener):
+        if name in names:
+            skipped.append(_skipped(name, "another file of this batch has the same name"))
+            return
+        names.add(name)
+        items.append(BatchFile(name, size, opener))
+    for f in files:
+        #a private BytesIO over the upload's bytes (getvalue does not copy them), so the
+        #workers never move the read position of the UploadedFile the script holds
+        if not f.name.lower().endswith(".zip"):
+            add(f.name, f.size, functools.partial(io.BytesIO, f.getvalue()))
+            continue
+        try:
+            zf = zipfile.ZipFile(io.BytesIO(f.getvalue()))  # stays open while its members are processed
+            lock = threading.Lock()
+            for info in zf.infolist():
+                name = os.path.basename(info.filename)
+                if info.is_dir() or name.startswith(("~$", "._")) or "__MACOSX" in info.filename:
+                    continue  # folders, Excel lock files, macOS metadata
+                if not name.lower().endswith(".xlsx"):
+                    skipped.append(_skipped(f"{f.name}/{info.filename}", "not an .xlsx file"))
+                elif info.file_size > MAX_MEMBER_BYTES:
+                    skipped.append(_skipped(f"{f.name}/{info.filename}", "too large"))
+                else:
+                    add(name, info.file_size, functools.partial(_open_member, zf, info, lock))
+        except zipfile.BadZipFile:
+            skipped.append(_skipped(f.name, "not a readable .zip"))
+    return items, skipped
+
+def _run(process, file):
+    try:
+        row = process(file)
+    except Exception as e:
+        row = {"status": "❌ failed", "detail": str(e) or type(e).__name__}
+    finally:
+        file.close()
+    return {"file": file.name, **row}
+
+def start_batch(files, process, skipped=()) -> str:
+    #process(file) -> summary row dict ("status", "detail", ...); returns the batch id
+    global _executor
+    with _lock:
+        now = time.time()
+        for batch_id in [b for b, (at, entries) in _batches.items()
+                         if now - at > BATCH_RETENTION and all(_finished(e) for _, e in entries)]:
+            del _batches[batch_id]
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix="batch-upload")
+        entries = [(f.name, _executor.submit(_run, process, f)) for f in files]
+        entries += [(row["file"], row) for row in skipped]
+        batch_id = uuid.uuid4().hex
+        _batches[batch_id] = (now, entries)
+        return batch_id
+
+def _finished(entry) -> bool:
+    return isinstance(entry, dict) or entry.done()
+
+def batch_status(batch_id: str):
+    #(files finished, files in the batch, summary rows in upload order), or None if unknown
+    batch = _batches.get(batch_id)
+    if batch is None:
+        return None
+    rows = []
+    for name, entry in batch[1]:
+        if isinstance(entry, dict):
+            rows.append(entry)
+        elif entry.done():
+            rows.append(entry.result())
+        else:
+            rows.append({"file": name, "status": "🔄 working" if entry.running() else "⏳ queued"})
+    done = sum(_finished(entry) for _, entry in batch[1])
+    return done, len(batch[1]), rows
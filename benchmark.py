@@ -0,0 +1,356 @@
+import argparse
+import ast
+import builtins
+import functools
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+#=== Benchmark suite ===
+#Times the hot paths of the app against a synthetic upload tree shaped like the NAS:
+#  <uploads>/<test>/<employee>/*.xlsx   + the employee workbook
+#at any size (1k, 100k, 1M files...), optionally with a delay added to every file-system
+#call on that tree to mimic the NAS round trip. Runs on a plain Linux box: the script's
+#Windows paths (SHARED_UPLOAD_FOLDER, EMPLOYEE_LIST_PATH) are read from its source and,
+#being relative names on Linux, land inside the work folder. Nothing touches the real NAS.
+#  python benchmark.py --files 1000,100000 --latency-ms 0,2 --repeat 3
+#  python benchmark.py --files 1000,100000 --latency-ms 0,2 --save-baseline
+#Cases (each repeat runs in a fresh process, so no cache survives from the previous one):
+#  startup              cold start: the login page, then logging in through the form
+#                       LOGIN_THINK_TIME seconds later (someone typing their number)
+#  load_employee_list   read_employee_list: parse / pickle sidecar / in-memory
+#  list_files_fast      scan_files on every test folder, cold and incremental
+#  list_folders_fast    scan_folders over all test folders at once, cold
+#  render_uploaded_log  the script's Uploaded Log tab (AppTest), empty catalog then warm
+#  handle_upload        the script's upload tab, one workbook until saved and converted
+#The median of the repeats is compared with BASELINE_PATH; a case more than --tolerance
+#slower than its baseline (and by more than NOISE_FLOOR) is a regression and the exit
+#code is 1. Baselines only mean something on the machine they were recorded on.
+#Generated trees are kept in --workdir and reused while their parameters are unchanged.
+#Files are hardlinks to a few template workbooks, so 1M files cost inodes, not gigabytes.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(HERE, "benchmark_baseline.json")
+DEFAULT_WORKDIR = os.path.join(tempfile.gettempdir(), "re-pn-lab-bench")
+DEFAULT_SCRIPT = "TEST5.py"
+TOLERANCE = 0.25
+NOISE_FLOOR = 0.005  # seconds; smaller slowdowns are never reported
+LOGIN_THINK_TIME = 3.0  # seconds between the login page and pressing Login, not timed
+TREE_VERSION = 1  # bump when generate_tree changes, so old trees are rebuilt
+EMPLOYEES_PER_TEST = 40
+FIRST_EMPLOYEE = 1000000000  # generated Employee # values count up from here; the benchmark logs in as this one
+LINKS_PER_TEMPLATE = 50000  # below ext4's 65000 hardlinks per inode
+TEMPLATE_ROWS = 50
+NAS_CALLS = ("stat", "lstat", "scandir", "listdir", "mkdir", "rmdir", "remove", "unlink",
+             "rename", "replace", "link", "utime", "open")
+
+def script_settings(script: str):
+    #the script's NAS paths and test names, read from its source without running it
+    with open(script, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    values = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            try:
+                values[node.targets[0].id] = ast.literal_eval(node.value)
+            except (ValueError, TypeError, SyntaxError):
+                pass  # not a plain literal
+    try:
+        return {
+            "uploads": values["SHARED_UPLOAD_FOLDER"],
+            "employee_list": values["EMPLOYEE_LIST_PATH"],
+            "tests": list(values["SPOTFIRE_MI_URLS"]) + list(values["SPOTFIRE_CHEMLAB_URLS"]),
+        }
+    except KeyError as e:
+        raise SystemExit(f"{script}: no literal {e.args[0]}; the benchmark needs the TEST4/TEST5 layout")
+
+def write_workbook(path: str, rows=TEMPLATE_ROWS, seed=0):
+    from openpyxl import Workbook
+    rng = random.Random(seed)
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Data"
+    ws.append(["Serial", "Temp", "Humidity", "Start", "Pass"])
+    start = time.time() - 86400
+    for i in range(rows):
+        ws.append([f"SN{seed:04d}{i:05d}", round(rng.uniform(20, 90), 2), round(rng.uniform(5, 95), 1),
+                   time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start + i * 60)), rng.random() > 0.05])
+    wb.save(path)
+
+def generate_tree(tree_dir: str, settings, files: int, employees: int, seed=1):
+    #builds (or reuses) the upload tree and employee workbook; returns the employee ids
+    import pandas as pd
+    params = {"version": TREE_VERSION, "files": files, "employees": employees, "seed": seed, **settings}
+    marker = os.path.join(tree_dir, "tree.json")
+    emp_ids = [str(FIRST_EMPLOYEE + i) for i in range(employees)]
+    try:
+        with open(marker, encoding="utf-8") as f:
+            if json.load(f) == params:
+                return emp_ids
+    except (OSError, ValueError):
+        pass
+    print(f"generating {files} files in {tree_dir} ...", file=sys.stderr)
+    shutil.rmtree(tree_dir, ignore_errors=True)
+    os.makedirs(tree_dir)
+    employee_list = os.path.join(tree_dir, settings["employee_list"])
+    os.makedirs(os.path.dirname(employee_list), exist_ok=True)
+    pd.DataFrame({"Employee #": emp_ids, "Name": [f"Employee {i}" for i in range(employees)]}).to_excel(
+        employee_list, index=False)
+    rng = random.Random(seed)
+    uploads = os.path.join(tree_dir, settings["uploads"])
+    staff = {test: rng.sample(emp_ids, min(employees, EMPLOYEES_PER_TEST)) for test in settings["tests"]}
+    now = time.time()
+    template = None
+    for i in range(files):
+        if i % LINKS_PER_TEMPLATE == 0:
+            template = os.path.join(tree_dir, f"template-{i // LINKS_PER_TEMPLATE}.xlsx")
+            write_workbook(template, seed=i)
+        test = settings["tests"][i % len(settings["tests"])]
+        folder = os.path.join(uploads, test, rng.choice(staff[test]))
+        path = os.path.join(folder, f"{test.replace(' ', '_')}_{i:07d}.xlsx")
+        try:
+            os.link(template, path)
+        except FileNotFoundError:
+            os.makedirs(folder, exist_ok=True)
+            os.link(template, path)
+        except OSError:
+            shutil.copyfile(template, path)  # no hardlinks on this file system
+        mtime = now - rng.uniform(0, 2 * 365 * 86400)  # spread over two years
+        os.utime(path, (mtime, mtime))
+        if (i + 1) % 100000 == 0:
+            print(f"  {i + 1} files", file=sys.stderr)
+    for test in settings["tests"]:
+        os.makedirs(os.path.join(uploads, test), exist_ok=True)  # tests without files too
+    with open(marker, "w", encoding="utf-8") as f:
+        json.dump(params, f)
+    return emp_ids
+
+def inject_latency(root: str, seconds: float):
+    #every os / open call on a path under root sleeps first, like an SMB round trip;
+    #other paths (the local catalog, Python itself) are not slowed down
+    root = os.path.abspath(root) + os.sep
+    def on_nas(path) -> bool:
+        try:
+            return os.path.abspath(os.fsdecode(path)).startswith(root)
+        except TypeError:
+            return False  # a file descriptor
+    def slow(fn):
+        @functools.wraps(fn)
+        def call(*args, **kwargs):
+            if args and on_nas(args[0]):
+                time.sleep(seconds)
+            return fn(*args, **kwargs)
+        return call
+    for name in NAS_CALLS:
+        setattr(os, name, slow(getattr(os, name)))
+    builtins.open = io.open = slow(builtins.open)
+
+def _timed(results: dict, case: str, fn):
+    start = time.perf_counter()
+    value = fn()
+    results[case] = time.perf_counter() - start
+    return value
+
+#=== One measurement (runs in its own process) ===
+def _login_page(script: str):
+    from streamlit.testing.v1 import AppTest
+    return _run(AppTest.from_file(script, default_timeout=3600))
+
+def _login(at, employee_id: str):
+    at.text_input[0].input(employee_id)
+    at.button[0].click()
+    _run(at)
+    if not at.session_state["authenticated"]:
+        raise RuntimeError(f"login failed: {[e.value for e in at.error]}")
+
+def _app(script: str, employee_id: str):
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(script, default_timeout=3600)
+    at.session_state["authenticated"] = True
+    at.session_state["employee_id"] = employee_id
+    return at
+
+def _run(at, tab=None):
+    if tab is not None:
+        navigate = at.selectbox[0] if at.selectbox and tab in at.selectbox[0].options else at.sidebar.radio[0]
+        navigate.set_value(tab)
+    at.run()
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+    return at
+
+class _Upload(io.BytesIO):
+    #stands in for st.file_uploader's UploadedFile
+    def __init__(self, data: bytes, name: str):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+        self.file_id = name
+        self.type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+def _upload(script: str, employee_id: str, payload: str):
+    import streamlit
+    name = os.path.basename(payload)
+    with open(payload, "rb") as f:
+        upload = _Upload(f.read(), name)
+    streamlit.file_uploader = lambda *args, **kwargs: None if kwargs.get("accept_multiple_files") else upload
+    at = _run(_app(script, employee_id))
+    while any(info.value.endswith("…") for info in at.info):  # "Checking workbook…" / "Converting for Spotfire…"
+        time.sleep(0.02)
+        _run(at)
+    if not at.success:
+        raise RuntimeError(f"upload did not complete: {[e.value for e in at.error]}")
+
+def measure(tree_dir: str, script: str, latency: float, run_dir: str):
+    #returns {case: seconds}; expects the environment to point the app's local state at run_dir
+    settings = script_settings(script)
+    employee_id = str(FIRST_EMPLOYEE)
+    os.chdir(tree_dir)
+    payload = os.path.join(run_dir, f"bench-{os.getpid()}.xlsx")
+    write_workbook(payload, seed=os.getpid())  # unique bytes: never deduplicated against a previous run
+    if latency:
+        inject_latency(tree_dir, latency)
+    import streamlit.testing.v1  # Streamlit's own import is the same for every version of the app
+    results = {}
+    at = _timed(results, "startup (login page)", lambda: _login_page(script))
+    time.sleep(LOGIN_THINK_TIME)  # background work started by the login page gets this time too
+    _timed(results, "startup (login)", lambda: _login(at, employee_id))
+    import employee_directory
+    from file_scanner import forget_scan_cache, scan_files, scan_folders
+    uploads = os.path.abspath(settings["uploads"])
+    folders = [os.path.join(uploads, test) for test in settings["tests"]]
+    employee_list = os.path.abspath(settings["employee_list"])
+    employee_directory._cache.clear()  # parsed while logging in: start the next cases cold again
+    if os.path.exists(employee_directory._sidecar_path(employee_list)):
+        os.remove(employee_directory._sidecar_path(employee_list))
+    _timed(results, "load_employee_list (parse)", lambda: employee_directory.read_employee_list(employee_list))
+    _timed(results, "load_employee_list (cached)", lambda: employee_directory.read_employee_list(employee_list))
+    employee_directory._cache.clear()  # new process, sidecar still on disk
+    _timed(results, "load_employee_list (sidecar)", lambda: employee_directory.read_employee_list(employee_list))
+    _timed(results, "list_files_fast (cold)", lambda: [scan_files(folder) for folder in folders])
+    _timed(results, "list_files_fast (warm)", lambda: [scan_files(folder) for folder in folders])
+    for folder in folders:
+        forget_scan_cache(folder)
+    _timed(results, "list_folders_fast (cold)", lambda: scan_folders(folders))
+    for folder in folders:
+        forget_scan_cache(folder)
+    at = _run(_app(script, employee_id))
+    _timed(results, "render_uploaded_log (cold catalog)", lambda: _run(at, "📋 Uploaded Log"))
+    _timed(results, "render_uploaded_log (warm)", lambda: _run(at))
+    _timed(results, "handle_upload", lambda: _upload(script, employee_id, payload))
+    saved = os.path.join(uploads, settings["tests"][0], employee_id, os.path.basename(payload))
+    if os.path.exists(saved):
+        os.remove(saved)  # keep the tree the same size for the next run
+    return results
+
+def _worker(args):
+    os.makedirs(os.path.join(args.workdir, "runs"), exist_ok=True)
+    run_dir = tempfile.mkdtemp(dir=os.path.join(args.workdir, "runs"))
+    try:
+        results = measure(args.worker, args.script, args.latency_ms[0] / 1000, run_dir)
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+    print(json.dumps(results))
+
+def _measure_in_subprocess(tree_dir: str, script: str, latency_ms: float, workdir: str):
+    run_state = tempfile.mkdtemp(dir=workdir)
+    env = dict(os.environ,
+               RE_PN_LAB_CATALOG=os.path.join(run_state, "catalog.sqlite3"),
+               RE_PN_LAB_REPLICATION_DB=os.path.join(run_state, "replication.sqlite3"),
+               RE_PN_LAB_CACHE_DIR=os.path.join(run_state, "cache"),
+               RE_PN_LAB_FILE_SERVER_PORT="0")  # any free port, never the app's 8502
+    try:
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", tree_dir, "--script", script,
+             "--latency-ms", str(latency_ms), "--workdir", workdir],
+            env=env, cwd=HERE, stdout=subprocess.PIPE, text=True, check=True,
+        ).stdout
+    finally:
+        shutil.rmtree(run_state, ignore_errors=True)
+    return json.loads(out.strip().splitlines()[-1])
+
+#=== Baselines ===
+def result_key(case: str, files: int, latency_ms: float) -> str:
+    return f"{case} | {files} files | {latency_ms:g} ms"
+
+def load_baseline(path=BASELINE_PATH):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)["results"]
+    except FileNotFoundError:
+        return {}
+
+def save_baseline(results, path=BASELINE_PATH):
+    merged = {**load_baseline(path), **results}  # sizes not run this time keep their baseline
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"machine": platform.node(), "python": platform.python_version(),
+                   "recorded": time.strftime("%Y-%m-%d %H:%M:%S"), "results": merged}, f, indent=1, sort_keys=True)
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    #[(key, seconds, baseline seconds or None, regressed)]
+    rows = []
+    for key, seconds in results.items():
+        base = baseline.get(key)
+        regressed = base is not None and seconds > base * (1 + tolerance) and seconds - base > NOISE_FLOOR
+        rows.append((key, seconds, base, regressed))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the app against a synthetic NAS-shaped upload tree.")
+    parser.add_argument("--files", default="1000", help="comma-separated tree sizes, e.g. 1000,100000,1000000")
+    parser.add_argument("--employees", type=int, default=500, help="rows in the employee workbook")
+    parser.add_argument("--latency-ms", default="0", type=lambda s: [float(v) for v in s.split(",")],
+                        help="comma-separated delay per file-system call on the tree, e.g. 0,2")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per size and latency; the median is reported")
+    parser.add_argument("--script", default=DEFAULT_SCRIPT, help="app script to benchmark (TEST4.py / TEST5.py)")
+    parser.add_argument("--workdir", default=DEFAULT_WORKDIR, help="where generated trees are kept")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.script = os.path.join(HERE, args.script)
+    if args.worker:
+        return _worker(args)
+
+    settings = script_settings(args.script)
+    if os.path.isabs(settings["uploads"]) or os.path.isabs(settings["employee_list"]):
+        raise SystemExit("the script's paths are absolute here; run the benchmark on Linux")
+    os.makedirs(args.workdir, exist_ok=True)
+    results = {}
+    for files in [int(v) for v in args.files.split(",")]:
+        tree_dir = os.path.join(args.workdir, f"tree-{files}")
+        generate_tree(tree_dir, settings, files, args.employees)
+        for latency_ms in args.latency_ms:
+            runs = [_measure_in_subprocess(tree_dir, args.script, latency_ms, args.workdir)
+                    for _ in range(args.repeat)]
+            for case in runs[0]:
+                results[result_key(case, files, latency_ms)] = statistics.median(run[case] for run in runs)
+
+    rows = compare(results, load_baseline(args.baseline), args.tolerance)
+    width = max(len(key) for key, _, _, _ in rows)
+    print(f"{'case':<{width}}  {'median s':>10}  {'baseline s':>10}  change")
+    for key, seconds, base, regressed in rows:
+        change = "" if base is None else f"{(seconds / base - 1) * 100:+.0f}%" if base else ""
+        print(f"{key:<{width}}  {seconds:>10.4f}  {'' if base is None else f'{base:.4f}':>10}  "
+              f"{change}{'  REGRESSION' if regressed else ''}")
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+        print(f"baseline saved to {args.baseline}")
+        return 0
+    regressions = [key for key, _, _, regressed in rows if regressed]
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
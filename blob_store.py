@@ -0,0 +1,141 @@
+import hashlib
+import os
+import threading
+import time
+from upload_io import UPLOAD_CHUNK_SIZE, fan_out_write, file_device, link_atomic, remove_file
+
+#=== Content-addressed upload store ===
+#Every distinct workbook is stored once under <store root>\.blobs\<aa>\<sha256>, and the
+#paths people and Spotfire see (UPLOADS\TRH\<emp>\x.xlsx, Spotfire\TRH\x.xlsx, DOWNLOADS...)
+#are hardlinks to that blob. Uploading bytes that are already stored only adds directory
+#entries: nothing is written to the NAS. Where hardlinks are not available a path falls
+#back to its own copy, so the store never breaks a save, it just stops deduplicating.
+#A blob's link count is its reference count: blobs with no paths left are dropped by
+#collect_unreferenced_blobs(), which upload_archive.py runs after every archive run.
+#Blobs modified within BLOB_GRACE are never dropped (a new blob has no links until its
+#upload paths are linked to it), and an upload that finds its blob collected before it
+#could link to it stores the bytes again.
+#Blobs are read-only (so are the paths linked to them): an edit in place would change
+#every upload sharing the bytes. A blob is reused only if it still has the size and
+#SHA-256 of its name; a damaged one is replaced from the upload (paths already linked to
+#it keep the damaged copy). Reusing a blob does not touch its mtime, which all its paths
+#share: the upload time goes into the file catalog instead (catalog_add).
+
+BLOB_DIR_NAME = ".blobs"
+BLOB_MODE = 0o444
+BLOB_GRACE = 3600  # seconds a blob without links is kept after its last change
+
+_verified = {}  # blob path -> (size, mtime_ns) when its content last matched its name
+_verified_lock = threading.Lock()
+
+def blob_path(store_root: str, digest: str) -> str:
+    return os.path.join(store_root, BLOB_DIR_NAME, digest[:2], digest)
+
+def _hash_stream(src, chunk_size=UPLOAD_CHUNK_SIZE):
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = src.read(chunk_size)
+        if not chunk:
+            break
+        digest.update(chunk)
+        size += len(chunk)
+    return size, digest.hexdigest()
+
+def _blob_intact(blob: str, size: int, digest: str) -> bool:
+    #False when missing or not the bytes its name says; the full read happens once per
+    #blob and process, after that an unchanged size and mtime is enough
+    try:
+        stat = os.stat(blob)
+    except OSError:
+        return False
+    if stat.st_size != size:
+        return False
+    signature = (stat.st_size, stat.st_mtime_ns)
+    with _verified_lock:
+        if _verified.get(blob) == signature:
+            return True
+    try:
+        with open(blob, "rb") as f:
+            if _hash_stream(f) != (size, digest):
+                return False
+    except OSError:
+        return False
+    with _verified_lock:
+        _verified[blob] = signature
+    return True
+
+def _protect(blob: str):
+    try:
+        os.chmod(blob, BLOB_MODE)
+    except OSError:
+        pass  # file system without permissions: the blob just stays writable
+
+def _same_file(a: str, b: str) -> bool:
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        return False
+
+def store_upload(src, store_root: str, dst_paths):
+    #src = seekable binary file object (st.file_uploader's UploadedFile)
+    #returns (size, sha256 hex digest, {dst_path: True | error message}, reused)
+    #reused = True when the bytes were already in the store (no data written for the blob)
+    src.seek(0)
+    size, digest = _hash_stream(src)  # upload is in server memory: hashing costs no NAS I/O
+    src.seek(0)
+    blob = blob_path(store_root, digest)
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    if not _blob_intact(blob, size, digest):
+        #new content (or a damaged blob): one fan-out pass writes the blob and, on the
+        #same filesystem, turns every destination into a hardlink of it
+        _, _, statuses = fan_out_write(src, [blob] + list(dst_paths))
+        if statuses.pop(blob, None) is True:
+            _protect(blob)
+        else:
+            try:
+                remove_file(blob)  # never leave a blob that may not match its name
+            except OSError:
+                pass
+        return size, digest, statuses, False
+
+    _protect(blob)  # again: clearing it on Windows to replace a linked path clears it here too
+    statuses = {}
+    elsewhere = []  # destinations on another filesystem than the store
+    blob_device = file_device(os.path.dirname(blob))
+    for dst_path in dst_paths:
+        try:
+            if _same_file(blob, dst_path):
+                statuses[dst_path] = True  # already points at these bytes
+            elif file_device(os.path.dirname(os.path.abspath(dst_path))) == blob_device:
+                link_atomic(blob, dst_path)
+                statuses[dst_path] = True
+            else:
+                elsewhere.append(dst_path)
+        except Exception as e:
+            statuses[dst_path] = str(e)
+    if not all(status is True for status in statuses.values()) and not os.path.exists(blob):
+        src.seek(0)  # collected in between: store it again
+        return store_upload(src, store_root, dst_paths)
+    if elsewhere:
+        _, _, more = fan_out_write(src, elsewhere)
+        statuses.update(more)
+    return size, digest, statuses, True
+
+def collect_unreferenced_blobs(store_root: str):
+    #removes blobs that no upload path links to any more (and temp files left by an
+    #interrupted store); returns how many were removed
+    removed = 0
+    cutoff = time.time() - BLOB_GRACE
+    blob_root = os.path.join(store_root, BLOB_DIR_NAME)
+    for folder, _, names in os.walk(blob_root):
+        for name in names:
+            path = os.path.join(folder, name)
+            try:
+                stat = os.stat(path)
+                if stat.st_nlink <= 1 and stat.st_mtime < cutoff:
+                    remove_file(path)
+                    removed += 1
+            except OSError:
+                continue
+    return removed
@@ -0,0 +1,88 @@
+import shutil
+import threading
+import time
+import uuid
+import zipfile
+from datetime import datetime
+
+#=== Bulk download ===
+#"Download selected" in the Uploaded Log: the script registers the selected files here
+#and gets a token back; the embedded file server (file_server) answers
+#  /api/zip/<token>
+#by writing a zip of those files straight to the socket while it reads them from the NAS.
+#Nothing is built in memory or on disk first: every file is copied through in
+#COPY_CHUNK pieces, members are stored (the uploads are .xlsx, already compressed) and
+#their sizes / CRCs go in data descriptors after the data, so memory stays the same for
+#5 files or 5,000. Only the small per-file entries of the zip's central directory are
+#kept until the end.
+#A token is a random id that is valid for EXPORT_TTL seconds and only ever covers the
+#files the app registered, so the link cannot be used to fetch anything else. Files
+#deleted since they were selected are skipped and named in _missing.txt in the zip.
+
+EXPORT_TTL = 3600  # seconds a registered selection can be downloaded
+COPY_CHUNK = 1024 * 1024
+
+_exports = {}  # token -> (registered at, zip file name, entries)
+_lock = threading.Lock()
+
+def register_export(entries, name: str) -> str:
+    #entries = [{"arcname", "path", "mtime"}, ...]; an entry with "member" is a file
+    #inside the archive bundle at "path" (upload_archive). Returns the token.
+    with _lock:
+        now = time.time()
+        for token in [t for t, (at, _, _) in _exports.items() if now - at > EXPORT_TTL]:
+            del _exports[token]
+        token = uuid.uuid4().hex
+        _exports[token] = (now, name, list(entries))
+        return token
+
+def export_entries(token: str):
+    #(zip file name, entries), or None for an unknown / expired token
+    with _lock:
+        export = _exports.get(token)
+    if export is None or time.time() - export[0] > EXPORT_TTL:
+        return None
+    return export[1], export[2]
+
+def _zip_info(entry) -> zipfile.ZipInfo:
+    stamp = datetime.fromtimestamp(max(entry["mtime"], 315532800))  # zip dates start in 1980
+    info = zipfile.ZipInfo(entry["arcname"], date_time=stamp.timetuple()[:6])
+    info.compress_type = zipfile.ZIP_STORED
+    return info
+
+def _open_entry(entry):
+    if "member" in entry:
+        bundle = zipfile.ZipFile(entry["path"])
+        try:
+            return bundle, bundle.open(entry["member"])
+        except BaseException:
+            bundle.close()
+            raise
+    return None, open(entry["path"], "rb")
+
+def write_zip(entries, out):
+    #out = any writable stream, seekable or not (a socket); returns the files written
+    written = 0
+    missing = []
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for entry in entries:
+            try:
+                bundle, src = _open_entry(entry)
+            except (OSError, KeyError, zipfile.BadZipFile):
+                missing.append(entry["arcname"])
+                continue
+            try:
+                with src, zf.open(_zip_info(entry), "w", force_zip64=True) as dst:
+                    shutil.copyfileobj(src, dst, COPY_CHUNK)
+            finally:
+                if bundle is not None:
+                    bundle.close()
+            written += 1
+        if missing:
+            zf.writestr("_missing.txt", "Not found when the zip was made:\n" + "\n".join(missing) + "\n")
+    return written
+
+def export_name(prefix: str) -> str:
+    #e.g. "HACT-20250131-1402.zip"
+    safe = "".join(c if c.isalnum() or c in "-_" else "_" for c in prefix).strip("_") or "uploads"
+    return f"{safe}-{datetime.now():%Y%m%d-%H%M}.zip"
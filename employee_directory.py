@@ -0,0 +1,103 @@
+import hashlib
+import os
+import pickle
+import threading
+
+#=== Employee list cache ===
+#Parsing the employee workbook costs a NAS read plus openpyxl on every rerun of every session.
+#This cache is shared by all sessions of the process and only re-reads the workbook when its
+#mtime or size changes. Each parsed copy is also written to a pickle sidecar on local disk,
+#so a cold start (new process, unchanged workbook) loads the DataFrame without openpyxl.
+#Each version also gets an Employee # -> record dict, so logins and name lookups are a
+#hash lookup instead of a boolean mask over the whole DataFrame.
+#The cached DataFrame and records are shared: callers must not modify them in place.
+#pandas is imported on the first read, not with this module, so a script can import
+#employee_directory and show its login page before paying for pandas.
+
+CACHE_DIR = os.environ.get(
+    "RE_PN_LAB_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"),
+)
+
+_cache = {}  # workbook path -> ((mtime_ns, size), DataFrame, {Employee #: record})
+_lock = threading.Lock()
+
+def _sidecar_path(path: str) -> str:
+    digest = hashlib.sha1(path.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, f"employees-{digest}.pkl")
+
+def _read_sidecar(path: str, signature):
+    #None when missing, stale or unreadable; the caller then parses the workbook again
+    sidecar = _sidecar_path(path)
+    try:
+        with open(sidecar, "rb") as f:
+            saved_signature, df = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        #truncated, corrupt or written by another pandas/Python version (unpickling can
+        #fail with almost any exception): drop it so it is rewritten from the workbook
+        try:
+            os.remove(sidecar)
+        except OSError:
+            pass
+        return None
+    return df if saved_signature == signature else None
+
+def _write_sidecar(path: str, signature, df):
+    #written to a temp name and renamed so another process never reads half a file
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        sidecar = _sidecar_path(path)
+        tmp = f"{sidecar}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump((signature, df), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, sidecar)
+    except OSError:
+        pass  # the sidecar is only a speed-up
+
+def read_employee_list(path: str):
+    #same result as pd.read_excel(path, dtype=str), parsed at most once per workbook version
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = _cache.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    with _lock:
+        cached = _cache.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]  # another session loaded it while we waited
+        df = _read_sidecar(path, signature)
+        if df is None:
+            import pandas as pd
+            df = pd.read_excel(path, dtype=str)
+            _write_sidecar(path, signature, df)
+        _cache[path] = (signature, df, _build_index(df))
+    return df
+
+def _build_index(df):
+    #first row wins for a repeated Employee #, same as .loc[...].values[0]
+    index = {}
+    if "Employee #" in df.columns:
+        for record in df.to_dict("records"):
+            index.setdefault(record["Employee #"], record)
+    return index
+
+def employee_index(df):
+    #{Employee #: {"Name": ..., ...}} for a DataFrame returned by read_employee_list,
+    #built once per workbook version
+    for _, cached_df, index in list(_cache.values()):
+        if cached_df is df:
+            return index
+    return _build_index(df)
+
+#=== Admins ===
+#Employee numbers that see the admin panels (stage timings in the sidebar...), from
+#RE_PN_LAB_ADMINS, comma-separated. Nobody is an admin by default.
+ADMIN_EMPLOYEES = frozenset(
+    emp_id.strip() for emp_id in os.environ.get("RE_PN_LAB_ADMINS", "").split(",") if emp_id.strip()
+)
+
+def is_admin(emp_id) -> bool:
+    return emp_id in ADMIN_EMPLOYEES
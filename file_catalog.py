@@ -0,0 +1,295 @@
+import os
+import sqlite3
+import threading
+import time
+
+#=== Persistent file catalog ===
+#Keeps one row per uploaded file so the Uploaded Log can read metadata from SQLite
+#instead of walking the NAS on every rerun.
+#handle_upload writes a row when it saves a file; reconcile_catalog repairs drift
+#(files added/removed/changed outside the app) against a real folder scan.
+#mtime is the time the log shows and sorts by: the upload time for files saved by the
+#app, the file's own mtime for files found by a scan. Uploads of bytes already in the
+#blob store are hardlinks sharing the blob's (older) mtime, so the file system cannot
+#tell when they were uploaded; file_mtime keeps what the file system reports and is
+#what reconcile_catalog compares against.
+
+#The database lives on local disk next to the app by default: SQLite locking is not
+#reliable on SMB shares, so do not point this at the NAS.
+CATALOG_PATH = os.environ.get(
+    "RE_PN_LAB_CATALOG",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "upload_catalog.sqlite3"),
+)
+RECONCILE_INTERVAL = 300  # seconds before a folder is re-checked against the NAS
+
+_local = threading.local()
+
+def _connect(db_path=CATALOG_PATH):
+    #one connection per thread (Streamlit runs every session in its own thread)
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path  TEXT PRIMARY KEY,
+                root  TEXT NOT NULL,
+                name  TEXT NOT NULL,
+                owner TEXT NOT NULL,
+                size  INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                file_mtime REAL
+            );
+            DROP INDEX IF EXISTS files_root_mtime;
+            CREATE INDEX IF NOT EXISTS files_root_mtime_path ON files (root, mtime DESC, path DESC);
+            CREATE TABLE IF NOT EXISTS roots (
+                root          TEXT PRIMARY KEY,
+                reconciled_at REAL NOT NULL,
+                version       INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS archived (
+                path   TEXT NOT NULL,
+                root   TEXT NOT NULL,
+                name   TEXT NOT NULL,
+                owner  TEXT NOT NULL,
+                size   INTEGER NOT NULL,
+                mtime  REAL NOT NULL,
+                month  TEXT NOT NULL,
+                bundle TEXT NOT NULL,
+                member TEXT NOT NULL,
+                PRIMARY KEY (bundle, member)
+            );
+            CREATE INDEX IF NOT EXISTS archived_root_month ON archived (root, month, mtime DESC);
+        """)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(roots)")]
+        if "version" not in columns:  # catalogs created before paging
+            conn.execute("ALTER TABLE roots ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(files)")]
+        if "file_mtime" not in columns:  # catalogs created before upload times
+            with conn:
+                conn.execute("ALTER TABLE files ADD COLUMN file_mtime REAL")
+                conn.execute("UPDATE files SET file_mtime = mtime")
+        conns[db_path] = conn
+    return conn
+
+def _norm(path: str) -> str:
+    return os.path.normpath(os.path.abspath(path))
+
+def _bump_version(conn, root: str):
+    #every change under a root moves its version so cached page cursors get dropped
+    #(a root seen for the first time gets reconciled_at = 0, i.e. stale)
+    conn.execute(
+        "INSERT INTO roots (root, reconciled_at, version) VALUES (?, 0, 1) "
+        "ON CONFLICT (root) DO UPDATE SET version = version + 1",
+        (root,),
+    )
+
+def catalog_add(root: str, path: str, uploaded=None, db_path=CATALOG_PATH):
+    #records (or refreshes) one file under a test folder, e.g. right after an upload
+    #root = "...\\UPLOADS\\TRH", path = "...\\UPLOADS\\TRH\\1000329829\\report.xlsx"
+    #uploaded = timestamp the log shows for it (default: now)
+    path = _norm(path)
+    root = _norm(root)
+    stat = os.stat(path)
+    conn = _connect(db_path)
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO files (path, root, name, owner, size, mtime, file_mtime) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (path, root, os.path.basename(path), os.path.basename(os.path.dirname(path)),
+             stat.st_size, time.time() if uploaded is None else uploaded, stat.st_mtime),
+        )
+        _bump_version(conn, root)
+
+def catalog_remove(path: str, db_path=CATALOG_PATH):
+    conn = _connect(db_path)
+    with conn:
+        row = conn.execute("SELECT root FROM files WHERE path = ?", (_norm(path),)).fetchone()
+        if row is not None:
+            conn.execute("DELETE FROM files WHERE path = ?", (_norm(path),))
+            _bump_version(conn, row[0])
+
+def catalog_files(root: str, owner_key="employee", db_path=CATALOG_PATH):
+    #same records as list_files_fast: name, path, size, mtime and the parent folder
+    #under owner_key ("employee" for UPLOADS/<test>/<emp>, "folder" for the flat layout)
+    rows = _connect(db_path).execute(
+        "SELECT name, path, size, mtime, owner FROM files WHERE root = ? ORDER BY mtime DESC, path DESC",
+        (_norm(root),),
+    ).fetchall()
+    return _records(rows, owner_key)
+
+def _records(rows, owner_key):
+    return [
+        {"name": name, "path": path, "size": size, "mtime": mtime, owner_key: owner}
+        for name, path, size, mtime, owner in rows
+    ]
+
+#=== Paging ===
+#Pages are read newest first straight off the (root, mtime, path) index, so a page of
+#k rows is a bounded top-k read: no full list is built or sorted. Known page starts are
+#kept as keyset cursors (mtime, path of the row before), so the next page is another
+#k-row index read however far down the list it is.
+
+def catalog_count(root: str, db_path=CATALOG_PATH) -> int:
+    return _connect(db_path).execute("SELECT COUNT(*) FROM files WHERE root = ?", (_norm(root),)).fetchone()[0]
+
+def catalog_version(root: str, db_path=CATALOG_PATH) -> int:
+    row = _connect(db_path).execute("SELECT version FROM roots WHERE root = ?", (_norm(root),)).fetchone()
+    return 0 if row is None else row[0]
+
+def catalog_page(root: str, limit: int, after=None, offset=0, owner_key="employee", db_path=CATALOG_PATH):
+    #after = (mtime, path) of the last row of the previous page; without it, skip offset rows
+    conn = _connect(db_path)
+    if after is not None:
+        rows = conn.execute(
+            "SELECT name, path, size, mtime, owner FROM files WHERE root = ? AND (mtime, path) < (?, ?) "
+            "ORDER BY mtime DESC, path DESC LIMIT ?",
+            (_norm(root), after[0], after[1], limit),
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            "SELECT name, path, size, mtime, owner FROM files WHERE root = ? "
+            "ORDER BY mtime DESC, path DESC LIMIT ? OFFSET ?",
+            (_norm(root), limit, offset),
+        ).fetchall()
+    return _records(rows, owner_key)
+
+def catalog_page_at(root: str, page: int, page_size: int, cursors: dict, owner_key="employee", db_path=CATALOG_PATH):
+    #page is 0-based; cursors is a dict the caller keeps between reruns (st.session_state)
+    #and is reset whenever the folder's catalog or the page size changes
+    key = (catalog_version(root, db_path), page_size)
+    if cursors.get("key") != key:
+        cursors.clear()
+        cursors.update(key=key, starts={0: None})
+    starts = cursors["starts"]
+    if page in starts:
+        files = catalog_page(root, page_size, after=starts[page], owner_key=owner_key, db_path=db_path)
+    else:
+        #jumped past the pages seen so far: let the index skip ahead once
+        files = catalog_page(root, page_size, offset=page * page_size, owner_key=owner_key, db_path=db_path)
+    if len(files) == page_size:
+        starts[page + 1] = (files[-1]["mtime"], files[-1]["path"])
+    return files
+
+#=== Queries across folders ===
+#Used by the file server's /api/files listing: newest first over several test folders,
+#optionally narrowed to one owner folder and an mtime window, paged with the same
+#(mtime, path) keyset as catalog_page.
+
+def catalog_roots(under: str, db_path=CATALOG_PATH):
+    #catalogued test folders below a folder, e.g. every test under UPLOADS
+    prefix = os.path.join(_norm(under), "")
+    rows = _connect(db_path).execute("SELECT root FROM roots ORDER BY root")
+    return [root for (root,) in rows if root.startswith(prefix)]
+
+def catalog_versions(roots, db_path=CATALOG_PATH):
+    #{root: version}; a listing built from these roots is unchanged while these are
+    return {root: catalog_version(root, db_path) for root in roots}
+
+def catalog_query(roots, limit: int, after=None, owner=None, since=None, until=None,
+                  owner_key="employee", db_path=CATALOG_PATH):
+    #since / until are timestamps (since inclusive, until exclusive)
+    #records as catalog_page plus "root" (the test folder each file is under)
+    roots = [_norm(root) for root in roots]
+    if not roots:
+        return []
+    where = [f"root IN ({','.join('?' * len(roots))})"]
+    params = list(roots)
+    if owner is not None:
+        where.append("owner = ?")
+        params.append(owner)
+    if since is not None:
+        where.append("mtime >= ?")
+        params.append(since)
+    if until is not None:
+        where.append("mtime < ?")
+        params.append(until)
+    if after is not None:
+        where.append("(mtime, path) < (?, ?)")
+        params.extend(after)
+    rows = _connect(db_path).execute(
+        f"SELECT name, path, size, mtime, owner, root FROM files WHERE {' AND '.join(where)} "
+        "ORDER BY mtime DESC, path DESC LIMIT ?",
+        params + [limit],
+    ).fetchall()
+    return [dict(record, root=row[5]) for record, row in zip(_records([row[:5] for row in rows], owner_key), rows)]
+
+#=== Archive index ===
+#Files moved into monthly bundles by upload_archive leave the files table and are
+#indexed here instead (bundle path + member name), so the Uploaded Log can still list
+#and download them without opening any bundle to find out what is inside.
+
+def catalog_archive(root: str, entries, db_path=CATALOG_PATH):
+    #entries = [(record, month, bundle, member), ...] for files just packed into a bundle;
+    #moves them from the live listing to the archive index in one transaction (a path
+    #archived twice, e.g. re-uploaded with an old date, keeps one row per member)
+    root = _norm(root)
+    conn = _connect(db_path)
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO archived (path, root, name, owner, size, mtime, month, bundle, member) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(_norm(f["path"]), root, f["name"], os.path.basename(os.path.dirname(_norm(f["path"]))),
+              f["size"], f["mtime"], month, bundle, member) for f, month, bundle, member in entries],
+        )
+        conn.executemany("DELETE FROM files WHERE path = ?", [(_norm(f["path"]),) for f, _, _, _ in entries])
+        _bump_version(conn, root)
+
+def archived_months(root: str, db_path=CATALOG_PATH):
+    #[(month "YYYY-MM", files), ...] newest month first
+    return _connect(db_path).execute(
+        "SELECT month, COUNT(*) FROM archived WHERE root = ? GROUP BY month ORDER BY month DESC",
+        (_norm(root),),
+    ).fetchall()
+
+def archived_page(root: str, month: str, limit: int, offset=0, owner_key="employee", db_path=CATALOG_PATH):
+    #records as catalog_page plus "bundle" and "member", newest first
+    rows = _connect(db_path).execute(
+        "SELECT name, path, size, mtime, owner, bundle, member FROM archived WHERE root = ? AND month = ? "
+        "ORDER BY mtime DESC, path DESC LIMIT ? OFFSET ?",
+        (_norm(root), month, limit, offset),
+    ).fetchall()
+    return [dict(record, bundle=row[5], member=row[6])
+            for record, row in zip(_records([row[:5] for row in rows], owner_key), rows)]
+
+def catalog_is_stale(root: str, max_age=RECONCILE_INTERVAL, db_path=CATALOG_PATH) -> bool:
+    row = _connect(db_path).execute(
+        "SELECT reconciled_at FROM roots WHERE root = ?", (_norm(root),)
+    ).fetchone()
+    return row is None or time.time() - row[0] > max_age
+
+def reconcile_catalog(root: str, files, db_path=CATALOG_PATH):
+    #files = records from a real scan of root (list_files_fast output)
+    #returns (changed, removed) so callers can tell whether anything drifted
+    #(a file changed outside the app is listed with its new mtime; upload times are kept)
+    root = _norm(root)
+    conn = _connect(db_path)
+    known = {
+        path: (size, file_mtime)
+        for path, size, file_mtime in conn.execute("SELECT path, size, file_mtime FROM files WHERE root = ?", (root,))
+    }
+    upserts = []
+    for f in files:
+        path = _norm(f["path"])
+        if known.pop(path, None) != (f["size"], f["mtime"]):
+            upserts.append((path, root, f["name"], os.path.basename(os.path.dirname(path)),
+                            f["size"], f["mtime"], f["mtime"]))
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO files (path, root, name, owner, size, mtime, file_mtime) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            upserts,
+        )
+        conn.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in known])
+        if upserts or known:
+            _bump_version(conn, root)
+        conn.execute(
+            "INSERT INTO roots (root, reconciled_at) VALUES (?, ?) "
+            "ON CONFLICT (root) DO UPDATE SET reconciled_at = excluded.reconciled_at",
+            (root, time.time()),
+        )
+    return len(upserts), len(known)
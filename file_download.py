@@ -0,0 +1,27 @@
+import zipfile
+from stage_timing import current_tab, span
+
+#=== Lazy downloads ===
+#st.download_button(data=bytes) makes every listed file get read from the NAS and kept in
+#server memory while the page is open, even if nobody clicks. Passing a callable instead
+#(Streamlit >= 1.52) defers the read to the moment the user clicks that button, so a page
+#render only costs the metadata from the catalog.
+#The reads happen outside the rerun that drew the button, so their timing span is filed
+#under the tab that drew it.
+
+def deferred_file(path: str):
+    #callable for st.download_button(data=...): runs only when the user clicks
+    tab = current_tab()
+    def read_file():
+        with span("download read", tab), open(path, "rb") as f:
+            return f.read()
+    return read_file
+
+def deferred_member(bundle: str, member: str):
+    #same for a file packed into an archive bundle (upload_archive): the zip's central
+    #directory points straight at the member, so only that member is read
+    tab = current_tab()
+    def read_member():
+        with span("download read", tab), zipfile.ZipFile(bundle) as zf:
+            return zf.read(member)
+    return read_member
@@ -0,0 +1,106 @@
+import os
+import threading
+from upload_io import TEMP_SUFFIX
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+#=== Incremental folder scanner ===
+#Remembers every folder's mtime together with the files and subfolders it held on the
+#previous pass. A folder whose mtime did not move is not listed again: its files come
+#from memory and only its subfolders get a single stat each. After one upload into
+#UPLOADS\TRH\1000329829 only that folder is re-read, so the cost of a pass follows the
+#amount of change instead of the size of the tree.
+#Note: a file overwritten in place (same name) does not move its folder's mtime;
+#handle_upload updates the catalog itself and forget_scan_cache() forces a full pass.
+
+SCAN_WORKERS = int(os.environ.get("RE_PN_LAB_SCAN_WORKERS", "16"))  # max folders read at the same time
+
+_dir_cache = {}  # folder path -> (mtime_ns, [(name, path, size, mtime), ...], [subfolder paths])
+_lock = threading.Lock()
+
+def _read_dir(path: str):
+    files, subdirs = [], []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.is_file() and not entry.name.endswith(TEMP_SUFFIX):
+                    stat = entry.stat()
+                    files.append((entry.name, entry.path, stat.st_size, stat.st_mtime))
+            except FileNotFoundError:
+                continue
+    return files, subdirs
+
+def _visit(path: str):
+    #returns (cached entry, re-read?) for one folder, or (None, False) if it is gone
+    try:
+        #stat before listing: a file landing in between moves the mtime again,
+        #so the next pass re-reads this folder instead of missing the file
+        mtime = os.stat(path).st_mtime_ns
+        cached = _dir_cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached, False
+        files, subdirs = _read_dir(path)
+    except FileNotFoundError:
+        return None, False
+    cached = (mtime, files, subdirs)
+    with _lock:
+        _dir_cache[path] = cached
+    return cached, True
+
+def scan_folders(folders, owner_key="employee", max_workers=None):
+    #scans several test folders at once: every folder visit (test folders and the
+    #employee folders under them) is a task on one thread pool, so NAS round trips
+    #overlap instead of being paid one after another
+    #returns {folder: records newest first}, records as in scan_files
+    folders = list(folders)
+    results = {folder: [] for folder in folders}
+    seen = {folder: set() for folder in folders}
+    changed = set()
+    with ThreadPoolExecutor(max_workers=max_workers or SCAN_WORKERS) as pool:
+        pending = {pool.submit(_visit, folder): (folder, folder) for folder in folders}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                root, path = pending.pop(future)
+                cached, reread = future.result()
+                if cached is None:
+                    continue
+                if reread:
+                    changed.add(root)
+                seen[root].add(path)
+                owner = os.path.basename(path)
+                for name, file_path, size, file_mtime in cached[1]:
+                    results[root].append({
+                        "name": name,
+                        "path": file_path,
+                        "size": size,
+                        "mtime": file_mtime,
+                        owner_key: owner,
+                    })
+                for sub in cached[2]:
+                    pending[pool.submit(_visit, sub)] = (root, sub)
+    for root in changed:
+        _drop_unseen(root, seen[root])
+    for files_list in results.values():
+        files_list.sort(key=lambda x: x["mtime"], reverse=True)
+    return results
+
+def scan_files(folder: str, owner_key="employee", max_workers=None):
+    #same records as the old os.walk version of list_files_fast, newest first:
+    #{"name", "path", "size", "mtime", owner_key: name of the folder holding the file}
+    return scan_folders([folder], owner_key, max_workers)[folder]
+
+def _drop_unseen(folder: str, seen):
+    #forgets folders under this root that were deleted since the last pass
+    prefix = os.path.join(folder, "")
+    with _lock:
+        for path in [p for p in _dir_cache if p.startswith(prefix) and p not in seen]:
+            del _dir_cache[path]
+
+def forget_scan_cache(folder: str):
+    #next scan_files(folder) re-reads every file (e.g. the "Rescan folders" button)
+    prefix = os.path.join(folder, "")
+    with _lock:
+        for path in [p for p in _dir_cache if p == folder or p.startswith(prefix)]:
+            del _dir_cache[path]
@@ -0,0 +1,293 @@
+import base64
+import functools
+import hashlib
+import io
+import json
+import os
+import threading
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from http import HTTPStatus
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlsplit
+from bulk_download import export_entries, write_zip
+from file_catalog import catalog_is_stale, catalog_query, catalog_roots, catalog_versions, reconcile_catalog
+from file_scanner import scan_folders
+
+#=== Embedded file server ===
+#Replaces the `python -m http.server 8502` subprocess that was spawned on every rerun.
+#One ThreadingHTTPServer per port is started in a daemon thread the first time the
+#script runs; later reruns find it already listening and return straight away.
+#Files are sent with socket.sendfile (zero-copy where the OS supports it), answer
+#single HTTP Range requests (resumed / partial downloads), carry ETag and
+#Last-Modified so browsers can revalidate with a 304, and connections are kept alive
+#(HTTP/1.1) between requests. Folder listings are the standard http.server ones; scripts
+#should use the JSON listing at /api/files instead. /api/zip/<token> streams the zip of
+#a "Download selected" from the Uploaded Log (bulk_download).
+
+FILE_SERVER_PORT = int(os.environ.get("RE_PN_LAB_FILE_SERVER_PORT", "8502"))
+#how browsers reach the server, e.g. http://labpc:8502; empty = the host the app was opened on
+FILE_SERVER_URL = os.environ.get("RE_PN_LAB_FILE_SERVER_URL", "").rstrip("/")
+
+_servers = {}  # port -> running ThreadingHTTPServer
+_lock = threading.Lock()
+
+def _etag(stat) -> str:
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+#=== JSON listing ===
+#GET /api/files lists uploads from the file catalog (the same metadata the Uploaded Log
+#shows) instead of an HTML page built from a live listdir of the NAS:
+#  /api/files?test=TRH&employee=1000329829&since=2025-01-01&until=2025-02-01&limit=100
+#test / employee = folder names, since (inclusive) / until (exclusive) = ISO date or
+#date-time, limit = 1..LISTING_MAX_LIMIT (default 100). Rows come newest first; when
+#there are more, "next" holds a cursor to pass back as &after=<next>.
+#Covers the test folders below the served folder that the app has catalogued; stale
+#ones are reconciled against the NAS first, exactly like the Uploaded Log does.
+#The response ETag is derived from the query and the catalog versions of those folders,
+#so a client revalidating with If-None-Match gets a 304 until an upload lands.
+
+LISTING_PATH = "/api/files"
+LISTING_DEFAULT_LIMIT = 100
+LISTING_MAX_LIMIT = 1000
+EXPORT_PATH = "/api/zip/"
+
+def _timestamp(value):
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise ValueError(f"bad date {value!r}, expected YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS") from None
+
+def _encode_cursor(record) -> str:
+    return base64.urlsafe_b64encode(json.dumps([record["mtime"], record["path"]]).encode()).decode()
+
+def _decode_cursor(value):
+    if value is None:
+        return None
+    try:
+        mtime, path = json.loads(base64.urlsafe_b64decode(value.encode()))
+        return float(mtime), str(path)
+    except (ValueError, TypeError):
+        raise ValueError(f"bad cursor {value!r}") from None
+
+def _listing_params(query: dict) -> dict:
+    def one(name):
+        values = query.get(name)
+        return values[-1] if values else None
+    try:
+        limit = int(one("limit") or LISTING_DEFAULT_LIMIT)
+    except ValueError:
+        raise ValueError(f"bad limit {one('limit')!r}") from None
+    if not 1 <= limit <= LISTING_MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {LISTING_MAX_LIMIT}")
+    return {
+        "test": one("test"),
+        "employee": one("employee"),
+        "since": _timestamp(one("since")),
+        "until": _timestamp(one("until")),
+        "after": _decode_cursor(one("after")),
+        "limit": limit,
+    }
+
+class _ChunkedWriter(io.RawIOBase):
+    #HTTP/1.1 chunked transfer encoding: the zip's length is not known up front
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if data:
+            self.wfile.write(b"%x\r\n" % len(data) + bytes(data) + b"\r\n")
+        return len(data)
+
+    def finish(self):
+        self.wfile.write(b"0\r\n\r\n")
+
+class FileRequestHandler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def log_message(self, format, *args):
+        pass  # the old subprocess sent its log to DEVNULL too
+
+    def do_GET(self):
+        self._serve(body=True)
+
+    def do_HEAD(self):
+        self._serve(body=False)
+
+    def _serve(self, body: bool):
+        url_path = urlsplit(self.path).path
+        if url_path == LISTING_PATH:
+            return self._serve_listing(body)
+        if url_path.startswith(EXPORT_PATH):
+            return self._serve_export(url_path[len(EXPORT_PATH):], body)
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            #folders (listing / redirect / index.html) and 404s: standard behaviour
+            return super().do_GET() if body else super().do_HEAD()
+        try:
+            f = open(path, "rb")
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, "File not found")
+            return
+        with f:
+            stat = os.fstat(f.fileno())
+            etag = _etag(stat)
+            last_modified = self.date_time_string(int(stat.st_mtime))
+            if self._not_modified(etag, stat.st_mtime):
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", last_modified)
+                self.end_headers()
+                return
+            size = stat.st_size
+            ranged = self._requested_range(size, etag, stat.st_mtime)
+            if ranged == "unsatisfiable":
+                self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            start, end = ranged or (0, size - 1)
+            length = end - start + 1
+            self.send_response(HTTPStatus.PARTIAL_CONTENT if ranged else HTTPStatus.OK)
+            self.send_header("Content-Type", self.guess_type(path))
+            self.send_header("Content-Length", str(length))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", last_modified)
+            if ranged:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            self.end_headers()
+            if body and length > 0:
+                try:
+                    self.connection.sendfile(f, offset=start, count=length)
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True  # client went away mid-download
+
+    def _serve_listing(self, body: bool):
+        url = urlsplit(self.path)
+        try:
+            params = _listing_params(parse_qs(url.query))
+        except ValueError as e:
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)}, body)
+            return
+        roots = catalog_roots(self.directory)
+        if params["test"] is not None:
+            roots = [root for root in roots if os.path.basename(root) == params["test"]]
+        stale = [root for root in roots if catalog_is_stale(root)]
+        for root, files in scan_folders(stale).items():
+            reconcile_catalog(root, files)
+        versions = sorted(catalog_versions(roots).items())
+        etag = '"' + hashlib.sha1(repr((url.query, versions)).encode()).hexdigest() + '"'
+        if self._not_modified(etag, None):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            return
+        records = catalog_query(roots, params["limit"] + 1, after=params["after"], owner=params["employee"],
+                                since=params["since"], until=params["until"])
+        more = len(records) > params["limit"]
+        records = records[:params["limit"]]
+        directory = os.path.abspath(self.directory)
+        files = [{
+            "test": os.path.basename(f["root"]),
+            "employee": f["employee"],
+            "name": f["name"],
+            "size": f["size"],
+            "mtime": f["mtime"],
+            "modified": datetime.fromtimestamp(f["mtime"]).isoformat(timespec="seconds"),
+            "url": "/" + quote(os.path.relpath(f["path"], directory).replace(os.sep, "/")),
+        } for f in records]
+        payload = {"files": files, "next": _encode_cursor(records[-1]) if more else None}
+        self._send_json(HTTPStatus.OK, payload, body, etag)
+
+    def _serve_export(self, token: str, body: bool):
+        export = export_entries(token)
+        if export is None:
+            self.send_error(HTTPStatus.NOT_FOUND, "Download link expired, select the files again")
+            return
+        name, entries = export
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{quote(name)}")
+        self.send_header("Cache-Control", "no-store")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        if not body:
+            return
+        chunked = _ChunkedWriter(self.wfile)
+        try:
+            with io.BufferedWriter(chunked, 256 * 1024) as out:
+                write_zip(entries, out)
+                out.flush()
+                chunked.finish()
+        except OSError:
+            #client cancelled, or a file failed mid-copy: no final chunk, so the browser
+            #reports the download as incomplete instead of saving a broken zip
+            self.close_connection = True
+
+    def _send_json(self, status, payload, body: bool, etag=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "no-cache")  # always revalidate, the ETag makes that cheap
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        if body:
+            self.wfile.write(data)
+
+    def _not_modified(self, etag: str, mtime) -> bool:
+        #If-None-Match wins over If-Modified-Since when both are sent
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            return "*" in tags or etag in tags
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since is not None and mtime is not None:
+            try:
+                return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError, IndexError, OverflowError):
+                return False
+        return False
+
+    def _requested_range(self, size: int, etag: str, mtime: float):
+        #(start, end) for a single "bytes=" range, None to send the whole file,
+        #or "unsatisfiable"; several ranges at once are answered with the whole file
+        header = self.headers.get("Range")
+        if header is None or not header.startswith("bytes=") or "," in header:
+            return None
+        if_range = self.headers.get("If-Range")
+        if if_range is not None and if_range != etag and if_range != self.date_time_string(int(mtime)):
+            return None  # the file changed since the client's partial copy
+        first, _, last = header[len("bytes="):].strip().partition("-")
+        try:
+            if first == "":
+                start, end = max(size - int(last), 0), size - 1  # "bytes=-500" = last 500 bytes
+            else:
+                start = int(first)
+                end = min(int(last), size - 1) if last else size - 1
+        except ValueError:
+            return None
+        if start > end or start >= size:
+            return "unsatisfiable"
+        return start, end
+
+def serve_folder(folder: str, port=FILE_SERVER_PORT, host=""):
+    #starts the server once per process; later calls (every Streamlit rerun) return the
+    #running one. Raises OSError if the port is taken by another process.
+    with _lock:
+        server = _servers.get(port)
+        if server is None:
+            handler = functools.partial(FileRequestHandler, directory=folder)
+            server = ThreadingHTTPServer((host, port), handler)
+            threading.Thread(target=server.serve_forever, name=f"file-server-{port}", daemon=True).start()
+            _servers[port] = server
+        return server
@@ -0,0 +1,43 @@
+import queue
+import threading
+import time
+from stage_timing import observe
+
+#=== Background prewarm ===
+#On a cold start the login page should appear as soon as Streamlit itself is loaded, so
+#the scripts do nothing before the form that the form does not need. The slow first-time
+#work of the pages after login (importing pandas and parsing the employee workbook,
+#creating the NAS folders, starting a workbook worker process) is handed to prewarm()
+#once the form has been sent to the browser.
+#Each task runs once per process. They run one after another, in the order given, on a
+#single daemon thread, so the warm-up never competes with itself for the CPU while the
+#user is logging in.
+#A task's duration shows up as stage "prewarm <name>" in the stage timings. A failed task
+#is not retried: the real call later does the same work and reports the error on the page.
+
+_started = set()  # task names already queued in this process
+_tasks = queue.Queue()
+_lock = threading.Lock()
+_thread = None
+
+def _run():
+    while True:
+        name, func, args, kwargs = _tasks.get()
+        start = time.perf_counter()
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            continue
+        observe(f"prewarm {name}", time.perf_counter() - start)
+
+def prewarm(name: str, func, *args, **kwargs):
+    #returns straight away; later calls with the same name (every rerun) do nothing
+    global _thread
+    with _lock:
+        if name in _started:
+            return
+        _started.add(name)
+        _tasks.put((name, func, args, kwargs))
+        if _thread is None:
+            _thread = threading.Thread(target=_run, name="prewarm", daemon=True)
+            _thread.start()
@@ -0,0 +1,206 @@
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+from upload_io import link_atomic
+
+#=== Background replication queue ===
+#handle_upload only waits for the primary copy (UPLOADS\<test>\<emp>\x.xlsx). The Spotfire
+#and DOWNLOADS copies are queued here and made by worker threads, so the success message
+#shows as soon as the upload itself is safe. Jobs live in SQLite on local disk, so a
+#restart picks up whatever was still pending. A failed copy is retried with exponential
+#backoff (plus jitter so many failed jobs don't all hit the NAS at once) and marked
+#"failed" after REPLICATION_MAX_ATTEMPTS.
+#Copies use link_atomic: a hardlink when source and destination share a filesystem,
+#otherwise a chunked copy to a temp file that is renamed into place.
+#Every app variant shares the queue, so a running job carries its owner (host:pid) and a
+#lease that the owner renews while it copies. A job whose lease ran out was left by a
+#process that died mid-copy and is taken over by whichever worker sees it first; a job
+#another live process is still copying is never touched. Finished jobs stay for
+#REPLICATION_RETENTION so the log can show them, then they are deleted.
+
+REPLICATION_DB = os.environ.get(
+    "RE_PN_LAB_REPLICATION_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "replication_queue.sqlite3"),
+)
+REPLICATION_WORKERS = int(os.environ.get("RE_PN_LAB_REPLICATION_WORKERS", "2"))
+REPLICATION_MAX_ATTEMPTS = 8
+RETRY_BASE_DELAY = 2.0   # seconds before the first retry, doubled after every failure
+RETRY_MAX_DELAY = 300.0  # never wait longer than this between two attempts
+REPLICATION_LEASE = 120.0  # seconds a running job stays claimed without being renewed
+REPLICATION_RETENTION = 7 * 86400  # seconds 'done' jobs are kept
+_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+_local = threading.local()
+_wake = threading.Event()
+_start_lock = threading.Lock()
+_workers = []
+_copying = set()  # ids of the jobs this process's workers are copying right now
+_copying_lock = threading.Lock()
+
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(REPLICATION_DB, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id       INTEGER PRIMARY KEY,
+                src      TEXT NOT NULL,
+                dst      TEXT NOT NULL,
+                state    TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_try REAL NOT NULL,
+                error    TEXT,
+                updated  REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_due ON jobs (state, next_try);
+            CREATE INDEX IF NOT EXISTS jobs_src ON jobs (src);
+        """)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for column, kind in (("owner", "TEXT"), ("lease", "REAL NOT NULL DEFAULT 0")):
+            if column not in columns:  # queue created before leases
+                try:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+                except sqlite3.OperationalError:
+                    pass  # added by another process in between
+        _local.conn = conn
+    return conn
+
+def _norm(path: str) -> str:
+    #same form as the catalog's paths, so log rows can look their jobs up directly
+    return os.path.normpath(os.path.abspath(path))
+
+def enqueue_replication(src: str, dst_paths):
+    #queues one copy of src per destination; an older job for the same pair is replaced
+    start_replication_workers()
+    src = _norm(src)
+    conn = _connect()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for dst in map(_norm, dst_paths):
+            conn.execute("DELETE FROM jobs WHERE src = ? AND dst = ? AND state != 'running'", (src, dst))
+            conn.execute(
+                "INSERT INTO jobs (src, dst, state, next_try, updated) VALUES (?, ?, 'pending', ?, ?)",
+                (src, dst, now, now),
+            )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    _wake.set()
+
+def replication_states(src_paths):
+    #{src: [(dst, state, attempts, error), ...]} for the given primary copies
+    start_replication_workers()  # jobs left pending by a restart are copied without a new upload
+    originals = {_norm(src): src for src in src_paths}
+    states = {src: [] for src in originals.values()}
+    src_paths = list(originals)
+    conn = _connect()
+    for i in range(0, len(src_paths), 500):  # stay under SQLite's parameter limit
+        batch = src_paths[i:i + 500]
+        rows = conn.execute(
+            f"SELECT src, dst, state, attempts, error FROM jobs WHERE src IN ({','.join('?' * len(batch))}) ORDER BY id",
+            batch,
+        )
+        for src, dst, state, attempts, error in rows:
+            states[originals[src]].append((dst, state, attempts, error))
+    return states
+
+def _claim():
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        now = time.time()
+        row = conn.execute(
+            "SELECT id, src, dst, attempts FROM jobs WHERE (state = 'pending' AND next_try <= ?) "
+            "OR (state = 'running' AND lease < ?) ORDER BY next_try LIMIT 1",
+            (now, now),
+        ).fetchone()
+        if row is not None:
+            conn.execute("UPDATE jobs SET state = 'running', owner = ?, lease = ?, updated = ? WHERE id = ?",
+                         (_OWNER, now + REPLICATION_LEASE, now, row[0]))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return row
+
+def _finish(job_id: int, attempts: int, error=None):
+    now = time.time()
+    if error is None:
+        _connect().execute(
+            "UPDATE jobs SET state = 'done', attempts = ?, error = NULL, updated = ? WHERE id = ? AND owner = ?",
+            (attempts, now, job_id, _OWNER),
+        )
+    elif attempts >= REPLICATION_MAX_ATTEMPTS:
+        _connect().execute(
+            "UPDATE jobs SET state = 'failed', attempts = ?, error = ?, updated = ? WHERE id = ? AND owner = ?",
+            (attempts, error, now, job_id, _OWNER),
+        )
+    else:
+        delay = min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY) * random.uniform(0.8, 1.2)
+        _connect().execute(
+            "UPDATE jobs SET state = 'pending', attempts = ?, error = ?, next_try = ?, updated = ? WHERE id = ? AND owner = ?",
+            (attempts, error, now + delay, now, job_id, _OWNER),
+        )
+
+def _worker():
+    while True:
+        try:
+            job = _claim()
+        except sqlite3.Error:
+            job = None
+        if job is None:
+            _wake.wait(timeout=1.0)
+            _wake.clear()
+            continue
+        job_id, src, dst, attempts = job
+        with _copying_lock:
+            _copying.add(job_id)
+        try:
+            try:
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                link_atomic(src, dst)
+                error = None
+            except Exception as e:
+                error = str(e)
+            _finish(job_id, attempts + 1, error)
+        except sqlite3.Error:
+            pass  # queue busy: the job's lease runs out and it is retried, here or elsewhere
+        finally:
+            with _copying_lock:
+                _copying.discard(job_id)
+
+def _keeper():
+    #renews the leases of the jobs being copied and deletes old finished jobs (a job whose
+    #result could not be saved is no longer renewed, so it runs out and is retried)
+    while True:
+        now = time.time()
+        with _copying_lock:
+            copying = list(_copying)
+        try:
+            conn = _connect()
+            conn.executemany("UPDATE jobs SET lease = ? WHERE id = ? AND state = 'running' AND owner = ?",
+                             [(now + REPLICATION_LEASE, job_id, _OWNER) for job_id in copying])
+            conn.execute("DELETE FROM jobs WHERE state = 'done' AND updated < ?", (now - REPLICATION_RETENTION,))
+        except sqlite3.Error:
+            pass  # retried next round, well before the leases run out
+        time.sleep(REPLICATION_LEASE / 4)
+
+def start_replication_workers():
+    #starts the worker threads once per process (at script start, from enqueue_replication
+    #and replication_states); later calls return straight away
+    with _start_lock:
+        if _workers:
+            return
+        keeper = threading.Thread(target=_keeper, name="replication-lease", daemon=True)
+        keeper.start()
+        _workers.append(keeper)
+        for i in range(REPLICATION_WORKERS):
+            thread = threading.Thread(target=_worker, name=f"replication-{i}", daemon=True)
+            thread.start()
+            _workers.append(thread)
@@ -0,0 +1,132 @@
+import cProfile
+import os
+import sys
+import threading
+from collections import Counter
+from datetime import datetime
+
+#=== Rerun profiler ===
+#Opt-in profiling of whole script reruns for chosen employees, to find out why a page is
+#slow for one user in production without touching the scripts. A rerun is profiled when
+#its employee is in RE_PN_LAB_PROFILE_EMPLOYEES (comma separated employee numbers, "*" =
+#everyone) or was switched on at runtime by an admin (set_profiled, sidebar panel).
+#The script calls start_profile() first thing and finish_profile() last; each profiled
+#rerun becomes one file in PROFILE_DIR named
+#  <YYYYmmdd-HHMMSS-ms>_<employee>_<tab>.<ext>
+#RE_PN_LAB_PROFILE_MODE picks the profiler:
+#  sample    (default) the script thread's stack is sampled every SAMPLE_INTERVAL seconds
+#            from another thread; writes .folded ("frame;frame;frame count" per line),
+#            the input of flamegraph.pl, speedscope and inferno. Low overhead.
+#  cprofile  deterministic cProfile; writes .prof (pstats), for snakeviz / flameprof /
+#            python -m pstats. Exact call counts, but slows the rerun down noticeably.
+#A rerun cut short (st.stop, st.rerun) is not written; its profiler is dropped by the
+#next start_profile or, for the sampler, when its thread ends.
+
+PROFILE_DIR = os.environ.get(
+    "RE_PN_LAB_PROFILE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles"),
+)
+PROFILE_MODE = os.environ.get("RE_PN_LAB_PROFILE_MODE", "sample")
+PROFILE_EMPLOYEES = frozenset(
+    e.strip() for e in os.environ.get("RE_PN_LAB_PROFILE_EMPLOYEES", "").split(",") if e.strip()
+)
+SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+
+_profiled = set()  # employees switched on at runtime
+_lock = threading.Lock()
+_local = threading.local()  # per script thread: the running profile
+
+def set_profiled(emp_id: str, on: bool):
+    with _lock:
+        if on:
+            _profiled.add(emp_id)
+        else:
+            _profiled.discard(emp_id)
+
+def profiled_employees():
+    #(from the environment, switched on at runtime)
+    with _lock:
+        return sorted(PROFILE_EMPLOYEES), sorted(_profiled)
+
+def is_profiled(emp_id) -> bool:
+    if "*" in PROFILE_EMPLOYEES:
+        return True
+    if not emp_id:
+        return False
+    with _lock:
+        return emp_id in PROFILE_EMPLOYEES or emp_id in _profiled
+
+class _Sampler:
+    def __init__(self, ident: int):
+        self.ident = ident
+        self.stacks = Counter()
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="rerun-profiler", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stop.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self.ident)
+            if frame is None:
+                return  # script thread is gone (rerun cut short)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def close(self):
+        self.stop.set()
+        self.thread.join()
+
+    def write(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+class _Deterministic:
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def close(self):
+        self.profile.disable()
+
+    def write(self, path: str):
+        self.profile.dump_stats(path)
+
+def _drop():
+    running = getattr(_local, "profile", None)
+    if running is not None:
+        running[0].close()
+        _local.profile = None
+
+def start_profile(emp_id):
+    #call first thing in the script with the session's employee (None before login)
+    _drop()
+    if not is_profiled(emp_id):
+        return
+    profiler = _Deterministic() if PROFILE_MODE == "cprofile" else _Sampler(threading.get_ident())
+    _local.profile = (profiler, datetime.now(), emp_id)
+
+def _safe(value: str) -> str:
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in value).strip("_") or "none"
+
+def finish_profile(tab=None):
+    #call last thing in the script; returns the profile file written, or None
+    running = getattr(_local, "profile", None)
+    if running is None:
+        return None
+    profiler, started, emp_id = running
+    _drop()
+    ext = ".prof" if isinstance(profiler, _Deterministic) else ".folded"
+    name = f"{started:%Y%m%d-%H%M%S}-{started.microsecond // 1000:03d}_{_safe(emp_id or 'login')}_{_safe(tab or 'no tab')}{ext}"
+    path = os.path.join(PROFILE_DIR, name)
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.write(path)
+    except OSError as e:
+        print(f"rerun_profiler: could not write {path}: {e}", file=sys.stderr)
+        return None
+    return path
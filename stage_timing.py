@@ -0,0 +1,158 @@
+import io
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from upload_io import write_stream_atomic
+
+#=== Stage timing ===
+#Answers "where does the time go" for a slow page: the scripts wrap each stage of a
+#rerun in span("stage"), e.g. load_employee_list, list_files_fast, render rows, and every
+#measurement lands in a histogram per (tab, stage), shared by all sessions of the process.
+#A rerun only learns its tab after the navigation widget, so spans measured before
+#set_tab() (the employee list...) are held and then filed under that tab; a rerun that
+#stops earlier (login page) files them under NO_TAB. finish_rerun() adds the whole rerun.
+#Each histogram keeps Prometheus buckets (count / sum since start) and the last WINDOW
+#samples for p50 / p95 / p99. A daemon thread writes them every METRICS_INTERVAL seconds
+#to METRICS_FILE (RE_PN_LAB_METRICS_FILE, empty = off):
+#  *.prom   Prometheus text format, replaced atomically (node_exporter textfile collector)
+#  *.jsonl  one line per (tab, stage) appended per interval, for log-based monitoring
+
+METRICS_FILE = os.environ.get(
+    "RE_PN_LAB_METRICS_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "stage_metrics.prom"),
+)
+METRICS_INTERVAL = 15  # seconds between metrics file writes
+WINDOW = 1000  # recent samples per (tab, stage) used for the percentiles
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+NO_TAB = "(no tab)"
+METRIC_NAME = "re_pn_lab_stage_seconds"
+
+_stats = {}  # (tab, stage) -> {"buckets", "count", "sum", "recent"}
+_lock = threading.Lock()
+_local = threading.local()  # per script thread: tab, spans waiting for it, rerun start
+_writer = None
+
+def observe(stage: str, seconds: float, tab=None):
+    key = (tab or NO_TAB, stage)
+    with _lock:
+        hist = _stats.get(key)
+        if hist is None:
+            hist = _stats[key] = {"buckets": [0] * len(BUCKETS), "count": 0, "sum": 0.0,
+                                  "recent": deque(maxlen=WINDOW)}
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                hist["buckets"][i] += 1
+        hist["count"] += 1
+        hist["sum"] += seconds
+        hist["recent"].append(seconds)
+
+def _flush(tab):
+    for stage, seconds in getattr(_local, "pending", ()):
+        observe(stage, seconds, tab)
+    _local.pending = []
+
+def start_rerun():
+    #call first thing in the script
+    _flush(NO_TAB)  # the previous rerun never reached set_tab
+    _local.tab = None
+    _local.started = time.perf_counter()
+
+def set_tab(tab: str):
+    _local.tab = tab
+    _flush(tab)
+
+def current_tab():
+    return getattr(_local, "tab", None)
+
+def finish_rerun():
+    #call last thing in the script; reruns cut short (st.stop, st.rerun) are not counted
+    started = getattr(_local, "started", None)
+    if started is not None:
+        observe("rerun", time.perf_counter() - started, current_tab())
+        _local.started = None
+
+@contextmanager
+def span(stage: str, tab=None):
+    #tab defaults to the current rerun's tab (pass it for work outside the script thread)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        tab = tab or current_tab()
+        if tab is None:
+            _local.pending = getattr(_local, "pending", []) + [(stage, seconds)]
+        else:
+            observe(stage, seconds, tab)
+
+def _percentile(ordered, q: float) -> float:
+    #nearest-rank percentile of an already sorted list
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+def stage_summary():
+    #[{"tab", "stage", "count", "mean", "p50", "p95", "p99"}] in seconds, by tab then stage
+    with _lock:
+        items = [(key, hist["count"], hist["sum"], sorted(hist["recent"])) for key, hist in _stats.items()]
+    return [{"tab": tab, "stage": stage, "count": count, "mean": total / count,
+             "p50": _percentile(recent, 0.50), "p95": _percentile(recent, 0.95), "p99": _percentile(recent, 0.99)}
+            for (tab, stage), count, total, recent in sorted(items)]
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def prometheus_text() -> str:
+    with _lock:
+        items = sorted((key, list(hist["buckets"]), hist["count"], hist["sum"]) for key, hist in _stats.items())
+    lines = [f"# HELP {METRIC_NAME} Time spent per stage of a Streamlit rerun.",
+             f"# TYPE {METRIC_NAME} histogram"]
+    for (tab, stage), buckets, count, total in items:
+        labels = f'tab="{_label(tab)}",stage="{_label(stage)}"'
+        lines += [f'{METRIC_NAME}_bucket{{{labels},le="{bound:g}"}} {n}' for bound, n in zip(BUCKETS, buckets)]
+        lines += [f'{METRIC_NAME}_bucket{{{labels},le="+Inf"}} {count}',
+                  f"{METRIC_NAME}_sum{{{labels}}} {total:.6f}",
+                  f"{METRIC_NAME}_count{{{labels}}} {count}"]
+    quantiles = f"{METRIC_NAME}_recent"
+    lines += [f"# HELP {quantiles} Percentiles of the last {WINDOW} measurements per stage.",
+              f"# TYPE {quantiles} gauge"]
+    for row in stage_summary():
+        labels = f'tab="{_label(row["tab"])}",stage="{_label(row["stage"])}"'
+        lines += [f'{quantiles}{{{labels},quantile="{q}"}} {row[key]:.6f}'
+                  for q, key in (("0.5", "p50"), ("0.95", "p95"), ("0.99", "p99"))]
+    return "\n".join(lines) + "\n"
+
+def write_metrics(path=METRICS_FILE):
+    if path.endswith(".jsonl"):
+        now = time.strftime("%Y-%m-%dT%H:%M:%S")
+        with open(path, "a", encoding="utf-8") as f:
+            for row in stage_summary():
+                f.write(json.dumps({"time": now, **row}) + "\n")
+    else:
+        write_stream_atomic(io.BytesIO(prometheus_text().encode("utf-8")), path)
+
+def start_metrics_writer(path=METRICS_FILE, interval=METRICS_INTERVAL):
+    #once per process; later calls (every rerun) return straight away
+    global _writer
+    if not path:
+        return
+    with _lock:
+        if _writer is not None:
+            return
+        def run():
+            written = None
+            while True:
+                time.sleep(interval)
+                with _lock:
+                    version = sum(hist["count"] for hist in _stats.values())
+                if version == written:
+                    continue  # nothing measured since the last write
+                try:
+                    write_metrics(path)
+                    written = version
+                except OSError:
+                    pass  # retried next interval
+        _writer = threading.Thread(target=run, name="stage-metrics", daemon=True)
+        _writer.start()
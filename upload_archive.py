@@ -0,0 +1,144 @@
+import argparse
+import os
+import shutil
+import time
+import uuid
+import zipfile
+from datetime import datetime
+from blob_store import collect_unreferenced_blobs
+from file_catalog import catalog_add, catalog_archive, catalog_files, reconcile_catalog
+from file_scanner import scan_files
+from upload_io import TEMP_SUFFIX, remove_file
+
+#=== Age-based archive ===
+#Uploads older than ARCHIVE_AGE_DAYS (by upload time in the catalog) are moved out of the live tree
+#UPLOADS\<test>\<employee> into one zip bundle per test and month:
+#  UPLOADS\.archive\TRH\2024-03.zip   members "<employee>/<file name>"
+#so folder scans and the catalog only carry recent history. A zip's central directory
+#is a seekable member index: one member can be read without unpacking the rest. The
+#file catalog also indexes every member (catalog_archive), so the Uploaded Log lists
+#archived files per month and downloads them (file_download.deferred_member) without
+#opening a bundle just to see what is inside.
+#A month that already has a bundle gets new members appended to a copy of it, which
+#then replaces the original in one rename, so a bundle is never left half-written.
+#Originals are deleted only after their member was read back from the new bundle with
+#the expected size, and only after the catalog index points at it. Each original is
+#checked again (size, mtime) right before it is deleted: a file re-uploaded under the
+#same name while the run was packing is a new file, and it stays, listed as live.
+#Uploads are hardlinks into the blob store (blob_store), so deleting one frees no space
+#while the blob is still there: the run ends by dropping blobs no upload links to any more.
+#Run it from a scheduled task on the machine that hosts the app (the catalog is local):
+#  python upload_archive.py "\\server\...\UPLOADS" --days 365
+
+ARCHIVE_AGE_DAYS = int(os.environ.get("RE_PN_LAB_ARCHIVE_AGE_DAYS", "365"))
+ARCHIVE_DIR_NAME = ".archive"
+SKIP_FOLDERS = {"Spotfire", "DOWNLOADS"}  # copies, not test folders
+
+def _member_name(f, taken) -> str:
+    member = f"{f['employee']}/{f['name']}"
+    stem, ext = os.path.splitext(member)
+    n = 1
+    while member in taken:  # same employee + name archived before in this month
+        member = f"{stem}~{n}{ext}"
+        n += 1
+    return member
+
+def _unchanged(f) -> bool:
+    #f = scan record; False once the path was removed or replaced since the scan
+    try:
+        stat = os.stat(f["path"])
+    except OSError:
+        return False
+    return (stat.st_size, stat.st_mtime) == (f["size"], f["mtime"])
+
+def _pack(bundle: str, files):
+    #adds files to the bundle; returns {path: member} for the members verified afterwards
+    os.makedirs(os.path.dirname(bundle), exist_ok=True)
+    tmp = os.path.join(os.path.dirname(bundle), f".{os.path.basename(bundle)}.{uuid.uuid4().hex[:8]}{TEMP_SUFFIX}")
+    written = {}
+    try:
+        if os.path.exists(bundle):
+            shutil.copyfile(bundle, tmp)
+        with zipfile.ZipFile(tmp, "a" if os.path.exists(tmp) else "w", zipfile.ZIP_DEFLATED) as zf:
+            taken = set(zf.namelist())
+            for f in files:
+                if not _unchanged(f):
+                    continue  # changed since it was listed: leave it for the next run
+                member = _member_name(f, taken)
+                zf.write(f["path"], member)
+                taken.add(member)
+                written[f["path"]] = member
+        with open(tmp, "rb+") as out:
+            os.fsync(out.fileno())
+        os.replace(tmp, bundle)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    sizes = {f["path"]: f["size"] for f in files}
+    with zipfile.ZipFile(bundle) as zf:
+        infos = {info.filename: info for info in zf.infolist()}
+    return {path: member for path, member in written.items()
+            if member in infos and infos[member].file_size == sizes[path]}
+
+def archive_folder(root: str, archive_root: str, max_age_days=ARCHIVE_AGE_DAYS, now=None):
+    #packs files under one test folder older than max_age_days; returns how many were archived
+    cutoff = (now or time.time()) - max_age_days * 86400
+    files = scan_files(root)
+    reconcile_catalog(root, files)
+    #age by upload time: a re-upload of old bytes links to a blob with an old file mtime
+    uploaded = {f["path"]: f["mtime"] for f in catalog_files(root)}
+    by_month = {}
+    for f in files:
+        when = uploaded.get(os.path.normpath(os.path.abspath(f["path"])), f["mtime"])
+        if when < cutoff:
+            by_month.setdefault(datetime.fromtimestamp(when).strftime("%Y-%m"), []).append((f, when))
+    archived = 0
+    for month, group in sorted(by_month.items()):
+        bundle = os.path.join(archive_root, f"{month}.zip")
+        members = _pack(bundle, [f for f, _ in group])
+        packed = [(f, when) for f, when in group if f["path"] in members and _unchanged(f)]
+        entries = [(dict(f, mtime=when), month, bundle, members[f["path"]]) for f, when in packed]
+        catalog_archive(root, entries)
+        for f, _ in packed:
+            if not _unchanged(f):
+                #re-uploaded since the catalog row moved to the archive: keep the new file listed
+                catalog_add(root, f["path"])
+                continue
+            try:
+                remove_file(f["path"])  # may be a read-only blob link
+            except FileNotFoundError:
+                pass
+            try:
+                os.rmdir(os.path.dirname(f["path"]))  # only succeeds once the folder is empty
+            except OSError:
+                pass
+        archived += len(entries)
+    return archived
+
+def archive_uploads(uploads_root: str, tests=None, max_age_days=ARCHIVE_AGE_DAYS):
+    #{test: files archived}; tests defaults to every test folder under uploads_root
+    if tests is None:
+        tests = sorted(
+            name for name in os.listdir(uploads_root)
+            if os.path.isdir(os.path.join(uploads_root, name))
+            and not name.startswith(".") and name not in SKIP_FOLDERS
+        )
+    return {
+        test: archive_folder(os.path.join(uploads_root, test),
+                             os.path.join(uploads_root, ARCHIVE_DIR_NAME, test),
+                             max_age_days)
+        for test in tests
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack old uploads into monthly zip bundles per test.")
+    parser.add_argument("uploads_root", help=r"e.g. \\server\...\Digitalization\UPLOADS")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AGE_DAYS, help="archive files older than this")
+    parser.add_argument("--tests", nargs="*", help="test folders to archive (default: all)")
+    args = parser.parse_args()
+    for test, count in archive_uploads(args.uploads_root, args.tests, args.days).items():
+        print(f"{test}: {count} file(s) archived")
+    print(f"{collect_unreferenced_blobs(args.uploads_root)} unreferenced blob(s) removed")
@@ -0,0 +1,251 @@
+import hashlib
+import os
+import queue
+import shutil
+import socket
+import stat
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+#=== Atomic streaming writes ===
+#Uploads are copied in fixed-size chunks into a temp file in the destination folder,
+#hashed on the way, flushed to disk and only then renamed onto the final name. Readers
+#(Spotfire, the Uploaded Log) either see the old file or the complete new one, never a
+#half-written workbook, and memory stays at one chunk however large the upload is.
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MB per write
+TEMP_SUFFIX = ".part"  # in-progress files; the folder scanner skips these
+
+def _temp_path(dst_path: str) -> str:
+    folder, name = os.path.split(dst_path)
+    return os.path.join(folder, f".{name}.{uuid.uuid4().hex[:8]}{TEMP_SUFFIX}")
+
+def write_stream_atomic(src, dst_path: str, chunk_size=UPLOAD_CHUNK_SIZE):
+    #src = any binary file object (st.file_uploader's UploadedFile, an open file...)
+    #returns (size in bytes, sha256 hex digest) of what was written
+    tmp_path = _temp_path(dst_path)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as out:
+            while True:
+                chunk = src.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+        replace_file(tmp_path, dst_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return size, digest.hexdigest()
+
+def copy_file_atomic(src_path: str, dst_path: str, chunk_size=UPLOAD_CHUNK_SIZE):
+    #shutil.copy2 replacement: same metadata copy, but the destination appears in one step
+    with open(src_path, "rb") as src:
+        result = write_stream_atomic(src, dst_path, chunk_size)
+    shutil.copystat(src_path, dst_path)
+    return result
+
+#=== Read-only files ===
+#Stored blobs (blob_store) are read-only, and so is every upload path linked to them.
+#Replacing or deleting such a path works as is on POSIX; Windows refuses until the
+#read-only attribute is cleared, which also clears it on the other links (blob_store
+#sets it again the next time the blob is reused).
+
+def _make_writable(path: str):
+    try:
+        os.chmod(path, os.stat(path).st_mode | stat.S_IWRITE)
+    except OSError:
+        pass
+
+def replace_file(tmp_path: str, dst_path: str):
+    try:
+        os.replace(tmp_path, dst_path)
+    except PermissionError:
+        _make_writable(dst_path)
+        os.replace(tmp_path, dst_path)
+
+def remove_file(path: str):
+    try:
+        os.remove(path)
+    except PermissionError:
+        _make_writable(path)
+        os.remove(path)
+
+#=== Upload tokens ===
+#st.file_uploader hands back the same file on every rerun (changing a selectbox, clicking
+#a download button...). upload_token identifies the upload from the copy Streamlit already
+#holds in memory, so handle_upload can tell it was saved before without touching the NAS.
+
+def upload_token(file):
+    #(name, size, sha256) of an UploadedFile; its read position is not moved
+    with file.getbuffer() as data:
+        digest = hashlib.sha256(data).hexdigest()
+    return file.name, file.size, digest
+
+#=== Fan-out writes ===
+#One upload often has to land in several folders (employee folder, Spotfire, DOWNLOADS).
+#fan_out_write reads the upload once and feeds every chunk to one writer thread per
+#filesystem in parallel. Destinations on the same filesystem as an already written copy
+#become hardlinks to it (falling back to a local copy where links are not supported),
+#so each filesystem is written to once and nothing is read back over the network.
+
+FAN_OUT_QUEUE_CHUNKS = 4  # chunks buffered per writer, bounds memory while a writer lags
+
+def file_device(folder: str):
+    return os.stat(folder).st_dev
+
+def _writer(chunks, tmp_path: str, state: dict):
+    try:
+        with open(tmp_path, "wb") as out:
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    break
+                if "error" not in state:
+                    out.write(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+    except Exception as e:
+        state["error"] = str(e)
+        while chunks.get() is not None:
+            pass  # keep draining so the reader never blocks on a failed writer
+
+def _finish_writers(writers):
+    for _, _, chunks, _, _ in writers:
+        chunks.put(None)
+    for _, _, _, _, thread in writers:
+        thread.join()
+
+def link_atomic(src_path: str, dst_path: str):
+    #hardlink under a temp name, then rename over dst so it appears in one step
+    tmp_path = _temp_path(dst_path)
+    try:
+        os.link(src_path, tmp_path)
+        replace_file(tmp_path, dst_path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        copy_file_atomic(src_path, dst_path)
+
+def fan_out_write(src, dst_paths, chunk_size=UPLOAD_CHUNK_SIZE):
+    #src = binary file object, dst_paths = full destination paths (folders must exist)
+    #returns (size, sha256 hex digest, {dst_path: status}) where status is like save_to_local:
+    #True = written, str = error message
+    statuses = {}
+    groups = {}  # device -> [paths]
+    seen = set()
+    for dst_path in dst_paths:
+        key = os.path.normcase(os.path.abspath(dst_path))
+        if key in seen:
+            continue  # listed twice, written once
+        seen.add(key)
+        try:
+            groups.setdefault(file_device(os.path.dirname(os.path.abspath(dst_path))), []).append(dst_path)
+        except OSError as e:
+            statuses[dst_path] = str(e)
+
+    writers = []  # (first path of the group, tmp path, queue, state, thread)
+    for paths in groups.values():
+        tmp_path = _temp_path(paths[0])
+        chunks = queue.Queue(maxsize=FAN_OUT_QUEUE_CHUNKS)
+        state = {}
+        thread = threading.Thread(target=_writer, args=(chunks, tmp_path, state), daemon=True)
+        thread.start()
+        writers.append((paths, tmp_path, chunks, state, thread))
+
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        while True:
+            chunk = src.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+            for _, _, chunks, _, _ in writers:
+                chunks.put(chunk)
+    except BaseException:
+        #reading the upload failed or the rerun was stopped: no destination has been
+        #touched yet, and no half-written temp file is left in any folder
+        _finish_writers(writers)
+        for _, tmp_path, _, _, _ in writers:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        raise
+    _finish_writers(writers)
+
+    for paths, tmp_path, _, state, _ in writers:
+        first = paths[0]
+        try:
+            if "error" in state:
+                raise OSError(state["error"])
+            replace_file(tmp_path, first)
+        except OSError as e:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            for dst_path in paths:
+                statuses[dst_path] = str(e)
+            continue
+        statuses[first] = True
+        for dst_path in paths[1:]:
+            try:
+                link_atomic(first, dst_path)
+                statuses[dst_path] = True
+            except Exception as e:
+                statuses[dst_path] = str(e)
+    return size, digest.hexdigest(), statuses
+
+#=== Cross-process folder locks ===
+#Several app processes (TEST4, TEST5, app_professional_update..., each with its workbook
+#worker processes) write to the same Spotfire folders. folder_lock serialises a
+#read-modify-write on files in one folder across all of them, even on other machines:
+#whoever creates the lock file (O_EXCL, which SMB shares honour too) holds the lock, the
+#others poll until it is deleted. The lock file ends in TEMP_SUFFIX, so scans skip it.
+#A lock file older than LOCK_STALE seconds was left by a process that died holding it
+#and is removed; the critical sections are far shorter than that.
+
+LOCK_STALE = 600
+LOCK_POLL = 0.05  # seconds between attempts while another process holds the lock
+
+@contextmanager
+def folder_lock(folder: str, name: str):
+    #with folder_lock(folder, "schema"): ...   not re-entrant
+    path = os.path.join(folder, f".{name}.lock{TEMP_SUFFIX}")
+    os.makedirs(folder, exist_ok=True)
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.stat(path).st_mtime > LOCK_STALE:
+                    os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue  # released in between
+            time.sleep(LOCK_POLL)
+    try:
+        os.write(fd, f"{socket.gethostname()} {os.getpid()}\n".encode("utf-8"))  # who holds it
+        os.close(fd)
+        yield
+    finally:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,204 @@
+import io
+import json
+import os
+from datetime import datetime
+import pandas as pd
+from upload_io import folder_lock, write_stream_atomic
+
+#=== Ingest-time Parquet conversion ===
+#Spotfire used to parse every raw .xlsx in UPLOADS\Spotfire\<test> on each refresh.
+#handle_upload now converts the workbook once, at upload time, into a typed Parquet
+#file next to it (report.xlsx -> report.parquet), so the dashboards can read columnar
+#data instead.
+#Each test folder keeps its schema in _schema.json: the column names and types seen
+#first fix the schema, and every later workbook of that test is cast to it. Columns a
+#workbook lacks are written as nulls, and columns never seen before are appended, so
+#the schema only grows and files of one test always line up. A value that cannot be
+#cast to its column's type (text in a numeric column...) is written as null and
+#counted, so the upload can warn about it.
+#One sheet is converted: the test's "sheet" rule (workbook_validation), the one the upload
+#was checked against, else the first sheet. pyarrow is imported on first use, so the app still
+#starts (and uploads still work) where it is missing.
+#Workbooks are converted in several worker processes, and several app variants share
+#the Spotfire folders, so the schema update is guarded by a lock file (folder_lock).
+
+PARQUET_SUFFIX = ".parquet"
+SCHEMA_FILE_NAME = "_schema.json"
+
+def _arrow_type(type_name: str):
+    import pyarrow as pa
+    return {
+        "double": pa.float64(),
+        "timestamp": pa.timestamp("us"),
+        "bool": pa.bool_(),
+        "string": pa.string(),
+    }[type_name]
+
+def _infer_type(series) -> str:
+    #integers are stored as double so a later workbook with blanks in that column still fits
+    if pd.api.types.is_bool_dtype(series):
+        return "bool"
+    if pd.api.types.is_numeric_dtype(series):
+        return "double"
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return "timestamp"
+    return "string"
+
+def _cast(series, type_name: str):
+    if type_name == "double":
+        return pd.to_numeric(series, errors="coerce").astype("float64")
+    if type_name == "timestamp":
+        return pd.to_datetime(series, errors="coerce")
+    if type_name == "bool":
+        if pd.api.types.is_bool_dtype(series):
+            return series.astype("boolean")
+        return series.map(lambda v: v if isinstance(v, bool) else None).astype("boolean")
+    return series.map(lambda v: None if pd.isna(v) else str(v)).astype("object")
+
+def load_schema(folder: str):
+    #[{"name", "type"}, ...] for the test folder, or [] before its first workbook
+    try:
+        with open(os.path.join(folder, SCHEMA_FILE_NAME), encoding="utf-8") as f:
+            return json.load(f)["columns"]
+    except FileNotFoundError:
+        return []
+
+def _save_schema(folder: str, columns):
+    data = json.dumps({"columns": columns}, indent=1).encode("utf-8")
+    write_stream_atomic(io.BytesIO(data), os.path.join(folder, SCHEMA_FILE_NAME))
+
+def conform(df, columns):
+    #returns (df cast to the schema, schema with any new columns appended, values nulled by the cast)
+    df = df.rename(columns=str)
+    columns = list(columns)
+    known = {c["name"] for c in columns}
+    for name in df.columns:
+        if name not in known:
+            columns.append({"name": name, "type": _infer_type(df[name])})
+            known.add(name)
+    out = {}
+    nulled = 0
+    for column in columns:
+        if column["name"] in df.columns:
+            cast = _cast(df[column["name"]], column["type"])
+            nulled += int((df[column["name"]].notna() & cast.isna()).sum())
+        else:
+            cast = _cast(pd.Series([None] * len(df), dtype="object"), column["type"])
+        out[column["name"]] = cast
+    return pd.DataFrame(out, index=df.index), columns, nulled
+
+def _write_table(table, path: str):
+    import pyarrow.parquet as pq
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer)
+    buffer.seek(0)
+    write_stream_atomic(buffer, path)
+
+def ingest_workbook(src, folder: str, name: str, provenance=None, sheet=0):
+    #src = the uploaded workbook (file object); writes <folder>\<stem>.parquet and, given
+    #provenance = {"sha256", "employee"}, appends it to the test's dataset as well
+    #sheet = sheet name or index to convert (rules_sheet of the test's rules)
+    #returns (parquet path, rows, values nulled because they did not fit the schema,
+    #         appended to the dataset: True, or False if that content was already in it)
+    import pyarrow as pa
+    if hasattr(src, "seek"):
+        src.seek(0)
+    df = pd.read_excel(src, sheet_name=sheet)
+    os.makedirs(folder, exist_ok=True)
+    with folder_lock(folder, "schema"):
+        current = load_schema(folder)
+        df, columns, nulled = conform(df, current)
+        if columns != current:
+            _save_schema(folder, columns)
+    schema = pa.schema([(c["name"], _arrow_type(c["type"])) for c in columns])
+    table = pa.Table.from_pandas(df, schema=schema, preserve_index=False, safe=False)
+    out_path = os.path.join(folder, os.path.splitext(name)[0] + PARQUET_SUFFIX)
+    _write_table(table, out_path)
+    appended = False
+    if provenance is not None:
+        appended = append_to_dataset(table, folder, provenance["sha256"], provenance["employee"], name)
+    return out_path, len(df), nulled, appended
+
+#=== Consolidated dataset per test ===
+#Besides one Parquet file per workbook, every test folder keeps a single dataset that a
+#dashboard can read in one go instead of opening N files:
+#  Spotfire\TRH\dataset\upload_date=2025-01-31\<sha256>.parquet   (hive-style partitions)
+#Each upload appends its rows plus provenance columns (upload_employee, upload_file,
+#upload_sha256, upload_time). _manifest.jsonl lists every workbook in the dataset by
+#SHA-256, so the same content uploaded again (another name, another employee) is not
+#appended twice. Files are only ever added: when the first upload of a new day lands,
+#the previous day's partition is compacted into one file (dataset-<date>.parquet).
+#The manifest check + append and the compaction hold the dataset's lock file, so two
+#processes never append the same content or compact the same partition at once.
+
+DATASET_DIR_NAME = "dataset"
+MANIFEST_NAME = "_manifest.jsonl"
+PROVENANCE_COLUMNS = ("upload_employee", "upload_file", "upload_sha256", "upload_time")
+
+def dataset_dir(folder: str) -> str:
+    return os.path.join(folder, DATASET_DIR_NAME)
+
+def read_manifest(dataset: str):
+    #[{"sha256", "file", "employee", "uploaded_at", "partition", "rows"}, ...] oldest first
+    try:
+        with open(os.path.join(dataset, MANIFEST_NAME), encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+def append_to_dataset(table, folder: str, digest: str, employee: str, name: str, uploaded_at=None):
+    #table = the workbook as converted by ingest_workbook; returns False for a duplicate
+    import pyarrow as pa
+    dataset = dataset_dir(folder)
+    uploaded_at = uploaded_at or datetime.now()
+    partition = f"upload_date={uploaded_at:%Y-%m-%d}"
+    rows = table.num_rows
+    values = {
+        "upload_employee": pa.array([employee] * rows, pa.string()),
+        "upload_file": pa.array([name] * rows, pa.string()),
+        "upload_sha256": pa.array([digest] * rows, pa.string()),
+        "upload_time": pa.array([uploaded_at] * rows, pa.timestamp("us")),
+    }
+    for column in PROVENANCE_COLUMNS:
+        if column in table.column_names:  # a workbook column of the same name is replaced
+            table = table.drop_columns([column])
+        table = table.append_column(column, values[column])
+    with folder_lock(dataset, "dataset"):
+        entries = read_manifest(dataset)
+        if any(entry["sha256"] == digest for entry in entries):
+            return False
+        os.makedirs(os.path.join(dataset, partition), exist_ok=True)
+        _write_table(table, os.path.join(dataset, partition, digest + PARQUET_SUFFIX))
+        #the manifest line goes last: a crash before it leaves a file that the next upload
+        #of the same content simply overwrites
+        with open(os.path.join(dataset, MANIFEST_NAME), "a", encoding="utf-8") as f:
+            f.write(json.dumps({
+                "sha256": digest, "file": name, "employee": employee,
+                "uploaded_at": uploaded_at.isoformat(timespec="seconds"),
+                "partition": partition, "rows": rows,
+            }) + "\n")
+        previous = entries[-1]["partition"] if entries else None
+    if previous is not None and previous != partition:
+        compact_partition(dataset, previous)
+    return True
+
+def compact_partition(dataset: str, partition: str):
+    #merges the per-upload files of one partition into one file; schemas that grew in
+    #between are unified (older files get nulls for the newer columns)
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    folder = os.path.join(dataset, partition)
+    with folder_lock(dataset, "dataset"):
+        try:
+            parts = sorted(p for p in os.listdir(folder) if p.endswith(PARQUET_SUFFIX))
+        except FileNotFoundError:
+            return
+        if len(parts) <= 1:
+            return
+        tables = [pq.read_table(os.path.join(folder, p)) for p in parts]
+        merged = pa.concat_tables(tables, promote_options="default")
+        compacted = f"dataset-{partition.split('=', 1)[1]}{PARQUET_SUFFIX}"
+        _write_table(merged, os.path.join(folder, compacted))
+        for p in parts:
+            if p != compacted:
+                os.remove(os.path.join(folder, p))
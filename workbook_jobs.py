@@ -0,0 +1,152 @@
+import io
+import os
+import pickle
+import queue
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+#=== Workbook jobs ===
+#Parsing a workbook (pandas / openpyxl) holds the GIL, so doing it in the Streamlit script
+#thread stalls that session and every other one in the process. handle_upload instead
+#submits the heavy steps to worker processes shared by all sessions of the process:
+#  check_job    validate against the test's rules + a preview of the first rows
+#  convert_job  Parquet conversion + dataset append (workbook_ingest)
+#Jobs get the workbook bytes (the upload is already in memory), so a worker never reads
+#the NAS back. There is one worker per core by default (RE_PN_LAB_WORKBOOK_WORKERS), so
+#several large uploads are parsed in parallel. Sessions keep only the job id and poll
+#job_result() until the job is done. Workers are started when jobs need them; only
+#WORKBOOK_WARM_WORKERS of them are started ahead (warm_pool, from the login page), since
+#each one imports pandas and openpyxl.
+#Workers are started as "python -m workbook_worker", not with multiprocessing: its spawn
+#method would re-run the app script in every worker (Streamlit makes it __main__) and its
+#fork method would copy the multi-threaded server. Each job runs on a thread here that
+#hands it to an idle worker over the worker's stdin / stdout and waits for the answer;
+#a worker that dies (out of memory...) fails only its job and is replaced by the next one.
+
+WORKBOOK_WORKERS = int(os.environ.get("RE_PN_LAB_WORKBOOK_WORKERS", "0")) or os.cpu_count() or 1
+WORKBOOK_WARM_WORKERS = min(int(os.environ.get("RE_PN_LAB_WORKBOOK_WARM_WORKERS", "1")), WORKBOOK_WORKERS)
+PREVIEW_ROWS = 20
+JOB_RETENTION = 3600  # seconds a finished job's result stays available
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+_executor = None  # threads waiting on the workers, at most WORKBOOK_WORKERS jobs at once
+_idle = queue.LifoQueue()  # worker processes without a job
+_jobs = {}  # job id -> (submitted at, Future)
+_lock = threading.Lock()
+
+def _check(data: bytes, test: str):
+    #runs in a worker process: (data rows checked, preview DataFrame)
+    import pandas as pd
+    from workbook_validation import load_rules, rules_sheet, validate_workbook
+    rules = load_rules(test) or {}
+    rows = validate_workbook(io.BytesIO(data), test, rules)
+    preview = pd.read_excel(io.BytesIO(data), sheet_name=rules_sheet(rules), nrows=PREVIEW_ROWS)
+    return rows, preview
+
+def _convert(data: bytes, folder: str, name: str, provenance, test):
+    #runs in a worker process: same result as workbook_ingest.ingest_workbook, on the
+    #sheet check_job validated for the test
+    from workbook_ingest import ingest_workbook
+    from workbook_validation import load_rules, rules_sheet
+    sheet = rules_sheet(load_rules(test)) if test is not None else 0
+    return ingest_workbook(io.BytesIO(data), folder, name, provenance=provenance, sheet=sheet)
+
+def _start_worker():
+    #same Python, same working directory (relative paths keep their meaning); this folder
+    #goes on the path so the worker finds workbook_worker and the job functions
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [HERE, os.environ.get("PYTHONPATH")])))
+    return subprocess.Popen([sys.executable, "-m", "workbook_worker"],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+
+def _call(worker, fn, args):
+    #runs fn(*args) in the worker process: (True, result) or (False, exception raised);
+    #the worker is killed if it cannot answer, or if its answer cannot be read back (an
+    #exception class whose __init__ takes other arguments fails to unpickle with TypeError):
+    #either way its pipe is in an unknown state
+    try:
+        pickle.dump((fn, args), worker.stdin, protocol=pickle.HIGHEST_PROTOCOL)
+        worker.stdin.flush()
+        return pickle.load(worker.stdout)
+    except Exception as e:
+        worker.kill()
+        worker.wait()
+        raise BrokenProcessPool(f"the workbook worker process stopped or sent an unreadable answer: {e}") from e
+
+def _release(worker):
+    if _idle.qsize() < WORKBOOK_WORKERS:
+        _idle.put(worker)
+    else:
+        worker.stdin.close()  # more idle workers than needed: this one exits
+
+def _run(fn, *args):
+    #runs on an executor thread
+    try:
+        worker = _idle.get_nowait()
+    except queue.Empty:
+        worker = _start_worker()
+    ok, value = _call(worker, fn, args)  # a worker that broke is not given back
+    _release(worker)
+    if not ok:
+        raise value
+    return value
+
+def _submit(fn, *args) -> str:
+    global _executor
+    with _lock:
+        now = time.time()
+        for job_id in [j for j, (at, f) in _jobs.items() if f.done() and now - at > JOB_RETENTION]:
+            del _jobs[job_id]
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKBOOK_WORKERS, thread_name_prefix="workbook-job")
+        future = _executor.submit(_run, fn, *args)
+        job_id = uuid.uuid4().hex
+        _jobs[job_id] = (now, future)
+        return job_id
+
+def _warm():
+    #runs in a worker process: the imports every job needs, ahead of the first job
+    import openpyxl, pandas, workbook_ingest, workbook_validation
+
+def warm_pool():
+    #starts WORKBOOK_WARM_WORKERS workers before the first upload needs them (prewarm);
+    #they import pandas / openpyxl while the user is still logging in
+    workers = [_start_worker() for _ in range(WORKBOOK_WARM_WORKERS - _idle.qsize())]
+    for worker in workers:
+        try:
+            _call(worker, _warm, ())
+        except BrokenProcessPool:
+            continue
+        _release(worker)
+
+def check_job(data: bytes, test: str) -> str:
+    return _submit(_check, data, test)
+
+def convert_job(data: bytes, folder: str, name: str, provenance=None, test=None) -> str:
+    #test = the test the upload was checked for, so the same sheet is converted
+    return _submit(_convert, data, folder, name, provenance, test)
+
+def job_result(job_id: str):
+    #("running", None), ("done", result) or ("failed", exception)
+    entry = _jobs.get(job_id)
+    if entry is None:
+        return "failed", LookupError("job no longer available (the app was restarted)")
+    future = entry[1]
+    if not future.done():
+        return "running", None
+    error = future.exception()
+    if error is not None:
+        return "failed", error
+    return "done", future.result()
+
+def wait_job(job_id: str, timeout=None):
+    #job_result that blocks until the job has finished (or timeout seconds have passed);
+    #for worker threads such as batch uploads, never for the Streamlit script thread
+    entry = _jobs.get(job_id)
+    if entry is not None:
+        wait([entry[1]], timeout)
+    return job_result(job_id)
@@ -0,0 +1,114 @@
+import json
+import os
+from datetime import date, datetime, time
+
+#=== Upload validation ===
+#Checks an uploaded workbook before anything is written, so a bad file is turned away
+#at the upload instead of being found when Spotfire chokes on it.
+#The workbook is opened with openpyxl in read-only mode: rows are streamed one at a
+#time (memory stays flat however large the file is) and the first violation stops the
+#check, so a bad upload is rejected after reading just enough of it to know.
+#Rules per test come from WORKBOOK_SCHEMAS (a JSON file, RE_PN_LAB_WORKBOOK_SCHEMAS):
+#  {"TRH": {"sheet": "Data",                         <- optional, default = first sheet
+#           "columns": [{"name": "Serial", "type": "string", "required": true},
+#                       {"name": "Temp", "type": "double"},
+#                       {"name": "Start", "type": "timestamp"}],
+#           "allow_extra_columns": true}}             <- optional, default true
+#Types are the ones workbook_ingest writes: double, timestamp, bool, string. "required"
+#columns may not have empty cells; other empty cells are fine. The header is the first row.
+#A test without an entry (or no file at all) only gets the basic check: the workbook
+#opens and its sheet has a header row.
+#workbook_schemas.example.json has an entry for every test of the apps (the TRH one is
+#the layout benchmark.py generates): copy it to workbook_schemas.json and fill in the
+#columns of each test. The sheet checked here is also the one converted for Spotfire
+#(workbook_ingest) and shown as the preview.
+
+WORKBOOK_SCHEMAS = os.environ.get(
+    "RE_PN_LAB_WORKBOOK_SCHEMAS",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "workbook_schemas.json"),
+)
+
+class WorkbookError(ValueError):
+    pass
+
+def load_rules(test: str, path=WORKBOOK_SCHEMAS):
+    #the rules for one test, or None if it has none
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f).get(test)
+    except FileNotFoundError:
+        return None
+
+def rules_sheet(rules):
+    #sheet the rules apply to, as pandas' sheet_name: its name, or 0 for the first sheet
+    sheet = (rules or {}).get("sheet")
+    return 0 if sheet is None else sheet
+
+def _matches(value, type_name: str) -> bool:
+    if type_name == "double":
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if type_name == "timestamp":
+        return isinstance(value, (datetime, date, time))
+    if type_name == "bool":
+        return isinstance(value, bool)
+    return True  # string: anything can be read as text
+
+def validate_workbook(src, test: str, rules=None):
+    #raises WorkbookError on the first problem; returns the number of data rows checked
+    #src = the uploaded file (file object), left rewound for the save that follows
+    from openpyxl import load_workbook
+    if rules is None:
+        rules = load_rules(test) or {}
+    if hasattr(src, "seek"):
+        src.seek(0)
+    try:
+        wb = load_workbook(src, read_only=True, data_only=True)
+    except Exception as e:
+        raise WorkbookError(f"not a readable .xlsx workbook ({e})") from None
+    try:
+        sheet_name = rules.get("sheet")
+        if sheet_name is None:
+            ws = wb.worksheets[0]
+        elif sheet_name in wb.sheetnames:
+            ws = wb[sheet_name]
+        else:
+            raise WorkbookError(f"sheet '{sheet_name}' is missing (found: {', '.join(wb.sheetnames)})")
+        rows = ws.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None or all(cell is None for cell in header):
+            raise WorkbookError(f"sheet '{ws.title}' has no header row")
+        header = [None if cell is None else str(cell).strip() for cell in header]
+        columns = rules.get("columns", [])
+        positions = {}
+        for column in columns:
+            if column["name"] not in header:
+                raise WorkbookError(f"sheet '{ws.title}': column '{column['name']}' is missing")
+            positions[column["name"]] = header.index(column["name"])
+        if not rules.get("allow_extra_columns", True):
+            expected = {column["name"] for column in columns}
+            extra = [name for name in header if name is not None and name not in expected]
+            if extra:
+                raise WorkbookError(f"sheet '{ws.title}': unexpected column '{extra[0]}'")
+        checked = 0
+        for row_number, row in enumerate(rows, start=2):
+            if all(cell is None for cell in row):
+                continue  # blank line
+            for column in columns:
+                position = positions[column["name"]]
+                value = row[position] if position < len(row) else None
+                if value is None or value == "":
+                    if column.get("required"):
+                        raise WorkbookError(
+                            f"sheet '{ws.title}' row {row_number}: '{column['name']}' is empty"
+                        )
+                elif not _matches(value, column.get("type", "string")):
+                    raise WorkbookError(
+                        f"sheet '{ws.title}' row {row_number}: '{column['name']}' should be "
+                        f"{column['type']}, got {value!r}"
+                    )
+            checked += 1
+        return checked
+    finally:
+        wb.close()
+        if hasattr(src, "seek"):
+            src.seek(0)
@@ -0,0 +1,45 @@
+import os
+import pickle
+import sys
+
+#=== Workbook worker process ===
+#Entry point of the worker processes workbook_jobs starts:
+#  python -m workbook_worker
+#so a worker's __main__ is this module and never the app script (Streamlit makes the
+#script __main__, and multiprocessing's spawn would re-run it in every worker: file
+#server, prewarm, login page...). Nothing here imports the app.
+#A worker reads pickled (function, args) requests from stdin, one after another, and
+#answers each with a pickled (True, result) or (False, exception) on stdout. It exits
+#when stdin is closed or its answer can no longer be delivered, i.e. when the app
+#process is gone.
+
+def _answer(out, ok: bool, value):
+    try:
+        data = pickle.dumps((ok, value), protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception as e:  # result or exception that cannot be pickled
+        data = pickle.dumps((False, RuntimeError(f"{type(value).__name__}: {value} ({e})")))
+    out.write(data)
+    out.flush()
+
+def main():
+    requests = sys.stdin.buffer
+    #answers go to a private copy of stdout; fd 1 then points at stderr, so a library
+    #printing something cannot corrupt the pipe
+    out = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    while True:
+        try:
+            fn, args = pickle.load(requests)
+        except EOFError:
+            return
+        try:
+            result = (True, fn(*args))
+        except Exception as e:
+            result = (False, e)
+        try:
+            _answer(out, *result)
+        except OSError:  # BrokenPipeError: nobody is waiting for the answer any more
+            return
+
+if __name__ == "__main__":
+    main()